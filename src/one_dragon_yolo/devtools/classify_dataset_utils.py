@@ -4,15 +4,22 @@ import shutil
 
 from tqdm import tqdm
 
+from one_dragon_yolo.devtools import os_utils
+
 
 def split_dataset(
         raw_dataset_dir: str,
         split_dataset_dir: str,
-        split_weights=(0.9, 0.1)
+        split_weights=(0.9, 0.1),
+        strategy: str = 'hardlink',
 ):
     """
     分隔数据集 每个分类都保持相同的比例
+    默认使用硬链接 不占用额外的硬盘空间 重新划分几乎不需要时间 跨盘时自动改为复制
+    :param strategy: 放置图片的方式 见 os_utils.MATERIALIZE_STRATEGIES
     """
+    materializer = os_utils.FileMaterializer(strategy)
+
     new_train_dir_path = os.path.join(split_dataset_dir, 'train')
     shutil.rmtree(new_train_dir_path, ignore_errors=True)
     os.mkdir(new_train_dir_path)
@@ -21,7 +28,7 @@ def split_dataset(
     shutil.rmtree(new_val_dir_path, ignore_errors=True)
     os.mkdir(new_val_dir_path)
 
-    for class_dir_name in tqdm(os.listdir(raw_dataset_dir), desc='Copying by class'):
+    for class_dir_name in tqdm(os.listdir(raw_dataset_dir), desc='Splitting by class'):
         if class_dir_name[0] == '.':
             # 忽略隐藏文件夹 可能是 .git 之类的
             continue
@@ -42,16 +49,18 @@ def split_dataset(
         train_new_class_dir_path = os.path.join(new_train_dir_path, class_dir_name)
         shutil.rmtree(train_new_class_dir_path, ignore_errors=True)
         os.mkdir(train_new_class_dir_path)
-        for image_name in tqdm(old_class_train_image_name_list, desc='Copying to train'):
+        for image_name in tqdm(old_class_train_image_name_list, desc='Linking to train'):
             old_image_path = os.path.join(old_class_dir_path, image_name)
             new_image_path = os.path.join(train_new_class_dir_path, image_name)
-            shutil.copyfile(old_image_path, new_image_path)
+            materializer.materialize(old_image_path, new_image_path)
 
         # val目录下 创建新的分类文件夹 并复制图片
         val_new_class_dir_path = os.path.join(new_val_dir_path, class_dir_name)
         shutil.rmtree(val_new_class_dir_path, ignore_errors=True)
         os.mkdir(val_new_class_dir_path)
-        for image_name in tqdm(old_class_val_image_name_list, desc='Copying to val'):
+        for image_name in tqdm(old_class_val_image_name_list, desc='Linking to val'):
             old_image_path = os.path.join(old_class_dir_path, image_name)
             new_image_path = os.path.join(val_new_class_dir_path, image_name)
-            shutil.copyfile(old_image_path, new_image_path)
\ No newline at end of file
+            materializer.materialize(old_image_path, new_image_path)
+
+    print(f'划分完成 {materializer.summary()}')
\ No newline at end of file
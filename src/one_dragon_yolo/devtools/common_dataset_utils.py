@@ -3,12 +3,12 @@ import re
 import shutil
 from typing import Optional, List, Set
 
-import cv2
 import numpy as np
-import pandas as pd
 from tqdm import tqdm
 
-from one_dragon_yolo.devtools import cv2_utils, ultralytics_utils, label_studio_utils
+from one_dragon_yolo.devtools import (dataset_build_utils, hamming_utils, image_hash_utils, label_stats_utils,
+                                      mosaic_utils, os_utils, ultralytics_utils, label_studio_utils, yolo_label_utils)
+from one_dragon_yolo.devtools.hash_cache_utils import ImageHashCache
 
 _BASE_DETECT = 'base-detect'
 
@@ -32,13 +32,6 @@ def get_dataset_images_dir(dataset_name: str) -> str:
     return dir_path
 
 
-def read_label_txt(txt_path) -> pd.DataFrame:
-    """
-    读取一个标签文件
-    """
-    return pd.read_csv(txt_path, sep=' ', header=None, encoding='utf-8', names=['idx', 'x', 'y', 'w', 'h'])
-
-
 def clear_dataset_labels(dataset_name: str):
     """
     清除一个dataset的全部标签文件
@@ -100,24 +93,23 @@ def init_labels_bk(dataset_name: str,
         if not label_txt.endswith('.txt'):
             continue
         label_txt_path = os.path.join(source_labels_dir, label_txt)
-        df = read_label_txt(label_txt_path)
+        labels = yolo_label_utils.read_label_txt(label_txt_path)
 
-        # 转化成新的下标
-        df['idx'] = df['idx'].map(id_old_2_new)
-        df.dropna(inplace=True)
-        df['idx'] = df['idx'].astype(int)
+        # 转化成新的下标 去掉不使用的标签
+        labels = yolo_label_utils.remap_classes(labels, id_old_2_new)
 
-        if len(df) > 0:  # 过滤之后 还有标签的才保存
+        if len(labels) > 0:  # 过滤之后 还有标签的才保存
             new_label_txt_path = os.path.join(target_labels_dir, label_txt)
-            df.to_csv(new_label_txt_path, sep=' ', index=False, header=False)
+            yolo_label_utils.write_label_txt(new_label_txt_path, labels)
 
     return labels_to_use_real
 
 
-def init_dataset_images(dataset_name: str):
+def init_dataset_images(dataset_name: str, strategy: str = 'hardlink'):
     """
     按照使用的标签 复制原图到数据集中
     未做数据增强
+    :param strategy: 放置原图的方式 见 os_utils.MATERIALIZE_STRATEGIES 默认使用硬链接 跨盘时自动改为复制
     """
     labels_dir = get_labels_dir(dataset_name)
     label_case_ids = set()  # 有标签的样例
@@ -138,6 +130,7 @@ def init_dataset_images(dataset_name: str):
     shutil.rmtree(images_dir)
     os.mkdir(images_dir)
 
+    materializer = os_utils.FileMaterializer(strategy)
     raw_img_dir = label_studio_utils.get_raw_images_dir()
     for prefix in os.listdir(raw_img_dir):
         sub_img_dir = os.path.join(raw_img_dir, prefix)
@@ -157,10 +150,13 @@ def init_dataset_images(dataset_name: str):
 
             old_path = os.path.join(sub_img_dir, img_name)
             new_path = os.path.join(images_dir, img_name)
-            shutil.copyfile(old_path, new_path)
+            materializer.materialize(old_path, new_path)
+
+    print(f'原图放置完成 {materializer.summary()}')
 
 
-def init_dataset_images_and_labels(dataset_name: str, img_size: int = 2176) -> bool:
+def init_dataset_images_and_labels(dataset_name: str, img_size: int = 2176, num_workers: int = 1,
+                                   force_rebuild: bool = False, image_format: str = 'png') -> Optional[List[str]]:
     """
     初始化一个数据集的图片和标签
     原图是 1920*1080 会使用两张图片合并成 
@@ -168,87 +164,57 @@ def init_dataset_images_and_labels(dataset_name: str, img_size: int = 2176) -> b
     - 2208*2208 (2208=32*69)
     同时将对应标签合并
     需要先使用 init_labels_bk 初始化原标签文件夹 labels_bk
+    按生成清单增量生成 只重新生成原图或标签内容变化了的图片 沿用上一次的配对
     :param dataset_name: 数据集名称
     :param img_size: 两张图片合并后的图片大小 需要>=1080*2=2160. 需要是32的倍数
-    :return:
+    :param num_workers: 生成图片的并行进程数 1 表示在当前进程中逐张生成
+    :param force_rebuild: 是否忽略生成清单 全部重新生成
+    :param image_format: 图片的保存格式 见 mosaic_utils.MOSAIC_IMAGE_FORMATS
+    :return: 生成的全部图片文件名 图片大小不合法时返回 None
     """
     if (img_size < 1080 * 2) or (img_size % 32 != 0):
-        return False
+        return None
     base_img_dir = get_dataset_images_dir(_BASE_DETECT)
 
     labels_bk_dir = get_labels_dir(dataset_name, bk=True)
     labels_dir = get_labels_dir(dataset_name, bk=False)
     images_dir = get_dataset_images_dir(dataset_name)
 
-    label_txt_names = os.listdir(labels_bk_dir)
-    total_cnt = len(label_txt_names)
-    idx = 0
-
-    while idx < total_cnt:
-        case1 = label_txt_names[idx][:-4]
-
-        img1_path = os.path.join(base_img_dir, '%s.png' % case1)
-        img1 = cv2.imread(img1_path)
-        label1_path = os.path.join(labels_bk_dir, label_txt_names[idx])
-        label1_df = read_label_txt(label1_path)
-
-        if idx + 1 < total_cnt:  # 跟下一张合并
-            case2 = label_txt_names[idx + 1][:-4]
-            img2_path = os.path.join(base_img_dir, '%s.png' % case2)
-            img2 = cv2.imread(img2_path)
-            label2_path = os.path.join(labels_bk_dir, label_txt_names[idx + 1])
-            label2_df = read_label_txt(label2_path)
-        elif idx > 0:  # 跟上一张合并 只有总数=奇数的最后一张会触发
-            case2 = label_txt_names[idx - 1][:-4]
-            img2_path = os.path.join(base_img_dir, '%s.png' % case2)
-            img2 = cv2.imread(img2_path)
-            label2_path = os.path.join(labels_bk_dir, label_txt_names[idx - 1])
-            label2_df = read_label_txt(label2_path)
-        else:  # 跟自己合并 只有总数=1会触发
-            case2 = case1
-            img2 = img1.copy()
-            label2_df = label1_df.copy()
-
-        idx += 2
-
-        height = img1.shape[0]
-        width = img1.shape[1]
-        radius = img_size
-
-        save_img = np.full((radius, radius, 3), 114, dtype=np.uint8)
-        save_img[0:height, 0:width, :] = img1
-        save_img[height:height+height, 0:width, :] = img2
-
-        label1_df['x'] *= width
-        label1_df['y'] *= height
-        label1_df['w'] *= width
-        label1_df['h'] *= height
-
-        label2_df['x'] *= width
-        label2_df['y'] *= height
-        label2_df['y'] += height
-        label2_df['w'] *= width
-        label2_df['h'] *= height
-
-        save_label_df = pd.concat([label1_df, label2_df])
-        save_label_df['x'] /= radius
-        save_label_df['y'] /= radius
-        save_label_df['w'] /= radius
-        save_label_df['h'] /= radius
-
-        save_img_path = os.path.join(images_dir, '%s-%s.png' % (case1, case2))
-        cv2.imwrite(save_img_path, save_img)
-
-        save_label_path = os.path.join(labels_dir, '%s-%s.txt' % (case1, case2))
-        save_label_df.to_csv(save_label_path, sep=' ', index=False, header=False)
-
-    return True
+    dataset_dir = ultralytics_utils.get_dataset_dir(dataset_name)
+    image_ext = mosaic_utils.get_image_ext(image_format)
+    params = {'builder': 'sequential_pairing', 'img_size': img_size, 'image_format': image_format}
+    manifest, reusable = dataset_build_utils.load_manifest(
+        dataset_dir, params, force_rebuild=force_rebuild, output_dirs=[images_dir, labels_dir])
+
+    case_ids = sorted(label_txt_name[:-4] for label_txt_name in os.listdir(labels_bk_dir)
+                      if label_txt_name.endswith('.txt'))
+
+    # 相邻的两张合并 总数为奇数时最后一张跟上一张合并 只有一张时跟自己合并
+    previous_pairs = manifest.get_pairs() if reusable else []
+    pair_jobs: List[tuple] = []
+    for case1, case2 in mosaic_utils.reuse_sequential_pairing(case_ids, previous_pairs):
+        pair_jobs.append(((case1, case2), mosaic_utils.MosaicJob(
+            os.path.join(base_img_dir, '%s.png' % case1), os.path.join(labels_bk_dir, '%s.txt' % case1),
+            os.path.join(base_img_dir, '%s.png' % case2), os.path.join(labels_bk_dir, '%s.txt' % case2),
+            os.path.join(images_dir, '%s-%s%s' % (case1, case2, image_ext)),
+            os.path.join(labels_dir, '%s-%s.txt' % (case1, case2)),
+            img_size,
+            image_format=image_format,
+        )))
+
+    image_names = mosaic_utils.run_incremental_mosaic_jobs(
+        manifest, pair_jobs, images_dir, labels_dir, num_workers=num_workers)
+    manifest.save(dataset_build_utils.get_manifest_path(dataset_dir))
+    return image_names
 
 
 def prepare_dateset(dataset_name: str,
                     split_weights=(0.9, 0.1, 0),
                     objects_to_use: Optional[List[str]] = None,
-                    labels_version: str = 'v1'):
+                    labels_version: str = 'v1',
+                    num_workers: int = 1,
+                    force_rebuild: bool = False,
+                    image_format: str = 'png'):
     """
     从基础数据集中 生成一个子数据集
 
@@ -258,36 +224,34 @@ def prepare_dateset(dataset_name: str,
     3. 划分数据集
     4. 写入 dataset.yaml 同时剔除标签的中文
 
+    再次生成时 只重新生成原图或过滤后的标签变化了的图片
+
     :param dataset_name: 子数据集名称
     :param split_weights: 自动划分数据集的比例
     :param objects_to_use: 限定使用的内容
     :param labels_version: 标签版本
+    :param num_workers: 生成图片的并行进程数
+    :param force_rebuild: 是否忽略生成清单 全部重新生成
+    :param image_format: 图片的保存格式 见 mosaic_utils.MOSAIC_IMAGE_FORMATS
     """
     target_dataset_dir = ultralytics_utils.get_dataset_dir(dataset_name)
-    if os.path.exists(target_dataset_dir):
-        shutil.rmtree(target_dataset_dir)
-    os.mkdir(target_dataset_dir)
 
     # 初始化标签
     labels_to_use_real = init_labels_bk(dataset_name, objects_to_use=objects_to_use, labels_version=labels_version)
 
     # 初始化图片
-    init_dataset_images_and_labels(dataset_name)
+    image_names = init_dataset_images_and_labels(dataset_name, num_workers=num_workers,
+                                                 force_rebuild=force_rebuild, image_format=image_format)
+    if image_names is None:
+        return
 
-    # 划分数据集
-    autosplit(path=os.path.join(target_dataset_dir, 'images'), weights=split_weights, annotated_only=True)
+    # 划分数据集 按图片名称稳定划分
+    dataset_build_utils.write_split_lists(target_dataset_dir, image_names, split_weights)
 
     # 保存dataset.yaml
-    with open(os.path.join(target_dataset_dir, 'dataset.yaml'), 'w', encoding='utf-8') as file:
-        file.write('path: %s\n' % dataset_name)
-        file.write('train: autosplit_train.txt\n')
-        file.write('val: autosplit_val.txt\n')
-        file.write('test: autosplit_test.txt\n')
-        file.write('names:\n')
-        label_idx = 0
-        for label in labels_to_use_real:
-            file.write('  %d: %s\n' % (label_idx, re.sub(r'[^a-zA-Z0-9-]', '', label).replace('--', '-')))
-            label_idx += 1
+    dataset_build_utils.write_dataset_yaml(
+        target_dataset_dir, dataset_name,
+        [re.sub(r'[^a-zA-Z0-9-]', '', label).replace('--', '-') for label in labels_to_use_real])
 
 
 def count_labels(dataset_name: str, label_version: str = 'v1') -> dict[str, int]:
@@ -299,18 +263,11 @@ def count_labels(dataset_name: str, label_version: str = 'v1') -> dict[str, int]
     for idx, row in labels_df.iterrows():
         idx_2_label[int(row[label_version][:4]) - 1] = row[label_version]
 
-    labels_dir = get_labels_dir(dataset_name)
+    store = label_stats_utils.load_labels(get_labels_dir(dataset_name))
+    class_cnt = label_stats_utils.count_boxes_per_class(store)
     labels_count: dict[str, int] = {}
-    for label_txt in os.listdir(labels_dir):
-        if not label_txt.endswith('.txt'):
-            continue
-        txt_df = read_label_txt(os.path.join(labels_dir, label_txt))
-        for idx, row in txt_df.iterrows():
-            label = idx_2_label[int(row['idx'])]
-            if label not in labels_count:
-                labels_count[label] = 1
-            else:
-                labels_count[label] = labels_count[label] + 1
+    for idx in np.flatnonzero(class_cnt).tolist():
+        labels_count[idx_2_label[idx]] = int(class_cnt[idx])
 
     return labels_count
 
@@ -368,19 +325,11 @@ def clear_raw_images_without_label(dataset_name: str, confirm_delete: bool = Fal
 def check_no_self_label_cases(dataset_name: str = 'base-detect') -> List[str]:
     """
     检查并返回图片中没有自身标签的样例 大概率是标注错了
+    样例id的前4位是自身标签的编号 从1开始
     """
-    labels_dir = get_labels_dir(dataset_name)
-
-    without_self_label_list = []
-    for label_txt_name in os.listdir(labels_dir):
-        if not label_txt_name.endswith('.txt'):
-            continue
-        idx = int(label_txt_name[:4])
-        txt_df = read_label_txt(os.path.join(labels_dir, label_txt_name))
-        if (idx - 1) not in txt_df['idx'].unique():
-            without_self_label_list.append(label_txt_name)
-
-    return without_self_label_list
+    store = label_stats_utils.load_labels(get_labels_dir(dataset_name))
+    expected_cls = np.array([int(data_id[:4]) - 1 for data_id in store.data_ids], dtype=np.int64)
+    return ['%s.txt' % data_id for data_id in label_stats_utils.find_missing_expected_class(store, expected_cls)]
 
 
 def remove_similar_image(
@@ -388,25 +337,56 @@ def remove_similar_image(
         keep_cnt: Optional[int] = None,
         keep_percent: Optional[float] = None,
         similarity_threshold: Optional[float] = None,
+        use_hash_cache: bool = True,
+        window_size: int = 5,
 ) -> None:
     """
-    在同一个文件夹中 对比相邻两张图片的相似度 然后删除相似度较高的
+    在同一个文件夹中 按拍摄时间排序后 对比每张图片与前面 window_size 张图片的相似度 然后删除相似度较高的
+    录制的连续画面中 重复的画面不一定相邻 因此与一个窗口内的图片比较 取最高的相似度
+
+    每张图片只读取和计算一次哈希
+    use_hash_cache=True 时 哈希会缓存在文件夹中 未变化的图片不需要重新读取
+
+    Args:
+        image_dir: 图片文件夹
+        keep_cnt: 最多保留的数量
+        keep_percent: 最多保留的比例
+        similarity_threshold: 只删除相似度不低于这个值的图片
+        use_hash_cache: 是否使用文件夹中的哈希缓存
+        window_size: 向前比较的图片数量 1 表示只与前一张比较
     """
     if keep_cnt is None and keep_percent is None and similarity_threshold is None:
         raise ValueError('keep_cnt or keep_percent or similarity_threshold must be set')
 
-    cal_similar_list: list[tuple[str, float]] = []
-    last_image = None
-    for image_name in tqdm(os.listdir(image_dir), '计算相似度'):
-        image_path = os.path.join(image_dir, image_name)
-        image = cv2.imread(image_path)
-        if last_image is not None:
-            similar = cv2_utils.calculate_phash_similarity(last_image, image)
-            cal_similar_list.append([image_path, similar])
-        else:
-            cal_similar_list.append([image_path, 0])
+    hash_cache = ImageHashCache(image_dir) if use_hash_cache else None
+
+    # 按修改时间 (即截图保存的时间) 排序 时间相同时按文件名
+    entries = [
+        entry for entry in os.scandir(image_dir)
+        if entry.is_file() and not entry.name.startswith('.')  # 忽略隐藏文件 包括哈希缓存
+    ]
+    entries.sort(key=lambda entry: (entry.stat().st_mtime_ns, entry.name))
+
+    image_path_list: list[str] = []
+    hash_list: list[int] = []
+    for entry in tqdm(entries, '计算哈希'):
+        image_path = entry.path
+        hash_value = hash_cache.get(image_path, 'phash_fast') if hash_cache is not None else None
+        if hash_value is None:
+            # 直接解码成缩小的灰度图计算哈希
+            hash_value = image_hash_utils.calculate_phash_file(image_path)
+            if hash_value is None:  # 读取失败
+                continue
+            if hash_cache is not None:
+                hash_cache.put(image_path, hash_value, 'phash_fast')
+        image_path_list.append(image_path)
+        hash_list.append(hash_value)
 
-        last_image = image
+    # 向量化计算每张图片与前面窗口内图片的最高相似度 第一张图片的相似度为0
+    hashes = np.array(hash_list, dtype=np.uint64)
+    similar_arr = hamming_utils.distance_to_similarity(
+        hamming_utils.window_min_distance(hashes, window_size).astype(np.float64))
+    cal_similar_list: list[tuple[str, float]] = list(zip(image_path_list, similar_arr.tolist()))
 
     # 按相似度排序 从小到大
     cal_similar_list.sort(key=lambda x: x[1])
@@ -417,8 +397,12 @@ def remove_similar_image(
         if similarity_threshold is not None and similar < similarity_threshold:
             continue
 
+        # 只设置了相似度阈值时 超过阈值的都删除
+        if keep_cnt is None and keep_percent is None:
+            os.remove(image_path)
+            delete_cnt += 1
         # 保留数量达到要求后 就删除
-        if keep_cnt is not None and current_cnt >= keep_cnt:
+        elif keep_cnt is not None and current_cnt >= keep_cnt:
             os.remove(image_path)
             delete_cnt += 1
         elif keep_percent is not None and current_cnt >= len(cal_similar_list) * keep_percent:
@@ -426,5 +410,12 @@ def remove_similar_image(
             delete_cnt += 1
         else:
             current_cnt += 1
+            continue
+
+        if hash_cache is not None:
+            hash_cache.remove(image_path)
+
+    if hash_cache is not None:
+        hash_cache.close()
 
     print('总共删除 ', delete_cnt)
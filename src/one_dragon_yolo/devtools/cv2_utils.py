@@ -1,7 +1,43 @@
 import cv2
-import imagehash
 import numpy as np
-from PIL import Image
+
+from one_dragon_yolo.devtools import hamming_utils, image_hash_utils
+
+
+def calculate_phash(image: np.ndarray) -> int:
+    """
+    计算一张图片的感知哈希 (PHash)，以64位整数返回，便于打包成 uint64 数组批量比较。
+    直接从 BGR 转成缩小的灰度图再计算，不经过 RGB 转换，误差见 image_hash_utils。
+
+    Args:
+        image (np.ndarray): OpenCV 格式的图片 (MatLike)。
+
+    Returns:
+        int: 64位感知哈希。
+    """
+    return int(calculate_phash_array([image])[0])
+
+
+def calculate_phash_array(images: list[np.ndarray]) -> np.ndarray:
+    """
+    计算多张图片的感知哈希，打包成连续的 uint64 数组。
+    每张图片先转成 32*32 的灰度图，再一起做向量化的 DCT。
+
+    Args:
+        images (list[np.ndarray]): OpenCV 格式的图片列表。
+
+    Returns:
+        np.ndarray: 形状为 (N,) 的 uint64 数组。
+    """
+    tiles = [
+        image_hash_utils.gray_to_hash_tile(
+            image_hash_utils.reduce_gray_for_hash(image_hash_utils.bgr_to_gray(image))
+        )
+        for image in images
+    ]
+    if len(tiles) == 0:
+        return np.zeros(0, dtype=np.uint64)
+    return image_hash_utils.phash_batch(np.stack(tiles))
 
 
 def calculate_phash_similarity(image1: np.ndarray, image2: np.ndarray) -> float:
@@ -10,6 +46,9 @@ def calculate_phash_similarity(image1: np.ndarray, image2: np.ndarray) -> float:
     通过计算哈希值的汉明距离来判断相似性。
     相似度值介于 0 到 1 之间，1 表示完全相同（汉明距离为 0）。
 
+    需要比较多张图片时，应先用 calculate_phash_array 对每张图片只计算一次哈希，
+    再用 hamming_utils 中的向量化函数计算距离。
+
     Args:
         image1 (np.ndarray): 第一张 OpenCV 格式的图片 (MatLike)。
         image2 (np.ndarray): 第二张 OpenCV 格式的图片 (MatLike)。
@@ -18,23 +57,50 @@ def calculate_phash_similarity(image1: np.ndarray, image2: np.ndarray) -> float:
         float: 基于 PHash 汉明距离的相似度值。
                相似度 = 1 - (汉明距离 / 哈希位长)。
     """
-    # 将 OpenCV 图像转换为 PIL 图像，因为 imagehash 库更常用 PIL 图像
-    # 注意：cv2.cvtColor 只是示例，如果图像已经是灰度图则不需要
-    image1_pil = Image.fromarray(cv2.cvtColor(image1, cv2.COLOR_BGR2RGB))
-    image2_pil = Image.fromarray(cv2.cvtColor(image2, cv2.COLOR_BGR2RGB))
-
-    # 计算感知哈希
-    hash1 = imagehash.phash(image1_pil)
-    hash2 = imagehash.phash(image2_pil)
-
-    # 计算汉明距离
-    hamming_distance = hash1 - hash2
-    
-    # 哈希的位长 (通常是 64 位，即 8*8)
-    # 对于 imagehash.phash，默认是 8x8 的哈希，所以位长是 64
-    hash_bits = hash1.hash.size * hash1.hash.itemsize * 8 # itemsize for byte length, *8 for bits
-
-    # 计算相似度 (1 表示完全相同，0 表示完全不同)
-    similarity = 1 - (hamming_distance / hash_bits)
-    
-    return similarity
\ No newline at end of file
+    hashes = calculate_phash_array([image1, image2])
+    hamming_distance = int(hamming_utils.popcount64(hashes[0] ^ hashes[1]))
+    return hamming_utils.distance_to_similarity(hamming_distance)
+
+
+def calculate_mse(gray1: np.ndarray, gray2: np.ndarray) -> float:
+    """
+    计算两张相同大小灰度图的均方误差 (MSE)。
+
+    Args:
+        gray1 (np.ndarray): 第一张灰度图。
+        gray2 (np.ndarray): 第二张灰度图。
+
+    Returns:
+        float: 均方误差，0 表示完全相同，最大为 255 的平方。
+    """
+    diff = gray1.astype(np.float32) - gray2.astype(np.float32)
+    return float(np.mean(diff * diff))
+
+
+def calculate_ssim(gray1: np.ndarray, gray2: np.ndarray) -> float:
+    """
+    计算两张相同大小灰度图的结构相似度 (SSIM)。
+    使用 11*11、sigma=1.5 的高斯窗口，常数与原论文一致。
+
+    Args:
+        gray1 (np.ndarray): 第一张灰度图 (0-255)。
+        gray2 (np.ndarray): 第二张灰度图 (0-255)。
+
+    Returns:
+        float: 平均 SSIM，1 表示完全相同。
+    """
+    c1 = (0.01 * 255) ** 2
+    c2 = (0.03 * 255) ** 2
+    x = gray1.astype(np.float32)
+    y = gray2.astype(np.float32)
+
+    def blur(image: np.ndarray) -> np.ndarray:
+        return cv2.GaussianBlur(image, (11, 11), 1.5)
+
+    mu_x, mu_y = blur(x), blur(y)
+    mu_xx, mu_yy, mu_xy = mu_x * mu_x, mu_y * mu_y, mu_x * mu_y
+    sigma_xx = blur(x * x) - mu_xx
+    sigma_yy = blur(y * y) - mu_yy
+    sigma_xy = blur(x * y) - mu_xy
+    ssim_map = ((2 * mu_xy + c1) * (2 * sigma_xy + c2)) / ((mu_xx + mu_yy + c1) * (sigma_xx + sigma_yy + c2))
+    return float(ssim_map.mean())
@@ -0,0 +1,250 @@
+"""
+数据集的增量生成
+
+生成数据集时在数据集文件夹中记录一份清单 .build_manifest.json
+- params: 生成参数 (图片大小、随机种子等) 变化时全部重新生成
+- sources: 每个输入文件的大小、修改时间和内容哈希 大小和修改时间不变时不重新读取内容
+- outputs: 每张生成图片的配对和输入文件的内容哈希
+
+再次生成时 只重新生成输入变化了的图片 删除不再需要的图片
+训练集/验证集/测试集按文件名的哈希划分 同一张图片每次都分到同一个集合
+"""
+import hashlib
+import json
+import os
+import shutil
+from typing import Dict, List, Optional, Tuple
+
+MANIFEST_FILE_NAME = '.build_manifest.json'
+MANIFEST_VERSION = 1
+SPLIT_TXT_NAMES = ['autosplit_train.txt', 'autosplit_val.txt', 'autosplit_test.txt']
+
+
+def get_manifest_path(dataset_dir: str) -> str:
+    """
+    清单文件的路径
+    """
+    return os.path.join(dataset_dir, MANIFEST_FILE_NAME)
+
+
+def calculate_file_hash(file_path: str) -> str:
+    """
+    计算文件内容的哈希
+
+    Args:
+        file_path: 文件路径
+
+    Returns:
+        str: sha1 十六进制字符串
+    """
+    sha1 = hashlib.sha1()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+class BuildManifest:
+    """一次数据集生成的清单"""
+
+    def __init__(self, params: Dict, sources: Optional[Dict[str, List]] = None,
+                 outputs: Optional[Dict[str, Dict]] = None):
+        """
+        Args:
+            params: 生成参数 需要可以保存成 JSON
+            sources: 输入文件路径 -> [大小, 修改时间, 内容哈希]
+            outputs: 生成图片的名称 -> {'pair': [数据ID, 数据ID], 'inputs': [内容哈希]}
+        """
+        self.params: Dict = params
+        self.sources: Dict[str, List] = sources if sources is not None else {}
+        self.outputs: Dict[str, Dict] = outputs if outputs is not None else {}
+        self._used_sources: set = set()
+
+    def get_file_hash(self, file_path: str) -> str:
+        """
+        获取输入文件的内容哈希 大小和修改时间与清单中一致时直接使用清单中的哈希
+
+        Args:
+            file_path: 文件路径
+
+        Returns:
+            str: 内容哈希
+        """
+        stat = os.stat(file_path)
+        self._used_sources.add(file_path)
+        record = self.sources.get(file_path)
+        if record is not None and record[0] == stat.st_size and record[1] == stat.st_mtime_ns:
+            return record[2]
+        file_hash = calculate_file_hash(file_path)
+        self.sources[file_path] = [stat.st_size, stat.st_mtime_ns, file_hash]
+        return file_hash
+
+    def get_pairs(self) -> List[Tuple[str, str]]:
+        """
+        Returns:
+            List[Tuple[str, str]]: 清单中全部生成图片的配对
+        """
+        return [(output['pair'][0], output['pair'][1]) for output in self.outputs.values()]
+
+    @staticmethod
+    def load(manifest_path: str) -> Optional['BuildManifest']:
+        """
+        读取清单 文件不存在、损坏或版本不一致时返回 None
+        """
+        if not os.path.exists(manifest_path):
+            return None
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as file:
+                data = json.load(file)
+            if data.get('version') != MANIFEST_VERSION:
+                return None
+            return BuildManifest(data['params'], data['sources'], data['outputs'])
+        except Exception as e:
+            print(f'读取数据集清单失败 {manifest_path}: {str(e)}')
+            return None
+
+    def save(self, manifest_path: str) -> None:
+        """
+        保存清单 只保留这次用到的输入文件 先写入临时文件再替换
+        """
+        data = {
+            'version': MANIFEST_VERSION,
+            'params': self.params,
+            'sources': {path: record for path, record in self.sources.items() if path in self._used_sources},
+            'outputs': self.outputs,
+        }
+        tmp_path = manifest_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump(data, file, ensure_ascii=False)
+        os.replace(tmp_path, manifest_path)
+
+
+def load_manifest(dataset_dir: str, params: Dict, force_rebuild: bool = False,
+                  output_dirs: Optional[List[str]] = None) -> Tuple[BuildManifest, bool]:
+    """
+    读取上一次生成的清单 不存在或参数变化时清空输出文件夹 返回一份只有参数的新清单
+
+    Args:
+        dataset_dir: 数据集文件夹
+        params: 这次的生成参数
+        force_rebuild: 是否忽略清单全部重新生成
+        output_dirs: 生成的图片和标签所在的文件夹 全部重新生成时清空
+
+    Returns:
+        (清单, 是否可以复用上一次的结果)
+    """
+    manifest = None if force_rebuild else BuildManifest.load(get_manifest_path(dataset_dir))
+    if manifest is not None and manifest.params == params:
+        return manifest, True
+
+    if manifest is not None:
+        print('数据集生成参数已变化 全部重新生成')
+    for dir_path in (output_dirs or []):
+        shutil.rmtree(dir_path, ignore_errors=True)
+        os.makedirs(dir_path, exist_ok=True)
+    return BuildManifest(params), False
+
+
+def remove_stale_outputs(dir_path: str, keep_names: set) -> int:
+    """
+    删除文件夹中不再需要的生成文件
+
+    Args:
+        dir_path: 生成图片或标签的文件夹
+        keep_names: 需要保留的文件名 (不含扩展名)
+
+    Returns:
+        int: 删除的文件数量
+    """
+    remove_cnt = 0
+    for entry in os.scandir(dir_path):
+        if not entry.is_file() or entry.name.startswith('.'):
+            continue
+        if os.path.splitext(entry.name)[0] in keep_names:
+            continue
+        os.remove(entry.path)
+        remove_cnt += 1
+    return remove_cnt
+
+
+def remove_label_caches(labels_dir: str) -> int:
+    """
+    删除 ultralytics 在标签文件夹旁边生成的 *.cache
+    ultralytics 只按文件路径和文件大小之和判断缓存是否有效 标签内容变化但大小不变时会继续使用旧的标签
+
+    Args:
+        labels_dir: 生成标签的文件夹
+
+    Returns:
+        int: 删除的文件数量
+    """
+    remove_cnt = 0
+    parent_dir = os.path.dirname(os.path.abspath(labels_dir))
+    for entry in os.scandir(parent_dir):
+        if entry.is_file() and entry.name.endswith('.cache'):
+            os.remove(entry.path)
+            remove_cnt += 1
+    return remove_cnt
+
+
+def get_split_idx(name: str, weights: Tuple[float, float, float]) -> int:
+    """
+    按名称的哈希决定分到哪个集合 与其它文件无关 新增或删除图片不会改变已有图片的划分
+
+    Args:
+        name: 图片名称
+        weights: 训练集、验证集、测试集的比例
+
+    Returns:
+        int: 0=训练集 1=验证集 2=测试集
+    """
+    value = int.from_bytes(hashlib.md5(name.encode('utf-8')).digest()[:8], 'little') / (1 << 64)
+    total = sum(weights)
+    cumulative = 0.0
+    for idx, weight in enumerate(weights):
+        cumulative += weight / total
+        if value < cumulative:
+            return idx
+    return len(weights) - 1
+
+
+def write_split_lists(dataset_dir: str, image_names: List[str],
+                      weights: Tuple[float, float, float] = (0.9, 0.1, 0)) -> None:
+    """
+    写入 autosplit_*.txt 格式与 ultralytics 的 autosplit 一致 但划分结果是稳定的
+    验证集比例为0时 使用训练集作为验证集
+
+    Args:
+        dataset_dir: 数据集文件夹
+        image_names: images 文件夹中的图片文件名
+        weights: 训练集、验证集、测试集的比例
+    """
+    split_lines: List[List[str]] = [[] for _ in SPLIT_TXT_NAMES]
+    for image_name in sorted(image_names):
+        split_idx = get_split_idx(os.path.splitext(image_name)[0], weights)
+        split_lines[split_idx].append(f'./images/{image_name}\n')
+    if weights[1] == 0:
+        split_lines[1] = split_lines[0]
+
+    for txt_name, lines in zip(SPLIT_TXT_NAMES, split_lines):
+        with open(os.path.join(dataset_dir, txt_name), 'w', encoding='utf-8') as file:
+            file.writelines(lines)
+
+
+def write_dataset_yaml(dataset_dir: str, dataset_name: str, names: List[str]) -> None:
+    """
+    写入 dataset.yaml 使用 autosplit_*.txt 划分
+
+    Args:
+        dataset_dir: 数据集文件夹
+        dataset_name: 数据集名称
+        names: 类别名称 按下标顺序
+    """
+    with open(os.path.join(dataset_dir, 'dataset.yaml'), 'w', encoding='utf-8') as file:
+        file.write('path: %s\n' % dataset_name)
+        file.write('train: autosplit_train.txt\n')
+        file.write('val: autosplit_val.txt\n')
+        file.write('test: autosplit_test.txt\n')
+        file.write('names:\n')
+        for label_idx, label in enumerate(names):
+            file.write('  %d: %s\n' % (label_idx, label))
@@ -0,0 +1,352 @@
+"""
+使用训练好的分类模型提取图片特征 用余弦相似度判断相似图片
+
+感知哈希只能找出画面几乎一样的图片，同一张卡片换了背景色调这类语义上重复的图片找不出来。
+这里读取 ultralytics_utils.export_cls_model 导出的 model.onnx，
+把最后一个全连接层的输入 (即池化后的特征) 作为额外的输出，在 CPU 上批量提取特征。
+"""
+import os
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import onnx
+import onnxruntime
+from PIL import Image
+
+from one_dragon_yolo.devtools.image_hash_utils import HashRoi, JPEG_EXTENSIONS
+
+FEATURE_CACHE_FILE_NAME = '.image_feature_cache.npz'
+EMBEDDING_BLOCK_SIZE = 1024  # 分块计算相似度矩阵时每块的查询数量
+
+
+def find_feature_output(model: onnx.ModelProto) -> str:
+    """
+    找到分类模型中池化后的特征 即最后一个全连接层的输入
+
+    Args:
+        model: onnx 模型
+
+    Returns:
+        特征在图中的名称
+    """
+    for node in reversed(model.graph.node):
+        if node.op_type in ('Gemm', 'MatMul'):
+            return node.input[0]
+    for node in reversed(model.graph.node):
+        if node.op_type in ('GlobalAveragePool', 'Flatten'):
+            return node.output[0]
+    raise ValueError('模型中没有找到全连接层或全局池化层')
+
+
+def load_rgb_for_embedding(image_path: str, width: int, height: int) -> np.ndarray:
+    """
+    读取 RGB 图片 JPEG 使用 draft() 直接解码成不小于目标尺寸的缩小图
+
+    Args:
+        image_path: 图片文件路径
+        width: 模型输入宽度
+        height: 模型输入高度
+
+    Returns:
+        np.ndarray: uint8 RGB 图片
+    """
+    with Image.open(image_path) as img:
+        if os.path.splitext(image_path)[1].lower() in JPEG_EXTENSIONS:
+            img.draft('RGB', (width, height))
+        return np.asarray(img.convert('RGB'))
+
+
+def preprocess_image(rgb: np.ndarray, width: int, height: int) -> np.ndarray:
+    """
+    与 ultralytics 分类模型的预处理一致: 按短边缩放 中心裁剪 归一化到 0-1
+
+    Args:
+        rgb: uint8 RGB 图片
+        width: 模型输入宽度
+        height: 模型输入高度
+
+    Returns:
+        np.ndarray: (3, height, width) float32
+    """
+    img_height, img_width = rgb.shape[:2]
+    scale = max(width / img_width, height / img_height)
+    resized_width = max(width, int(round(img_width * scale)))
+    resized_height = max(height, int(round(img_height * scale)))
+    resized = np.asarray(Image.fromarray(rgb).resize((resized_width, resized_height), Image.Resampling.BILINEAR))
+    left = (resized_width - width) // 2
+    top = (resized_height - height) // 2
+    cropped = resized[top:top + height, left:left + width]
+    return np.ascontiguousarray(cropped.transpose(2, 0, 1), dtype=np.float32) / 255.0
+
+
+def normalize_features(features: np.ndarray) -> np.ndarray:
+    """
+    按行做 L2 归一化 之后内积就是余弦相似度
+    """
+    features = np.asarray(features, dtype=np.float32)
+    norm = np.linalg.norm(features, axis=1, keepdims=True)
+    return features / np.maximum(norm, 1e-12)
+
+
+class OnnxFeatureExtractor:
+    """
+    在 CPU 上批量提取分类模型的池化特征
+    """
+
+    def __init__(self, model_path: str, batch_size: int = 16, feature_name: Optional[str] = None):
+        """
+        Args:
+            model_path: 导出的 onnx 模型路径
+            batch_size: 每次推理的图片数量 模型不支持动态 batch 时自动改为 1
+            feature_name: 特征在图中的名称 None 时自动查找
+        """
+        self.model_path: str = model_path
+        model = onnx.load(model_path)
+        self.feature_name: str = find_feature_output(model) if feature_name is None else feature_name
+        model.graph.output.append(onnx.ValueInfoProto(name=self.feature_name))
+
+        model_input = model.graph.input[0]
+        self.input_name: str = model_input.name
+        dims = model_input.type.tensor_type.shape.dim
+        self.input_height: int = dims[2].dim_value
+        self.input_width: int = dims[3].dim_value
+
+        # 默认导出的模型 batch 固定为 1 尝试改成动态的 失败时逐张推理
+        self.batch_size: int = max(1, batch_size)
+        fixed_batch = dims[0].dim_value > 0
+        if fixed_batch and self.batch_size > 1:
+            dynamic_model = onnx.ModelProto()
+            dynamic_model.CopyFrom(model)
+            dynamic_model.graph.input[0].type.tensor_type.shape.dim[0].dim_param = 'batch'
+            for output in dynamic_model.graph.output:
+                if output.type.tensor_type.HasField('shape'):
+                    output.type.tensor_type.shape.dim[0].dim_param = 'batch'
+            try:
+                self._session = self._create_session(dynamic_model)
+                self._run(np.zeros((2, 3, self.input_height, self.input_width), dtype=np.float32))
+            except Exception:
+                self.batch_size = 1
+                self._session = self._create_session(model)
+        else:
+            self._session = self._create_session(model)
+
+    @staticmethod
+    def _create_session(model: onnx.ModelProto) -> onnxruntime.InferenceSession:
+        return onnxruntime.InferenceSession(model.SerializeToString(), providers=['CPUExecutionProvider'])
+
+    def _run(self, batch: np.ndarray) -> np.ndarray:
+        features = self._session.run([self.feature_name], {self.input_name: batch})[0]
+        return features.reshape(len(batch), -1)
+
+    def model_key(self) -> str:
+        """
+        模型文件的标识 模型变化后特征缓存失效
+        """
+        stat = os.stat(self.model_path)
+        return f'{os.path.abspath(self.model_path)}|{stat.st_size}|{stat.st_mtime_ns}|{self.feature_name}'
+
+    def extract(self, image_paths: List[str], roi: Optional[HashRoi] = None,
+                progress_callback=None) -> List[Optional[np.ndarray]]:
+        """
+        批量提取图片特征
+
+        Args:
+            image_paths: 图片文件路径列表
+            roi: 感兴趣区域 None 表示使用完整画面
+            progress_callback: 进度回调函数 (已完成数量)
+
+        Returns:
+            与图片路径一一对应的 L2 归一化后的 float32 特征 读取失败时为 None
+        """
+        result: List[Optional[np.ndarray]] = [None] * len(image_paths)
+        for start in range(0, len(image_paths), self.batch_size):
+            batch_idx: List[int] = []
+            batch_images: List[np.ndarray] = []
+            for idx in range(start, min(start + self.batch_size, len(image_paths))):
+                try:
+                    rgb = load_rgb_for_embedding(image_paths[idx], self.input_width, self.input_height)
+                    if roi is not None:
+                        rgb = roi.apply(rgb)
+                    batch_images.append(preprocess_image(rgb, self.input_width, self.input_height))
+                    batch_idx.append(idx)
+                except Exception as e:
+                    print(f"无法处理图片 {image_paths[idx]}: {str(e)}")
+
+            if len(batch_images) > 0:
+                features = normalize_features(self._run(np.stack(batch_images)))
+                for idx, feature in zip(batch_idx, features):
+                    result[idx] = feature
+            if progress_callback is not None:
+                progress_callback(min(start + self.batch_size, len(image_paths)))
+        return result
+
+
+class FeatureCache:
+    """
+    持久化的图片特征缓存 以 float16 矩阵保存在根文件夹的 npz 文件中
+
+    与 ImageHashCache 一样按相对路径、文件大小和修改时间判断是否失效，
+    模型或感兴趣区域变化后整个缓存失效。
+    """
+
+    def __init__(self, root_folder: str, model_key: str, file_name: str = FEATURE_CACHE_FILE_NAME):
+        """
+        Args:
+            root_folder: 根文件夹路径 缓存中保存的是相对这个文件夹的路径
+            model_key: 模型标识
+            file_name: 缓存文件名
+        """
+        self.root_folder: str = root_folder
+        self.file_path: str = os.path.join(root_folder, file_name)
+        self.model_key: str = model_key
+        self.hit_cnt: int = 0
+        self.miss_cnt: int = 0
+        self._entries: Dict[str, Tuple[int, int, np.ndarray]] = {}
+        self._changed: bool = False
+
+        if os.path.exists(self.file_path):
+            try:
+                with np.load(self.file_path, allow_pickle=False) as data:
+                    if str(data['model_key']) == model_key:
+                        for rel_path, size, mtime_ns, feature in zip(
+                                data['rel_path'].tolist(), data['size'].tolist(),
+                                data['mtime_ns'].tolist(), data['feature']):
+                            self._entries[rel_path] = (size, mtime_ns, feature)
+            except Exception:
+                self._entries.clear()  # 缓存损坏时重新计算
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _rel_path(self, image_path: str) -> str:
+        return os.path.relpath(image_path, self.root_folder).replace('\\', '/')
+
+    def get(self, image_path: str) -> Optional[np.ndarray]:
+        """
+        读取一张图片的缓存特征
+
+        Returns:
+            float32 特征 没有缓存或缓存已失效时返回 None
+        """
+        entry = self._entries.get(self._rel_path(image_path))
+        if entry is not None:
+            try:
+                stat = os.stat(image_path)
+            except OSError:
+                stat = None
+            if stat is not None and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+                self.hit_cnt += 1
+                return entry[2].astype(np.float32)
+
+        self.miss_cnt += 1
+        return None
+
+    def put(self, image_path: str, feature: np.ndarray) -> None:
+        """
+        写入一张图片的特征 调用 close 后才会保存到文件中
+        """
+        try:
+            stat = os.stat(image_path)
+        except OSError:
+            return
+        self._entries[self._rel_path(image_path)] = (stat.st_size, stat.st_mtime_ns, feature.astype(np.float16))
+        self._changed = True
+
+    def remove(self, image_path: str) -> None:
+        """
+        删除一张图片的缓存 图片被删除时调用
+        """
+        if self._entries.pop(self._rel_path(image_path), None) is not None:
+            self._changed = True
+
+    def close(self) -> None:
+        """
+        有变化时将全部特征写入文件
+        """
+        if not self._changed:
+            return
+        rel_paths = list(self._entries.keys())
+        feature_dim = len(next(iter(self._entries.values()))[2]) if len(rel_paths) > 0 else 0
+        np.savez(
+            self.file_path,
+            model_key=np.array(self.model_key),
+            rel_path=np.array(rel_paths, dtype=str),
+            size=np.array([self._entries[p][0] for p in rel_paths], dtype=np.int64),
+            mtime_ns=np.array([self._entries[p][1] for p in rel_paths], dtype=np.int64),
+            feature=np.stack([self._entries[p][2] for p in rel_paths]) if len(rel_paths) > 0
+            else np.zeros((0, feature_dim), dtype=np.float16),
+        )
+        self._changed = False
+
+
+class EmbeddingIndex:
+    """
+    特征的相似度索引 接口与 hamming_utils.HammingIndex 一致
+
+    分块计算查询特征与全部有效特征的内积 (归一化后即余弦相似度)，
+    每块只保留超过阈值的结果，内存占用与块大小成正比。
+    """
+
+    def __init__(self, features: np.ndarray):
+        """
+        Args:
+            features: (N, D) 特征矩阵 查询结果中使用行号表示每个元素
+        """
+        self.features: np.ndarray = normalize_features(features)
+        self.alive: np.ndarray = np.ones(len(self.features), dtype=bool)
+        self.comparison_cnt: int = 0  # 实际计算相似度的次数
+
+    def __len__(self) -> int:
+        return int(self.alive.sum())
+
+    def is_alive(self, idx: int) -> bool:
+        return bool(self.alive[idx])
+
+    def remove(self, idx) -> None:
+        """
+        移除元素 之后的查询不会再返回它
+        """
+        self.alive[idx] = False
+
+    def query_many(
+            self,
+            query_features: np.ndarray,
+            min_similarity: float,
+            query_alive: Optional[np.ndarray] = None,
+            block_size: int = EMBEDDING_BLOCK_SIZE,
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        批量查询余弦相似度不低于 min_similarity 的元素
+
+        Args:
+            query_features: (M, D) 查询特征
+            min_similarity: 最低余弦相似度
+            query_alive: 查询中需要处理的标记 None 表示全部
+            block_size: 每块的查询数量
+
+        Returns:
+            (查询下标, 元素下标, 余弦相似度) 按查询下标、元素下标排序
+        """
+        query_idx = np.arange(len(query_features)) if query_alive is None else np.flatnonzero(query_alive)
+        item_idx = np.flatnonzero(self.alive)
+        if len(query_idx) == 0 or len(item_idx) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        query_features = normalize_features(query_features)
+        item_features = self.features[item_idx]
+
+        result_q: List[np.ndarray] = []
+        result_i: List[np.ndarray] = []
+        result_s: List[np.ndarray] = []
+        for start in range(0, len(query_idx), block_size):
+            block_query_idx = query_idx[start:start + block_size]
+            similarity = query_features[block_query_idx] @ item_features.T
+            self.comparison_cnt += similarity.size
+            rows, cols = np.nonzero(similarity >= min_similarity)
+            result_q.append(block_query_idx[rows])
+            result_i.append(item_idx[cols])
+            result_s.append(similarity[rows, cols])
+
+        return np.concatenate(result_q), np.concatenate(result_i), np.concatenate(result_s)
@@ -0,0 +1,128 @@
+"""
+解码后的原图和标签的 LRU 缓存
+
+拼接数据集时每张原图会出现在多张拼接图片中 (随机配对时平均两次)
+缓存按解码后的字节数限制大小 配合 mosaic_utils.schedule_cache_local 的任务顺序 每张原图大多只需要解码一次
+"""
+from collections import OrderedDict
+from typing import Optional
+
+import cv2
+import numpy as np
+
+from one_dragon_yolo.devtools import yolo_label_utils
+
+
+class FrameCacheStats:
+    """缓存的统计 可以在进程之间传递后合并"""
+
+    def __init__(self, hit_cnt: int = 0, miss_cnt: int = 0, saved_bytes: int = 0, loaded_bytes: int = 0):
+        self.hit_cnt: int = hit_cnt  # 命中次数
+        self.miss_cnt: int = miss_cnt  # 未命中 需要读取的次数
+        self.saved_bytes: int = saved_bytes  # 命中时不需要解码的字节数
+        self.loaded_bytes: int = loaded_bytes  # 未命中时解码的字节数
+
+    def add(self, other: 'FrameCacheStats') -> None:
+        self.hit_cnt += other.hit_cnt
+        self.miss_cnt += other.miss_cnt
+        self.saved_bytes += other.saved_bytes
+        self.loaded_bytes += other.loaded_bytes
+
+    def copy(self) -> 'FrameCacheStats':
+        return FrameCacheStats(self.hit_cnt, self.miss_cnt, self.saved_bytes, self.loaded_bytes)
+
+    def diff(self, before: 'FrameCacheStats') -> 'FrameCacheStats':
+        """
+        Returns:
+            从 before 到现在的增量
+        """
+        return FrameCacheStats(self.hit_cnt - before.hit_cnt, self.miss_cnt - before.miss_cnt,
+                               self.saved_bytes - before.saved_bytes, self.loaded_bytes - before.loaded_bytes)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hit_cnt + self.miss_cnt
+        return self.hit_cnt / total if total > 0 else 0.0
+
+    def __str__(self) -> str:
+        return (f'命中率 {self.hit_rate:.1%} ({self.hit_cnt}/{self.hit_cnt + self.miss_cnt}) '
+                f'节省解码 {self.saved_bytes / 1024 / 1024:.1f}MB 实际解码 {self.loaded_bytes / 1024 / 1024:.1f}MB')
+
+
+class FrameCache:
+    """
+    按字节数限制大小的 LRU 缓存 图片和标签共用同一个容量 统计只包含图片
+    返回的数组是缓存中的同一个对象 调用方不能修改
+    """
+
+    def __init__(self, max_mb: float = 256):
+        """
+        Args:
+            max_mb: 最多缓存的解码后大小 单位 MB 0 表示不缓存
+        """
+        self.max_bytes: int = int(max_mb * 1024 * 1024)
+        self.used_bytes: int = 0
+        self.stats: FrameCacheStats = FrameCacheStats()
+        self._entries: OrderedDict[tuple, np.ndarray] = OrderedDict()
+
+    def _get(self, key: tuple, count: bool = True) -> Optional[np.ndarray]:
+        value = self._entries.get(key)
+        if value is None:
+            return None
+        self._entries.move_to_end(key)
+        if count:
+            self.stats.hit_cnt += 1
+            self.stats.saved_bytes += value.nbytes
+        return value
+
+    def _put(self, key: tuple, value: np.ndarray, count: bool = True) -> None:
+        if count:
+            self.stats.miss_cnt += 1
+            self.stats.loaded_bytes += value.nbytes
+        if value.nbytes > self.max_bytes:
+            return
+        self._entries[key] = value
+        self.used_bytes += value.nbytes
+        while self.used_bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.used_bytes -= evicted.nbytes
+
+    def get_image(self, image_path: str) -> Optional[np.ndarray]:
+        """
+        读取图片 缓存中没有时使用 cv2.imread 解码
+
+        Args:
+            image_path: 图片路径
+
+        Returns:
+            BGR 图片 读取失败时返回 None
+        """
+        key = ('image', image_path)
+        img = self._get(key)
+        if img is None:
+            img = cv2.imread(image_path)
+            if img is not None:
+                self._put(key, img)
+        return img
+
+    def get_labels(self, label_path: str) -> np.ndarray:
+        """
+        读取标签文件
+
+        Args:
+            label_path: 标签文件路径
+
+        Returns:
+            形状为 (n, 5) 的标签数组
+        """
+        key = ('labels', label_path)
+        labels = self._get(key, count=False)
+        if labels is None:
+            labels = yolo_label_utils.read_label_txt(label_path)
+            self._put(key, labels, count=False)
+        return labels
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.used_bytes = 0
+
@@ -0,0 +1,465 @@
+import math
+from itertools import combinations
+from typing import Iterator, List, Optional, Tuple
+
+import imagehash
+import numpy as np
+
+HASH_BITS = 64  # 感知哈希默认是 8*8=64位
+DISTANCE_BLOCK_SIZE = 2048  # 分块计算距离矩阵时每块的边长 2048*2048 的 uint64 约占 32MB
+
+# 每个字节的汉明重量 用于没有 np.bitwise_count 的旧版 numpy
+_POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def hash_to_int(hash_value: imagehash.ImageHash) -> int:
+    """
+    将 imagehash 的哈希值转换成整数 高位对应哈希矩阵的第一个元素
+
+    Args:
+        hash_value: imagehash 的哈希值
+
+    Returns:
+        int: 64位整数
+    """
+    result = 0
+    for bit in hash_value.hash.flatten():
+        result = (result << 1) | int(bit)
+    return result
+
+
+def pack_hashes(hashes: List[imagehash.ImageHash]) -> np.ndarray:
+    """
+    将多个 imagehash 的哈希值打包成连续的 uint64 数组 位序与 hash_to_int 一致
+
+    Args:
+        hashes: imagehash 的哈希值列表 需要都是64位
+
+    Returns:
+        np.ndarray: 形状为 (N,) 的 uint64 数组
+    """
+    if len(hashes) == 0:
+        return np.zeros(0, dtype=np.uint64)
+    bits = np.stack([h.hash.reshape(-1) for h in hashes]).astype(np.uint8)
+    packed = np.packbits(bits, axis=1)  # (N, 8) 高位在前
+    return np.ascontiguousarray(packed).view('>u8').reshape(-1).astype(np.uint64)
+
+
+def popcount64(values: np.ndarray) -> np.ndarray:
+    """
+    计算 uint64 数组中每个元素的汉明重量
+
+    Args:
+        values: 任意形状的 uint64 数组
+
+    Returns:
+        np.ndarray: 同形状的 uint8 数组
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    if hasattr(np, 'bitwise_count'):  # numpy >= 2.0
+        return np.bitwise_count(values)
+    byte_counts = _POPCOUNT_TABLE[np.ascontiguousarray(values).reshape(-1).view(np.uint8)]
+    return byte_counts.reshape(values.shape + (8,)).sum(axis=-1, dtype=np.uint8)
+
+
+def hamming_distance_matrix(hashes1: np.ndarray, hashes2: np.ndarray) -> np.ndarray:
+    """
+    计算两组哈希两两之间的汉明距离 结果会占用 len(hashes1)*len(hashes2) 字节
+    数量较多时使用 iter_distance_blocks 分块计算
+
+    Args:
+        hashes1: (N,) uint64 数组
+        hashes2: (M,) uint64 数组
+
+    Returns:
+        np.ndarray: (N, M) uint8 距离矩阵
+    """
+    return popcount64(hashes1[:, None] ^ hashes2[None, :])
+
+
+def iter_distance_blocks(
+        hashes1: np.ndarray,
+        hashes2: np.ndarray,
+        block_size: int = DISTANCE_BLOCK_SIZE,
+) -> Iterator[Tuple[int, int, np.ndarray]]:
+    """
+    分块计算两组哈希的汉明距离矩阵 控制内存占用
+
+    Args:
+        hashes1: (N,) uint64 数组
+        hashes2: (M,) uint64 数组
+        block_size: 每块的边长
+
+    Returns:
+        逐块返回 (行偏移, 列偏移, 距离矩阵块)
+    """
+    for row_start in range(0, len(hashes1), block_size):
+        row_block = hashes1[row_start:row_start + block_size]
+        for col_start in range(0, len(hashes2), block_size):
+            col_block = hashes2[col_start:col_start + block_size]
+            yield row_start, col_start, hamming_distance_matrix(row_block, col_block)
+
+
+def similarity_to_max_distance(similarity_threshold: float, hash_bits: int = HASH_BITS) -> int:
+    """
+    将相似度阈值转换成允许的最大汉明距离
+    相似度 = 1 - 汉明距离 / 哈希位长 因此 相似度 >= 阈值 等价于 汉明距离 <= (1 - 阈值) * 哈希位长
+
+    Args:
+        similarity_threshold: 相似度阈值 (0-1)
+        hash_bits: 哈希位长
+
+    Returns:
+        int: 最大汉明距离
+    """
+    # 加一个极小值 避免浮点误差导致 0.875*64=7.9999 这类情况被向下取整
+    return max(0, int(math.floor((1 - similarity_threshold) * hash_bits + 1e-9)))
+
+
+def distance_to_similarity(distance, hash_bits: int = HASH_BITS):
+    """
+    将汉明距离转换成相似度 (0-1)，1表示完全相同 支持传入 numpy 数组
+    """
+    return 1.0 - (distance / hash_bits)
+
+
+def cluster_pairs(item_cnt: int, pair_i: np.ndarray, pair_j: np.ndarray) -> List[List[int]]:
+    """
+    使用并查集 将相似的图片对合并成连通的分组
+
+    Args:
+        item_cnt: 图片数量
+        pair_i: 相似对的第一个下标
+        pair_j: 相似对的第二个下标
+
+    Returns:
+        包含至少2张图片的分组列表 每个分组内的下标升序排列 分组按最小下标排序
+    """
+    parent = list(range(item_cnt))
+
+    def find(x: int) -> int:
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]  # 路径减半
+            x = parent[x]
+        return x
+
+    for i, j in zip(np.asarray(pair_i).tolist(), np.asarray(pair_j).tolist()):
+        root_i, root_j = find(i), find(j)
+        if root_i != root_j:
+            # 以较小的下标作为根 结果与相似对的顺序无关
+            if root_i < root_j:
+                parent[root_j] = root_i
+            else:
+                parent[root_i] = root_j
+
+    roots = np.array([find(x) for x in range(item_cnt)], dtype=np.int64)
+    if item_cnt == 0:
+        return []
+    order = np.argsort(roots, kind='stable')
+    sorted_roots = roots[order]
+    starts = np.flatnonzero(np.r_[True, sorted_roots[1:] != sorted_roots[:-1]])
+    ends = np.r_[starts[1:], item_cnt]
+    return [order[s:e].tolist() for s, e in zip(starts.tolist(), ends.tolist()) if e - s >= 2]
+
+
+def merge_counts_by_distance(item_cnt: int, pair_i: np.ndarray, pair_j: np.ndarray,
+                             distance: np.ndarray, max_distance: int) -> np.ndarray:
+    """
+    按距离从小到大合并相似对 统计每个最大距离下 并查集一共合并了多少次
+    每个分组保留一张时 合并次数就是需要删除的图片数量 = 分组内图片数 - 分组数
+
+    Args:
+        item_cnt: 图片数量
+        pair_i: 相似对的第一个下标
+        pair_j: 相似对的第二个下标
+        distance: 相似对的汉明距离
+        max_distance: 统计的最大距离
+
+    Returns:
+        np.ndarray: 长度为 max_distance + 1 的数组 第 d 项是只使用距离 <= d 的相似对时的合并次数
+    """
+    parent = list(range(item_cnt))
+
+    def find(x: int) -> int:
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]  # 路径减半
+            x = parent[x]
+        return x
+
+    distance = np.asarray(distance)
+    order = np.argsort(distance, kind='stable')
+    merge_cnt_list = np.zeros(max_distance + 1, dtype=np.int64)
+    for i, j, d in zip(np.asarray(pair_i)[order].tolist(), np.asarray(pair_j)[order].tolist(),
+                       distance[order].tolist()):
+        if d > max_distance:
+            break
+        root_i, root_j = find(i), find(j)
+        if root_i != root_j:
+            parent[max(root_i, root_j)] = min(root_i, root_j)
+            merge_cnt_list[d] += 1
+    return np.cumsum(merge_cnt_list)
+
+
+def window_min_distance(hashes: np.ndarray, window_size: int) -> np.ndarray:
+    """
+    按顺序计算每个哈希与前 window_size 个哈希的最小汉明距离
+    每次对整个数组错开 k 位计算一次 总计算量为 O(N * window_size)
+
+    Args:
+        hashes: 按时间排序的 uint64 哈希数组
+        window_size: 向前比较的数量 1 表示只与前一个比较
+
+    Returns:
+        np.ndarray: (N,) uint8 数组 前面没有可比较的哈希时为 HASH_BITS
+    """
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    min_distance = np.full(len(hashes), HASH_BITS, dtype=np.uint8)
+    for k in range(1, min(window_size, len(hashes) - 1) + 1):
+        np.minimum(min_distance[k:], popcount64(hashes[k:] ^ hashes[:-k]), out=min_distance[k:])
+    return min_distance
+
+
+def farthest_point_sample(hashes: np.ndarray, sample_cnt: int,
+                          start_idx: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    在汉明空间中做最远点采样 每次选出与已选图片最近距离最大的一张 使选出的图片尽量分散
+
+    每一步只需要计算新选出的图片与全部图片的距离 总计算量为 O(N * sample_cnt)
+
+    Args:
+        hashes: uint64 哈希数组
+        sample_cnt: 需要选出的数量
+        start_idx: 第一张选出的图片下标
+
+    Returns:
+        (选出的下标 按选出顺序排列, 每张图片与最近的已选图片的距离)
+    """
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    item_cnt = len(hashes)
+    sample_cnt = min(sample_cnt, item_cnt)
+    if sample_cnt <= 0:
+        return np.zeros(0, dtype=np.int64), np.full(item_cnt, HASH_BITS, dtype=np.uint8)
+
+    selected = np.empty(sample_cnt, dtype=np.int64)
+    selected[0] = start_idx
+    # 已选的图片记为 -1 哈希完全相同的图片 (距离为0) 也不会被重复选中
+    min_distance = popcount64(hashes ^ hashes[start_idx]).astype(np.int16)
+    min_distance[start_idx] = -1
+    for i in range(1, sample_cnt):
+        # 距离相同时 argmax 取下标最小的 结果是确定的
+        selected[i] = int(np.argmax(min_distance))
+        np.minimum(min_distance, popcount64(hashes ^ hashes[selected[i]]).astype(np.int16), out=min_distance)
+        min_distance[selected[i]] = -1
+    min_distance[selected] = 0
+    return selected, min_distance.astype(np.uint8)
+
+
+def _empty_pairs() -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.uint8)
+
+
+class HammingIndex:
+    """
+    汉明空间索引 使用 multi-index hashing 实现半径查询
+
+    64位哈希被切分成 block_count 块，每块按块值分桶。
+    根据鸽巢原理，汉明距离不超过 r 的两个哈希，至少有一块的距离不超过 r // block_count，
+    因此只需要在每块中枚举距离不超过 r // block_count 的块值，就能找出全部候选。
+    当半径过大、候选数量接近全量时，自动退化为分块的暴力距离矩阵。
+    """
+
+    def __init__(self, hashes: np.ndarray, block_count: int = 4):
+        """
+        Args:
+            hashes: (N,) uint64 哈希数组 查询结果中使用数组下标表示每个元素
+            block_count: 切分的块数 需要能整除64
+        """
+        if HASH_BITS % block_count != 0:
+            raise ValueError('block_count 需要能整除 %d' % HASH_BITS)
+
+        self.hashes: np.ndarray = np.ascontiguousarray(hashes, dtype=np.uint64)
+        self.alive: np.ndarray = np.ones(len(self.hashes), dtype=bool)
+        self.block_count: int = block_count
+        self.block_bits: int = HASH_BITS // block_count
+        self.block_mask: np.uint64 = np.uint64((1 << self.block_bits) - 1)
+        self.comparison_cnt: int = 0  # 实际计算汉明距离的次数
+
+        # 每块建立一个按块值分桶的表 桶 v 中的元素下标为 order[bucket_start[v]:bucket_start[v]+bucket_cnt[v]]
+        self._block_tables: List[Tuple[np.ndarray, np.ndarray, np.ndarray]] = []
+        for block_idx in range(block_count):
+            block_values = self._block_values(self.hashes, block_idx).astype(np.int64)
+            order = np.argsort(block_values, kind='stable')
+            bucket_cnt = np.bincount(block_values, minlength=1 << self.block_bits)
+            bucket_start = np.cumsum(bucket_cnt) - bucket_cnt
+            self._block_tables.append((order, bucket_start, bucket_cnt))
+
+        self._flip_masks_cache: dict[int, np.ndarray] = {}
+
+    def __len__(self) -> int:
+        return int(self.alive.sum())
+
+    def _block_values(self, hashes: np.ndarray, block_idx: int) -> np.ndarray:
+        return (hashes >> np.uint64(block_idx * self.block_bits)) & self.block_mask
+
+    def _flip_masks(self, radius: int) -> np.ndarray:
+        """
+        块内所有汉明重量不超过 radius 的掩码
+        """
+        if radius not in self._flip_masks_cache:
+            masks = []
+            for weight in range(radius + 1):
+                for bits in combinations(range(self.block_bits), weight):
+                    mask = 0
+                    for bit in bits:
+                        mask |= 1 << bit
+                    masks.append(mask)
+            self._flip_masks_cache[radius] = np.array(masks, dtype=np.uint64)
+        return self._flip_masks_cache[radius]
+
+    def is_alive(self, idx: int) -> bool:
+        return bool(self.alive[idx])
+
+    def remove(self, idx) -> None:
+        """
+        从索引中移除元素 之后的查询不会再返回它们 支持传入下标数组
+        """
+        self.alive[idx] = False
+
+    def query(self, hash_value: int, max_distance: int) -> List[Tuple[int, int]]:
+        """
+        查询与给定哈希的汉明距离不超过 max_distance 的元素
+
+        Args:
+            hash_value: 64位整数哈希
+            max_distance: 最大汉明距离
+
+        Returns:
+            [(下标, 汉明距离)] 按下标排序
+        """
+        _, item_idx, distance = self.query_many(np.array([hash_value], dtype=np.uint64), max_distance)
+        return list(zip(item_idx.tolist(), distance.tolist()))
+
+    def query_many(
+            self,
+            query_hashes: np.ndarray,
+            max_distance: int,
+            query_alive: Optional[np.ndarray] = None,
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        批量半径查询 找出所有汉明距离不超过 max_distance 的 (查询, 元素) 对
+
+        Args:
+            query_hashes: (Q,) uint64 查询哈希数组
+            max_distance: 最大汉明距离
+            query_alive: (Q,) bool 数组 为 False 的查询会被跳过
+
+        Returns:
+            (查询下标, 元素下标, 汉明距离) 三个等长数组 按 (查询下标, 元素下标) 排序
+        """
+        query_hashes = np.ascontiguousarray(query_hashes, dtype=np.uint64)
+        query_idx = np.arange(len(query_hashes), dtype=np.int64)
+        if query_alive is not None:
+            query_idx = query_idx[query_alive]
+        item_idx = np.flatnonzero(self.alive)
+        if len(query_idx) == 0 or len(item_idx) == 0:
+            return _empty_pairs()
+
+        if self._should_use_mih(query_hashes[query_idx], max_distance, len(item_idx)):
+            return self._mih_pairs(query_hashes, query_idx, max_distance)
+        else:
+            return self._bruteforce_pairs(query_hashes, query_idx, item_idx, max_distance)
+
+    def _should_use_mih(self, query_hashes: np.ndarray, max_distance: int, alive_cnt: int) -> bool:
+        """
+        估算索引需要验证的候选数量 明显少于暴力比较时才使用索引
+        """
+        sub_radius = max_distance // self.block_count
+        masks_cnt = sum(math.comb(self.block_bits, k) for k in range(sub_radius + 1))
+        if masks_cnt * self.block_count >= alive_cnt:  # 枚举量已经超过线性扫描
+            return False
+
+        candidate_cnt = 0
+        bruteforce_cnt = len(query_hashes) * alive_cnt
+        for block_idx, (_, _, bucket_cnt) in enumerate(self._block_tables):
+            query_block = self._block_values(query_hashes, block_idx)
+            for mask in self._flip_masks(sub_radius):
+                candidate_cnt += int(bucket_cnt[(query_block ^ mask).astype(np.int64)].sum())
+            # 候选的验证比暴力比较多了取下标的开销 按4倍估算
+            if candidate_cnt * 4 >= bruteforce_cnt:  # 哈希分布太集中 索引已经没有优势
+                return False
+        return True
+
+    def _mih_pairs(
+            self,
+            query_hashes: np.ndarray,
+            query_idx: np.ndarray,
+            max_distance: int,
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        在每块的分桶表中查找候选并验证距离 同一对可能在多块中命中 最后去重
+        """
+        sub_radius = max_distance // self.block_count
+        query_parts: List[np.ndarray] = []
+        item_parts: List[np.ndarray] = []
+        distance_parts: List[np.ndarray] = []
+        for block_idx, (order, bucket_start, bucket_cnt) in enumerate(self._block_tables):
+            query_block = self._block_values(query_hashes[query_idx], block_idx)
+            for mask in self._flip_masks(sub_radius):
+                keys = (query_block ^ mask).astype(np.int64)
+                counts = bucket_cnt[keys]
+                hit_cnt = int(counts.sum())
+                if hit_cnt == 0:
+                    continue
+
+                # 每个查询命中的桶 展开成 (查询, 元素) 对
+                hit_query = np.repeat(query_idx, counts)
+                offsets = np.arange(hit_cnt, dtype=np.int64) - np.repeat(np.cumsum(counts) - counts, counts)
+                hit_item = order[np.repeat(bucket_start[keys], counts) + offsets]
+
+                keep = self.alive[hit_item]
+                hit_query, hit_item = hit_query[keep], hit_item[keep]
+                self.comparison_cnt += len(hit_query)
+                distance = popcount64(query_hashes[hit_query] ^ self.hashes[hit_item])
+                within = distance <= max_distance
+                query_parts.append(hit_query[within])
+                item_parts.append(hit_item[within])
+                distance_parts.append(distance[within])
+
+        if len(query_parts) == 0:
+            return _empty_pairs()
+
+        pair_query = np.concatenate(query_parts)
+        pair_item = np.concatenate(item_parts)
+        pair_distance = np.concatenate(distance_parts)
+        order = np.lexsort((pair_item, pair_query))
+        pair_query, pair_item, pair_distance = pair_query[order], pair_item[order], pair_distance[order]
+        first = np.ones(len(pair_query), dtype=bool)
+        first[1:] = (pair_query[1:] != pair_query[:-1]) | (pair_item[1:] != pair_item[:-1])
+        return pair_query[first], pair_item[first], pair_distance[first]
+
+    def _bruteforce_pairs(
+            self,
+            query_hashes: np.ndarray,
+            query_idx: np.ndarray,
+            item_idx: np.ndarray,
+            max_distance: int,
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        分块计算距离矩阵 找出所有距离不超过 max_distance 的对
+        """
+        query_parts: List[np.ndarray] = []
+        item_parts: List[np.ndarray] = []
+        distance_parts: List[np.ndarray] = []
+        for row_start, col_start, distance in iter_distance_blocks(query_hashes[query_idx], self.hashes[item_idx]):
+            self.comparison_cnt += distance.size
+            rows, cols = np.nonzero(distance <= max_distance)
+            query_parts.append(query_idx[row_start + rows])
+            item_parts.append(item_idx[col_start + cols])
+            distance_parts.append(distance[rows, cols])
+
+        if len(query_parts) == 0:
+            return _empty_pairs()
+        pair_query = np.concatenate(query_parts)
+        pair_item = np.concatenate(item_parts)
+        order = np.lexsort((pair_item, pair_query))
+        return pair_query[order], pair_item[order], np.concatenate(distance_parts)[order]
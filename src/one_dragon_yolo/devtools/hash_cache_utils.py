@@ -0,0 +1,175 @@
+import os
+import sqlite3
+from typing import Dict, List, Optional, Set, Tuple
+
+HASH_CACHE_FILE_NAME = '.image_hash_cache.sqlite3'
+
+
+def _to_signed(hash_value: int) -> int:
+    """
+    sqlite 只支持有符号的64位整数
+    """
+    return hash_value - (1 << 64) if hash_value >= (1 << 63) else hash_value
+
+
+def _to_unsigned(hash_value: int) -> int:
+    return hash_value + (1 << 64) if hash_value < 0 else hash_value
+
+
+class ImageHashCache:
+    """
+    持久化的图片哈希缓存 以 sqlite 文件保存在根文件夹中
+
+    每条记录以 (相对路径, 哈希种类) 为键 同时记录文件大小和修改时间。
+    读取时文件大小或修改时间不一致的记录视为失效，需要重新计算。
+
+    另外记录已经去重过的图片 (accepted_image) 供增量去重使用，新增的图片只需要与这些图片比较。
+    """
+
+    def __init__(self, root_folder: str, file_name: str = HASH_CACHE_FILE_NAME):
+        """
+        Args:
+            root_folder: 根文件夹路径 缓存中保存的是相对这个文件夹的路径
+            file_name: 缓存文件名
+        """
+        self.root_folder: str = root_folder
+        self.db_path: str = os.path.join(root_folder, file_name)
+        self.hit_cnt: int = 0  # 命中次数
+        self.miss_cnt: int = 0  # 未命中或失效的次数
+
+        self._conn = sqlite3.connect(self.db_path)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS image_hash ('
+            ' rel_path TEXT NOT NULL,'
+            ' kind TEXT NOT NULL,'
+            ' size INTEGER NOT NULL,'
+            ' mtime_ns INTEGER NOT NULL,'
+            ' hash INTEGER NOT NULL,'
+            ' PRIMARY KEY (rel_path, kind))'
+        )
+        self._conn.execute('CREATE TABLE IF NOT EXISTS accepted_image (rel_path TEXT PRIMARY KEY)')
+        self._conn.commit()
+
+        # 按种类一次性读取全部记录 避免每张图片查询一次数据库
+        self._entries: Dict[str, Dict[str, Tuple[int, int, int]]] = {}
+        self._pending: List[Tuple[str, str, int, int, int]] = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _rel_path(self, image_path: str) -> str:
+        return os.path.relpath(image_path, self.root_folder).replace('\\', '/')
+
+    def _load_kind(self, kind: str) -> Dict[str, Tuple[int, int, int]]:
+        if kind not in self._entries:
+            rows = self._conn.execute(
+                'SELECT rel_path, size, mtime_ns, hash FROM image_hash WHERE kind = ?', (kind,)
+            )
+            self._entries[kind] = {row[0]: (row[1], row[2], row[3]) for row in rows}
+        return self._entries[kind]
+
+    def get(self, image_path: str, kind: str = 'phash') -> Optional[int]:
+        """
+        读取一张图片的缓存哈希
+
+        Args:
+            image_path: 图片路径
+            kind: 哈希种类
+
+        Returns:
+            64位整数哈希 没有缓存或缓存已失效时返回 None
+        """
+        entry = self._load_kind(kind).get(self._rel_path(image_path))
+        if entry is not None:
+            try:
+                stat = os.stat(image_path)
+            except OSError:
+                stat = None
+            if stat is not None and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+                self.hit_cnt += 1
+                return _to_unsigned(entry[2])
+
+        self.miss_cnt += 1
+        return None
+
+    def put(self, image_path: str, hash_value: int, kind: str = 'phash') -> None:
+        """
+        写入一张图片的哈希 调用 commit 或 close 后才会保存到文件中
+
+        Args:
+            image_path: 图片路径
+            hash_value: 64位整数哈希
+            kind: 哈希种类
+        """
+        try:
+            stat = os.stat(image_path)
+        except OSError:
+            return
+        rel_path = self._rel_path(image_path)
+        signed_hash = _to_signed(int(hash_value))
+        self._load_kind(kind)[rel_path] = (stat.st_size, stat.st_mtime_ns, signed_hash)
+        self._pending.append((rel_path, kind, stat.st_size, stat.st_mtime_ns, signed_hash))
+
+    def remove(self, image_path: str) -> None:
+        """
+        删除一张图片的全部缓存 图片被删除时调用
+        """
+        self._flush()  # 先写入待保存的记录 避免之后被重新插入
+        rel_path = self._rel_path(image_path)
+        for entries in self._entries.values():
+            entries.pop(rel_path, None)
+        self._conn.execute('DELETE FROM image_hash WHERE rel_path = ?', (rel_path,))
+        self._conn.execute('DELETE FROM accepted_image WHERE rel_path = ?', (rel_path,))
+
+    def get_accepted(self) -> Set[str]:
+        """
+        读取已经去重过的图片
+
+        Returns:
+            相对根文件夹的路径集合 分隔符统一为 /
+        """
+        return {row[0] for row in self._conn.execute('SELECT rel_path FROM accepted_image')}
+
+    def to_rel_path(self, image_path: str) -> str:
+        """
+        图片在缓存中使用的相对路径 与 get_accepted 的结果一致
+        """
+        return self._rel_path(image_path)
+
+    def add_accepted(self, image_paths: List[str]) -> None:
+        """
+        记录已经去重过的图片 调用 commit 或 close 后才会保存到文件中
+
+        Args:
+            image_paths: 图片路径列表
+        """
+        self._conn.executemany('INSERT OR IGNORE INTO accepted_image VALUES (?)',
+                               [(self._rel_path(path),) for path in image_paths])
+
+    def remove_accepted(self, rel_paths: List[str]) -> None:
+        """
+        移除已经不存在的图片记录
+
+        Args:
+            rel_paths: 相对根文件夹的路径列表 即 get_accepted 的结果
+        """
+        self._conn.executemany('DELETE FROM accepted_image WHERE rel_path = ?', [(path,) for path in rel_paths])
+
+    def commit(self) -> None:
+        """
+        将新写入的哈希保存到文件中
+        """
+        self._flush()
+        self._conn.commit()
+
+    def _flush(self) -> None:
+        if len(self._pending) > 0:
+            self._conn.executemany('INSERT OR REPLACE INTO image_hash VALUES (?, ?, ?, ?, ?)', self._pending)
+            self._pending.clear()
+
+    def close(self) -> None:
+        self.commit()
+        self._conn.close()
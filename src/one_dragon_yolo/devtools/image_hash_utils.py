@@ -0,0 +1,345 @@
+"""
+感知哈希的快速解码前端
+
+感知哈希只需要 32*32 的灰度图，因此不需要把原图完整解码成彩色图：
+- JPEG 使用 PIL 的 draft() 在 DCT 阶段直接缩小到 1/8 并输出灰度
+- 其他格式使用 cv2.IMREAD_REDUCED_GRAYSCALE_2 直接解码成缩小一半的灰度图
+之后用 LANCZOS 缩放到 32*32 (与 imagehash.phash 一致)，
+再由 phash_batch 对多张图片一起做 DCT、取中位数和打包。
+
+与 imagehash.phash(Image.open(path)) 的结果不是逐位一致的，
+在 1920*1080 的游戏截图上测得汉明距离最大为 2、平均约 0.5 (JPEG 平均约 0.1)，
+远小于常用阈值对应的距离 (相似度 0.85 对应 9)。
+PNG 的耗时主要在 zlib 解压，收益有限；JPEG 可以快 3 倍以上。
+"""
+import hashlib
+import json
+import os
+from typing import List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image
+
+JPEG_EXTENSIONS = {'.jpg', '.jpeg'}
+HASH_IMAGE_MIN_SIZE = 64  # 缩小解码后最短边的下限 保证缩放到 32*32 前还有足够的信息
+HASH_SIZE = 8  # 哈希矩阵边长 8*8=64位
+HASH_TILE_SIZE = 32  # 计算 DCT 的灰度图边长 与 imagehash.phash 的 hash_size * highfreq_factor 一致
+PIXEL_TILE_SIZE = 64  # 像素级比较 (SSIM / MSE) 使用的灰度图边长
+ROI_FILE_NAME = 'similarity_roi.json'  # 项目的感兴趣区域配置 保存在根文件夹中
+
+
+def _dct_matrix(n: int, k: int) -> np.ndarray:
+    """
+    未归一化的 DCT-II 矩阵的前 k 行 与 scipy.fftpack.dct 的默认参数一致
+    y[i] = 2 * sum(x[j] * cos(pi * i * (2j + 1) / (2n)))
+    """
+    i = np.arange(k, dtype=np.float64)[:, None]
+    j = np.arange(n, dtype=np.float64)[None, :]
+    return 2 * np.cos(np.pi * i * (2 * j + 1) / (2 * n))
+
+
+_DCT_LOW = _dct_matrix(HASH_TILE_SIZE, HASH_SIZE)  # (8, 32) 只需要低频部分
+
+
+class HashRoi:
+    """
+    计算哈希时使用的感兴趣区域 坐标都是相对图片宽高的比例 (0-1) 格式为 (x1, y1, x2, y2)
+
+    - crop: 只保留这个矩形内的画面
+    - ignore: 忽略这些矩形 (例如小地图、技能栏等固定的界面) 坐标相对原图
+
+    被忽略的区域用剩余画面的平均灰度填充，不再带有任何结构，因此不会让不同的画面变得相似。
+    """
+
+    def __init__(self, crop: Optional[Sequence[float]] = None,
+                 ignore: Optional[Sequence[Sequence[float]]] = None):
+        self.crop: Optional[Tuple[float, float, float, float]] = None if crop is None else _check_rect(crop)
+        self.ignore: List[Tuple[float, float, float, float]] = [_check_rect(rect) for rect in (ignore or [])]
+
+    @staticmethod
+    def from_dict(data: dict) -> 'HashRoi':
+        return HashRoi(crop=data.get('crop'), ignore=data.get('ignore'))
+
+    @staticmethod
+    def load(file_path: str) -> Optional['HashRoi']:
+        """
+        从 json 文件读取 文件不存在时返回 None
+
+        文件格式: {"crop": [x1, y1, x2, y2], "ignore": [[x1, y1, x2, y2], ...]} 两项都可以省略
+        """
+        if not os.path.exists(file_path):
+            return None
+        with open(file_path, 'r', encoding='utf-8') as file:
+            return HashRoi.from_dict(json.load(file))
+
+    def to_dict(self) -> dict:
+        return {
+            'crop': None if self.crop is None else list(self.crop),
+            'ignore': [list(rect) for rect in self.ignore],
+        }
+
+    def is_empty(self) -> bool:
+        return self.crop is None and len(self.ignore) == 0
+
+    def signature(self) -> str:
+        """
+        区域配置的短签名 用于区分哈希缓存 区域变化后缓存自动失效
+        """
+        text = json.dumps(self.to_dict(), sort_keys=True)
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()[:8]
+
+    def apply(self, gray: np.ndarray) -> np.ndarray:
+        """
+        对灰度图应用感兴趣区域
+
+        Args:
+            gray: 完整画面的灰度图 可以是缩小解码后的
+
+        Returns:
+            np.ndarray: 裁剪并填充忽略区域后的灰度图
+        """
+        height, width = gray.shape[:2]
+        keep_mask = None
+        if len(self.ignore) > 0:
+            keep_mask = np.ones((height, width), dtype=bool)
+            for rect in self.ignore:
+                x1, y1, x2, y2 = _to_pixel_rect(rect, width, height)
+                keep_mask[y1:y2, x1:x2] = False
+
+        if self.crop is not None:
+            x1, y1, x2, y2 = _to_pixel_rect(self.crop, width, height)
+            gray = gray[y1:y2, x1:x2]
+            if keep_mask is not None:
+                keep_mask = keep_mask[y1:y2, x1:x2]
+
+        if keep_mask is not None and not keep_mask.all():
+            fill_value = gray[keep_mask].mean() if keep_mask.any() else 0
+            gray = gray.copy()
+            gray[~keep_mask] = np.uint8(round(float(fill_value)))
+        return gray
+
+
+def _check_rect(rect: Sequence[float]) -> Tuple[float, float, float, float]:
+    x1, y1, x2, y2 = (float(v) for v in rect)
+    if not (0 <= x1 < x2 <= 1 and 0 <= y1 < y2 <= 1):
+        raise ValueError(f'区域需要是 0-1 之间的 (x1, y1, x2, y2): {rect}')
+    return x1, y1, x2, y2
+
+
+def _to_pixel_rect(rect: Tuple[float, float, float, float], width: int, height: int) -> Tuple[int, int, int, int]:
+    x1, y1, x2, y2 = rect
+    return (int(round(x1 * width)), int(round(y1 * height)),
+            max(int(round(x2 * width)), int(round(x1 * width)) + 1),
+            max(int(round(y2 * height)), int(round(y1 * height)) + 1))
+
+
+def load_gray_for_hash(image_path: str) -> Optional[np.ndarray]:
+    """
+    以缩小的灰度图读取图片 用于计算感知哈希
+
+    Args:
+        image_path: 图片文件路径
+
+    Returns:
+        np.ndarray: uint8 灰度图 读取失败 (包括不是图片的文件) 时返回 None
+    """
+    if os.path.splitext(image_path)[1].lower() in JPEG_EXTENSIONS:
+        try:
+            with Image.open(image_path) as img:
+                draft_size = (max(HASH_IMAGE_MIN_SIZE, img.width // 8), max(HASH_IMAGE_MIN_SIZE, img.height // 8))
+                img.draft('L', draft_size)
+                return np.asarray(img.convert('L'))
+        except (OSError, ValueError):  # PIL 无法识别或文件已损坏
+            return None
+
+    # 使用 np.fromfile + imdecode 兼容中文路径
+    data = np.fromfile(image_path, dtype=np.uint8)
+    gray = cv2.imdecode(data, cv2.IMREAD_REDUCED_GRAYSCALE_2)
+    if gray is not None and min(gray.shape[:2]) >= HASH_IMAGE_MIN_SIZE:
+        return gray
+
+    # 小图不缩小 cv2 不支持的格式 (例如 gif) 交给 PIL
+    gray = cv2.imdecode(data, cv2.IMREAD_GRAYSCALE)
+    if gray is not None:
+        return gray
+    try:
+        with Image.open(image_path) as img:
+            return np.asarray(img.convert('L'))
+    except (OSError, ValueError):  # PIL 无法识别或文件已损坏
+        return None
+
+
+def bgr_to_gray(image: np.ndarray) -> np.ndarray:
+    """
+    将 OpenCV 格式的图片直接转换成灰度图 不经过 RGB 和 PIL
+
+    Args:
+        image: BGR / BGRA / 灰度 的 OpenCV 图片
+
+    Returns:
+        np.ndarray: uint8 灰度图
+    """
+    if image.ndim == 2:
+        return image
+    if image.shape[2] == 4:
+        return cv2.cvtColor(image, cv2.COLOR_BGRA2GRAY)
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+
+def reduce_gray_for_hash(gray: np.ndarray) -> np.ndarray:
+    """
+    将已经解码的灰度图缩小一半 与 cv2.IMREAD_REDUCED_GRAYSCALE_2 的效果一致
+
+    Args:
+        gray: uint8 灰度图
+
+    Returns:
+        np.ndarray: 缩小后的灰度图 太小的图片原样返回
+    """
+    if min(gray.shape[:2]) // 2 < HASH_IMAGE_MIN_SIZE:
+        return gray
+    return cv2.resize(gray, None, fx=0.5, fy=0.5, interpolation=cv2.INTER_AREA)
+
+
+def gray_to_hash_tile(gray: np.ndarray) -> np.ndarray:
+    """
+    将灰度图缩放成计算感知哈希用的 32*32 小图 与 imagehash.phash 一样使用 LANCZOS
+
+    Args:
+        gray: uint8 灰度图
+
+    Returns:
+        np.ndarray: (32, 32) uint8 灰度图
+    """
+    tile = Image.fromarray(gray).resize((HASH_TILE_SIZE, HASH_TILE_SIZE), Image.Resampling.LANCZOS)
+    return np.asarray(tile)
+
+
+def load_hash_tile(image_path: str, roi: Optional[HashRoi] = None) -> Optional[np.ndarray]:
+    """
+    读取图片文件 得到计算感知哈希用的 32*32 灰度图
+
+    Args:
+        image_path: 图片文件路径
+        roi: 感兴趣区域 None 表示使用完整画面
+
+    Returns:
+        np.ndarray: (32, 32) uint8 灰度图 读取失败时返回 None
+    """
+    gray = load_gray_for_hash(image_path)
+    if gray is None:
+        return None
+    if roi is not None:
+        gray = roi.apply(gray)
+    return gray_to_hash_tile(gray)
+
+
+def _pack_bit_rows(bits: np.ndarray) -> np.ndarray:
+    """
+    将 (N, 64) 的布尔数组按行打包成 uint64 高位对应第一个元素
+    """
+    packed = np.packbits(bits, axis=1)  # (N, 8) 高位在前
+    return np.ascontiguousarray(packed).view('>u8').reshape(-1).astype(np.uint64)
+
+
+def ahash_batch(tiles: np.ndarray) -> np.ndarray:
+    """
+    批量计算均值哈希 将 32*32 灰度图按 4*4 的块取平均缩小到 8*8 后与均值比较
+
+    比 imagehash.average_hash 少一次缩放 结果不完全一致 只用于预筛选
+
+    Args:
+        tiles: (N, 32, 32) 灰度图数组
+
+    Returns:
+        np.ndarray: (N,) uint64 数组
+    """
+    tiles = np.asarray(tiles, dtype=np.float32)
+    if len(tiles) == 0:
+        return np.zeros(0, dtype=np.uint64)
+    block = HASH_TILE_SIZE // HASH_SIZE
+    small = tiles.reshape(len(tiles), HASH_SIZE, block, HASH_SIZE, block).mean(axis=(2, 4))
+    flat = small.reshape(len(tiles), HASH_SIZE * HASH_SIZE)
+    return _pack_bit_rows(flat > flat.mean(axis=1, keepdims=True))
+
+
+def dhash_batch(tiles: np.ndarray) -> np.ndarray:
+    """
+    批量计算差异哈希 将 32*32 灰度图缩小到 9*8 后比较左右相邻的像素
+
+    比 imagehash.dhash 少一次缩放 结果不完全一致 只用于预筛选
+
+    Args:
+        tiles: (N, 32, 32) 灰度图数组
+
+    Returns:
+        np.ndarray: (N,) uint64 数组
+    """
+    if len(tiles) == 0:
+        return np.zeros(0, dtype=np.uint64)
+    small = np.stack([
+        cv2.resize(np.asarray(tile, dtype=np.float32), (HASH_SIZE + 1, HASH_SIZE), interpolation=cv2.INTER_AREA)
+        for tile in tiles
+    ])
+    bits = small[:, :, 1:] > small[:, :, :-1]
+    return _pack_bit_rows(bits.reshape(len(tiles), HASH_SIZE * HASH_SIZE))
+
+
+def phash_batch(tiles: np.ndarray) -> np.ndarray:
+    """
+    批量计算感知哈希 DCT、中位数和打包都是向量化的 结果直接是 uint64
+
+    与 imagehash.phash 对同一张 32*32 灰度图的结果逐位一致，
+    只有低频系数与中位数的差小于浮点误差时才可能有差别。
+
+    Args:
+        tiles: (N, 32, 32) 灰度图数组
+
+    Returns:
+        np.ndarray: (N,) uint64 数组 高位对应哈希矩阵的第一个元素
+    """
+    tiles = np.asarray(tiles, dtype=np.float64)
+    if len(tiles) == 0:
+        return np.zeros(0, dtype=np.uint64)
+    dct_low = _DCT_LOW @ tiles @ _DCT_LOW.T  # (N, 8, 8) 先对列再对行做 DCT 只保留低频
+    flat = dct_low.reshape(len(tiles), HASH_SIZE * HASH_SIZE)
+    return _pack_bit_rows(flat > np.median(flat, axis=1, keepdims=True))
+
+
+def calculate_phash_file(image_path: str, roi: Optional[HashRoi] = None) -> Optional[int]:
+    """
+    使用快速解码前端计算图片文件的感知哈希
+
+    Args:
+        image_path: 图片文件路径
+        roi: 感兴趣区域 None 表示使用完整画面
+
+    Returns:
+        int: 64位感知哈希 读取失败时返回 None
+    """
+    tile = load_hash_tile(image_path, roi)
+    if tile is None:
+        return None
+    return int(phash_batch(tile[None])[0])
+
+
+def load_pixel_tile(image_path: str, size: int = PIXEL_TILE_SIZE,
+                    roi: Optional[HashRoi] = None) -> Optional[np.ndarray]:
+    """
+    读取图片文件 得到像素级比较用的缩小灰度图
+
+    Args:
+        image_path: 图片文件路径
+        size: 缩小后的边长
+        roi: 感兴趣区域 None 表示使用完整画面
+
+    Returns:
+        np.ndarray: (size, size) float32 灰度图 读取失败时返回 None
+    """
+    gray = load_gray_for_hash(image_path)
+    if gray is None:
+        return None
+    if roi is not None:
+        gray = roi.apply(gray)
+    return cv2.resize(gray, (size, size), interpolation=cv2.INTER_AREA).astype(np.float32)
@@ -0,0 +1,197 @@
+"""
+标签统计
+
+通过 label_store_utils 一次读入整个标签文件夹的标签 之后的统计都是对整列数组的 np.bincount 运算
+- 每个类别的标签数量和出现的图片数量
+- 标签大小 (sqrt(w*h)) 和宽高比 (log2(w/h)) 的直方图 包括每个类别的
+- 检查图片中是否有它应有的类别
+"""
+import csv
+import json
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from one_dragon_yolo.devtools import label_store_utils
+from one_dragon_yolo.devtools.label_store_utils import LabelStore
+
+ASPECT_LOG2_RANGE = 4  # 宽高比的直方图范围 [1/16, 16]
+
+
+def load_labels(labels_dir: str) -> LabelStore:
+    """
+    读取文件夹中的全部标签 文件夹中已有标签汇总时只重新读取变化了的txt
+    只在内存中生成汇总 统计不会在标签文件夹中写入文件
+
+    Args:
+        labels_dir: YOLO txt 标签文件夹
+
+    Returns:
+        LabelStore: 全部标签
+    """
+    return label_store_utils.load_label_store(labels_dir, persist=False)
+
+
+def get_class_cnt(store: LabelStore, class_cnt: Optional[int] = None) -> int:
+    """
+    类别数量 未指定或小于出现过的最大类别+1时 使用出现过的最大类别+1
+    """
+    observed_cnt = int(store.cls.max()) + 1 if len(store.cls) > 0 else 0
+    return max(class_cnt or 0, observed_cnt)
+
+
+def count_boxes_per_class(store: LabelStore, class_cnt: Optional[int] = None) -> np.ndarray:
+    """
+    Returns:
+        np.ndarray: 每个类别的标签数量
+    """
+    return np.bincount(store.cls, minlength=get_class_cnt(store, class_cnt))
+
+
+def count_images_per_class(store: LabelStore, class_cnt: Optional[int] = None) -> np.ndarray:
+    """
+    Returns:
+        np.ndarray: 每个类别出现在多少张图片中 同一张图片中的多个标签只算一次
+    """
+    class_cnt = get_class_cnt(store, class_cnt)
+    if class_cnt == 0:
+        return np.zeros(0, dtype=np.int64)
+    keys = np.unique(store.box_data_idx().astype(np.int64) * class_cnt + store.cls)
+    return np.bincount(keys % class_cnt, minlength=class_cnt)
+
+
+def histogram_by_class(values: np.ndarray, cls: np.ndarray, bin_edges: np.ndarray, class_cnt: int) -> np.ndarray:
+    """
+    每个类别的直方图 超出范围的值放到两端的桶中
+
+    Args:
+        values: 每个标签的值
+        cls: 每个标签的类别
+        bin_edges: 桶的边界 长度为 桶数量+1
+        class_cnt: 类别数量
+
+    Returns:
+        np.ndarray: (类别数量, 桶数量)
+    """
+    bin_cnt = len(bin_edges) - 1
+    bin_idx = np.clip(np.searchsorted(bin_edges, values, side='right') - 1, 0, bin_cnt - 1)
+    counts = np.bincount(cls.astype(np.int64) * bin_cnt + bin_idx, minlength=class_cnt * bin_cnt)
+    return counts.reshape(class_cnt, bin_cnt)
+
+
+def find_missing_expected_class(store: LabelStore, expected_cls: np.ndarray) -> List[str]:
+    """
+    找出没有应有类别标签的图片 大概率是标注错了
+
+    Args:
+        store: 全部标签
+        expected_cls: 每个数据应有的类别 顺序与 store.data_ids 一致 -1 表示不检查
+
+    Returns:
+        List[str]: 数据ID列表
+    """
+    box_data_idx = store.box_data_idx()
+    matched = store.cls == expected_cls[box_data_idx]
+    has_expected = np.zeros(len(store), dtype=bool)
+    has_expected[box_data_idx[matched]] = True
+    missing = np.flatnonzero((expected_cls >= 0) & ~has_expected)
+    return [store.data_ids[idx] for idx in missing.tolist()]
+
+
+def compute_label_stats(store: LabelStore, class_cnt: Optional[int] = None,
+                        class_names: Optional[List[str]] = None, bin_cnt: int = 20) -> Dict:
+    """
+    计算全部统计
+
+    Args:
+        store: 全部标签
+        class_cnt: 类别数量 为空时使用出现过的最大类别+1
+        class_names: 类别名称 为空时使用类别下标
+        bin_cnt: 直方图的桶数量
+
+    Returns:
+        Dict: 可以保存为 JSON 的统计结果
+    """
+    class_cnt = get_class_cnt(store, class_cnt)
+    cls = store.cls.astype(np.int64)
+    w = store.xywh[:, 2].astype(np.float64)
+    h = store.xywh[:, 3].astype(np.float64)
+
+    size = np.sqrt(w * h)
+    aspect = np.log2(np.maximum(w, 1e-9) / np.maximum(h, 1e-9))
+    size_edges = np.linspace(0, 1, bin_cnt + 1)
+    aspect_edges = np.linspace(-ASPECT_LOG2_RANGE, ASPECT_LOG2_RANGE, bin_cnt + 1)
+    size_hist = histogram_by_class(size, cls, size_edges, class_cnt)
+    aspect_hist = histogram_by_class(aspect, cls, aspect_edges, class_cnt)
+
+    box_cnt = np.bincount(cls, minlength=class_cnt)
+    image_cnt = count_images_per_class(store, class_cnt)
+    safe_cnt = np.maximum(box_cnt, 1)
+    mean_w = np.bincount(cls, weights=w, minlength=class_cnt) / safe_cnt
+    mean_h = np.bincount(cls, weights=h, minlength=class_cnt) / safe_cnt
+
+    names = class_names if class_names is not None else [str(idx) for idx in range(class_cnt)]
+    classes = []
+    for idx in range(class_cnt):
+        classes.append({
+            'class_id': idx,
+            'name': names[idx] if idx < len(names) else str(idx),
+            'boxes': int(box_cnt[idx]),
+            'images': int(image_cnt[idx]),
+            'mean_w': round(float(mean_w[idx]), 6),
+            'mean_h': round(float(mean_h[idx]), 6),
+            'size_hist': size_hist[idx].tolist(),
+            'aspect_hist': aspect_hist[idx].tolist(),
+        })
+
+    return {
+        'image_cnt': len(store),
+        'empty_image_cnt': int(np.count_nonzero(np.diff(store.offsets) == 0)),
+        'box_cnt': int(len(cls)),
+        'size_bin_edges': size_edges.tolist(),
+        'aspect_log2_bin_edges': aspect_edges.tolist(),
+        'size_hist': size_hist.sum(axis=0).tolist(),
+        'aspect_hist': aspect_hist.sum(axis=0).tolist(),
+        'classes': classes,
+    }
+
+
+def save_label_stats(stats: Dict, json_path: Optional[str] = None, csv_path: Optional[str] = None) -> None:
+    """
+    保存统计结果 JSON 包含全部内容 CSV 每行一个类别 不包含直方图
+
+    Args:
+        stats: compute_label_stats 的结果
+        json_path: JSON 文件路径
+        csv_path: CSV 文件路径
+    """
+    if json_path is not None:
+        with open(json_path, 'w', encoding='utf-8') as file:
+            json.dump(stats, file, ensure_ascii=False, indent=2)
+    if csv_path is not None:
+        columns = ['class_id', 'name', 'boxes', 'images', 'mean_w', 'mean_h']
+        with open(csv_path, 'w', encoding='utf-8', newline='') as file:
+            writer = csv.DictWriter(file, fieldnames=columns, extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(stats['classes'])
+
+
+def report_label_stats(labels_dir: str, class_names: Optional[List[str]] = None,
+                       json_path: Optional[str] = None, csv_path: Optional[str] = None) -> Dict:
+    """
+    统计一个标签文件夹 并保存报告
+
+    Args:
+        labels_dir: YOLO txt 标签文件夹
+        class_names: 类别名称
+        json_path: JSON 报告路径
+        csv_path: CSV 报告路径
+
+    Returns:
+        Dict: 统计结果
+    """
+    store = load_labels(labels_dir)
+    stats = compute_label_stats(store, class_cnt=len(class_names) if class_names is not None else None,
+                                class_names=class_names)
+    save_label_stats(stats, json_path=json_path, csv_path=csv_path)
+    return stats
@@ -0,0 +1,219 @@
+"""
+数据集项目的标签汇总文件
+
+yolo/ 文件夹中有成千上万个很小的 txt 文件 每个工具每次都要逐个打开
+在网络盘上 打开文件的开销远大于读取内容
+这里把全部标签按列保存在 yolo/.label_store.npz 中 读取时只需要打开一个文件
+
+- data_id: 每个标签文件的数据ID
+- mtime_ns / size: 标签文件的修改时间和大小 用于增量更新
+- offsets: 第 i 个标签文件的标签是 [offsets[i], offsets[i+1])
+- cls / xywh: 全部标签的类别和相对坐标
+"""
+import os
+from typing import Dict, List, Optional
+
+import numpy as np
+from tqdm import tqdm
+
+from one_dragon_yolo.devtools import yolo_label_utils
+
+LABEL_STORE_FILE_NAME = '.label_store.npz'
+
+
+class LabelStore:
+    """一个 yolo 标签文件夹的全部标签 按列保存"""
+
+    def __init__(self, data_ids: List[str], mtime_ns: np.ndarray, sizes: np.ndarray,
+                 offsets: np.ndarray, cls: np.ndarray, xywh: np.ndarray):
+        """
+        Args:
+            data_ids: 数据ID列表
+            mtime_ns: 每个标签文件的修改时间
+            sizes: 每个标签文件的大小
+            offsets: 长度为 数据数量+1 第 i 个数据的标签是 [offsets[i], offsets[i+1])
+            cls: 全部标签的类别
+            xywh: 全部标签的相对坐标 (M, 4)
+        """
+        self.data_ids: List[str] = data_ids
+        self.mtime_ns: np.ndarray = mtime_ns
+        self.sizes: np.ndarray = sizes
+        self.offsets: np.ndarray = offsets
+        self.cls: np.ndarray = cls
+        self.xywh: np.ndarray = xywh
+        self._id_2_idx: Dict[str, int] = {data_id: idx for idx, data_id in enumerate(data_ids)}
+
+    def __len__(self) -> int:
+        return len(self.data_ids)
+
+    def __contains__(self, data_id: str) -> bool:
+        return data_id in self._id_2_idx
+
+    def get(self, data_id: str) -> Optional[np.ndarray]:
+        """
+        Args:
+            data_id: 数据ID
+
+        Returns:
+            形状为 (n, 5) 的标签数组 没有这个标签文件时返回 None
+        """
+        idx = self._id_2_idx.get(data_id)
+        if idx is None:
+            return None
+        start, end = self.offsets[idx], self.offsets[idx + 1]
+        labels = np.empty((end - start, yolo_label_utils.LABEL_COLUMNS), dtype=np.float32)
+        labels[:, 0] = self.cls[start:end]
+        labels[:, 1:] = self.xywh[start:end]
+        return labels
+
+    def to_dict(self) -> Dict[str, np.ndarray]:
+        """
+        Returns:
+            Dict[str, np.ndarray]: 数据ID -> 形状为 (n, 5) 的标签数组
+        """
+        return {data_id: self.get(data_id) for data_id in self.data_ids}
+
+    def is_unchanged(self, data_id: str, mtime_ns: int, size: int) -> bool:
+        """
+        标签文件的修改时间和大小都与汇总中的一致
+        """
+        idx = self._id_2_idx.get(data_id)
+        return idx is not None and self.mtime_ns[idx] == mtime_ns and self.sizes[idx] == size
+
+    def box_data_idx(self) -> np.ndarray:
+        """
+        Returns:
+            np.ndarray: 每个标签所属数据在 data_ids 中的下标
+        """
+        return np.repeat(np.arange(len(self.data_ids)), np.diff(self.offsets))
+
+    @staticmethod
+    def from_labels(data_ids: List[str], mtime_ns: List[int], sizes: List[int],
+                    labels_list: List[np.ndarray]) -> 'LabelStore':
+        """
+        由每个数据的标签数组创建
+
+        Args:
+            data_ids: 数据ID列表
+            mtime_ns: 每个标签文件的修改时间
+            sizes: 每个标签文件的大小
+            labels_list: 每个数据的 (n, 5) 标签数组
+        """
+        counts = np.array([len(labels) for labels in labels_list], dtype=np.int64)
+        offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        all_labels = yolo_label_utils.concat_labels(labels_list)
+        return LabelStore(
+            data_ids=list(data_ids),
+            mtime_ns=np.array(mtime_ns, dtype=np.int64),
+            sizes=np.array(sizes, dtype=np.int64),
+            offsets=offsets,
+            cls=all_labels[:, 0].astype(np.int32),
+            xywh=np.ascontiguousarray(all_labels[:, 1:], dtype=np.float32),
+        )
+
+    @staticmethod
+    def load(store_path: str) -> Optional['LabelStore']:
+        """
+        读取汇总文件 文件不存在或损坏时返回 None
+        """
+        if not os.path.exists(store_path):
+            return None
+        try:
+            with np.load(store_path) as data:
+                return LabelStore(
+                    data_ids=data['data_id'].tolist(),
+                    mtime_ns=data['mtime_ns'],
+                    sizes=data['size'],
+                    offsets=data['offsets'],
+                    cls=data['cls'],
+                    xywh=data['xywh'],
+                )
+        except Exception as e:
+            print(f'读取标签汇总文件失败 {store_path}: {str(e)}')
+            return None
+
+    def save(self, store_path: str) -> None:
+        """
+        保存到汇总文件 先写入临时文件再替换 避免中途失败留下损坏的文件
+        """
+        tmp_path = store_path + '.tmp'
+        with open(tmp_path, 'wb') as file:
+            np.savez(file,
+                     data_id=np.array(self.data_ids, dtype=np.str_),
+                     mtime_ns=self.mtime_ns, size=self.sizes, offsets=self.offsets,
+                     cls=self.cls, xywh=self.xywh)
+        os.replace(tmp_path, store_path)
+
+
+def get_label_store_path(yolo_txt_dir: str) -> str:
+    """
+    标签汇总文件的路径
+    """
+    return os.path.join(yolo_txt_dir, LABEL_STORE_FILE_NAME)
+
+
+def update_label_store(yolo_txt_dir: str, persist: bool = True) -> LabelStore:
+    """
+    扫描标签文件夹 只重新读取修改时间或大小变化了的 txt 文件 删除的文件从汇总中去掉
+    有变化时保存汇总文件
+
+    Args:
+        yolo_txt_dir: YOLO txt 标签文件夹
+        persist: 是否保存汇总文件 False 时只在内存中生成 不在文件夹中写入任何文件
+
+    Returns:
+        LabelStore: 更新后的标签汇总
+    """
+    store_path = get_label_store_path(yolo_txt_dir)
+    old_store = LabelStore.load(store_path)
+
+    data_ids: List[str] = []
+    mtime_ns: List[int] = []
+    sizes: List[int] = []
+    labels_list: List[np.ndarray] = []
+    changed = old_store is None
+    reload_cnt = 0
+    entries = sorted((entry for entry in os.scandir(yolo_txt_dir)
+                      if entry.name.endswith('.txt') and entry.is_file()),
+                     key=lambda entry: entry.name)
+    for entry in tqdm(entries, desc='更新标签汇总'):
+        data_id = entry.name[:-4]
+        stat = entry.stat()
+        if old_store is not None and old_store.is_unchanged(data_id, stat.st_mtime_ns, stat.st_size):
+            labels = old_store.get(data_id)
+        else:
+            labels = yolo_label_utils.read_label_txt(entry.path)
+            changed = True
+            reload_cnt += 1
+        data_ids.append(data_id)
+        mtime_ns.append(stat.st_mtime_ns)
+        sizes.append(stat.st_size)
+        labels_list.append(labels)
+
+    if old_store is not None and len(old_store) != len(data_ids):
+        changed = True  # 有标签文件被删除
+
+    store = LabelStore.from_labels(data_ids, mtime_ns, sizes, labels_list)
+    if changed and persist:
+        store.save(store_path)
+        print(f'标签汇总已更新 重新读取 {reload_cnt} 个文件 共 {len(store)} 个文件 {len(store.cls)} 个标签')
+    return store
+
+
+def load_label_store(yolo_txt_dir: str, update: bool = True, persist: bool = True) -> LabelStore:
+    """
+    读取标签汇总
+
+    Args:
+        yolo_txt_dir: YOLO txt 标签文件夹
+        update: 是否先检查 txt 文件的变化 不检查时只打开汇总文件 汇总文件不存在时仍然会创建
+        persist: 是否保存汇总文件 False 时已有的汇总文件仍然会被复用
+
+    Returns:
+        LabelStore: 标签汇总
+    """
+    if not update:
+        store = LabelStore.load(get_label_store_path(yolo_txt_dir))
+        if store is not None:
+            return store
+    return update_label_store(yolo_txt_dir, persist=persist)
@@ -0,0 +1,511 @@
+"""
+两张 1920*1080 的原图上下拼接成一张正方形图片 同时合并对应的标签
+
+配对在主进程中预先生成 之后每张拼接图片是一个独立的任务 可以分发到进程池中并行生成
+同样的配对 无论使用多少个进程 生成的结果都一致
+"""
+import os
+import random
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Set, Tuple
+
+import cv2
+import numpy as np
+from tqdm import tqdm
+
+from one_dragon_yolo.devtools import dataset_build_utils, yolo_label_utils
+from one_dragon_yolo.devtools.frame_cache_utils import FrameCache, FrameCacheStats
+
+MOSAIC_FILL_VALUE = 114  # 空白区域的填充颜色 与 ultralytics 的 letterbox 一致
+
+# 拼接图片的保存格式 -> (扩展名, cv2.imwrite 的参数)
+# 2176*2176 的 png 编码是生成数据集最耗时的一步 而训练时每张图片只会读取几百次
+MOSAIC_IMAGE_FORMATS: Dict[str, Tuple[str, List[int]]] = {
+    'png': ('.png', []),  # cv2 的默认参数
+    'png0': ('.png', [cv2.IMWRITE_PNG_COMPRESSION, 0]),  # 不压缩 编码最快 体积最大
+    'png1': ('.png', [cv2.IMWRITE_PNG_COMPRESSION, 1]),
+    'webp': ('.webp', [cv2.IMWRITE_WEBP_QUALITY, 101]),  # 质量超过100时为无损
+    'jpg': ('.jpg', [cv2.IMWRITE_JPEG_QUALITY, 95]),  # 有损 只用于探索性的训练
+    'npy': ('.png', [cv2.IMWRITE_PNG_COMPRESSION, 0]),  # 另外保存同名的 .npy ultralytics 会直接读取 .npy
+}
+
+
+class MosaicJob:
+    """一张拼接图片的输入和输出 只包含路径 可以传给子进程"""
+
+    def __init__(self, image1_path: str, label1_path: str, image2_path: str, label2_path: str,
+                 save_image_path: str, save_label_path: str, target_img_size: int,
+                 labels1: Optional[np.ndarray] = None, labels2: Optional[np.ndarray] = None,
+                 image_format: str = 'png'):
+        self.image1_path: str = image1_path
+        self.label1_path: str = label1_path
+        self.image2_path: str = image2_path
+        self.label2_path: str = label2_path
+        self.save_image_path: str = save_image_path
+        self.save_label_path: str = save_label_path
+        self.target_img_size: int = target_img_size
+        # 已经从标签汇总中读取的标签 为空时读取 txt 文件
+        self.labels1: Optional[np.ndarray] = labels1
+        self.labels2: Optional[np.ndarray] = labels2
+        self.image_format: str = image_format  # MOSAIC_IMAGE_FORMATS 中的格式 扩展名需要与 save_image_path 一致
+
+
+def draw_random_pairing(case_cnt: int, seed: Optional[int] = None) -> List[Tuple[int, int]]:
+    """
+    每个样例随机选一个样例与之配对 (可能是自己)
+    在生成任务之前一次性抽取 结果与并行方式无关
+
+    Args:
+        case_cnt: 样例数量
+        seed: 随机种子 相同的种子得到相同的配对 None 时每次不同
+
+    Returns:
+        [(样例下标, 配对的样例下标)] 长度为 case_cnt
+    """
+    rng = random.Random(seed)
+    return [(idx, rng.randint(0, case_cnt - 1)) for idx in range(case_cnt)]
+
+
+def draw_sequential_pairing(case_cnt: int) -> List[Tuple[int, int]]:
+    """
+    相邻的两个样例配对 总数为奇数时最后一张与上一张配对 只有一张时与自己配对
+
+    Args:
+        case_cnt: 样例数量
+
+    Returns:
+        [(样例下标, 配对的样例下标)]
+    """
+    pairing: List[Tuple[int, int]] = []
+    for idx in range(0, case_cnt, 2):
+        if idx + 1 < case_cnt:
+            pairing.append((idx, idx + 1))
+        elif idx > 0:
+            pairing.append((idx, idx - 1))
+        else:
+            pairing.append((idx, idx))
+    return pairing
+
+
+def reuse_random_pairing(data_ids: List[str], previous_pairs: List[Tuple[str, str]],
+                         seed: Optional[int] = None) -> List[Tuple[str, str]]:
+    """
+    随机配对 上一次生成时的配对中两个样例都还在的直接沿用 其余样例重新抽取
+    没有上一次的配对时 结果与 draw_random_pairing 相同
+
+    Args:
+        data_ids: 样例ID列表
+        previous_pairs: 上一次生成时的配对
+        seed: 随机种子
+
+    Returns:
+        [(样例ID, 配对的样例ID)] 长度为 len(data_ids)
+    """
+    id_set = set(data_ids)
+    id_2_partner = {id1: id2 for id1, id2 in previous_pairs if id1 in id_set and id2 in id_set}
+    rng = random.Random(seed)
+    pairing: List[Tuple[str, str]] = []
+    for data_id in data_ids:
+        partner = id_2_partner.get(data_id)
+        if partner is None:
+            partner = data_ids[rng.randint(0, len(data_ids) - 1)]
+        pairing.append((data_id, partner))
+    return pairing
+
+
+def reuse_sequential_pairing(data_ids: List[str], previous_pairs: List[Tuple[str, str]]) -> List[Tuple[str, str]]:
+    """
+    相邻配对 上一次生成时的配对中两个样例都还在的直接沿用 其余样例按顺序相邻配对
+    新增一张图片时 不会让后面全部的配对都错开
+
+    Args:
+        data_ids: 样例ID列表
+        previous_pairs: 上一次生成时的配对
+
+    Returns:
+        [(样例ID, 配对的样例ID)]
+    """
+    id_set = set(data_ids)
+    covered: Set[str] = set()
+    pairing: List[Tuple[str, str]] = []
+    for id1, id2 in previous_pairs:
+        if id1 not in id_set or id2 not in id_set or id1 in covered:
+            continue
+        pairing.append((id1, id2))
+        covered.add(id1)
+        covered.add(id2)
+
+    remaining = [data_id for data_id in data_ids if data_id not in covered]
+    for idx1, idx2 in draw_sequential_pairing(len(remaining)):
+        pairing.append((remaining[idx1], remaining[idx2]))
+    return pairing
+
+
+def compose_mosaic(img1: np.ndarray, labels1: np.ndarray,
+                   img2: np.ndarray, labels2: np.ndarray,
+                   target_img_size: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    将两张图片上下拼接到 target_img_size*target_img_size 的画布上 并把标签换算到画布上的相对坐标
+
+    Args:
+        img1: 放在上方的图片
+        labels1: 第一张图片的标签 (n, 5) 数组
+        img2: 放在下方的图片 大小与第一张相同
+        labels2: 第二张图片的标签 (n, 5) 数组
+        target_img_size: 画布大小
+
+    Returns:
+        (拼接后的图片, 合并后的标签)
+    """
+    height = img1.shape[0]
+    width = img1.shape[1]
+    radius = target_img_size
+
+    save_img = np.full((radius, radius, 3), MOSAIC_FILL_VALUE, dtype=np.uint8)
+    save_img[0:height, 0:width, :] = img1
+    save_img[height:height+height, 0:width, :] = img2
+
+    save_labels = yolo_label_utils.merge_vertical_labels(labels1, labels2, width, height, radius)
+    return save_img, save_labels
+
+
+def get_image_ext(image_format: str) -> str:
+    """
+    保存格式对应的图片扩展名
+
+    Args:
+        image_format: MOSAIC_IMAGE_FORMATS 中的格式
+
+    Returns:
+        扩展名 包含 .
+    """
+    if image_format not in MOSAIC_IMAGE_FORMATS:
+        raise ValueError(f'不支持的图片格式: {image_format}')
+    return MOSAIC_IMAGE_FORMATS[image_format][0]
+
+
+def save_mosaic_image(save_image_path: str, img: np.ndarray, image_format: str = 'png') -> bool:
+    """
+    按保存格式保存拼接图片
+    npy 格式额外保存一份同名的 .npy ultralytics 训练时读取 .npy 而不需要解码图片
+
+    Args:
+        save_image_path: 图片路径
+        img: 图片
+        image_format: MOSAIC_IMAGE_FORMATS 中的格式
+
+    Returns:
+        是否保存成功
+    """
+    _, params = MOSAIC_IMAGE_FORMATS[image_format]
+    if not cv2.imwrite(save_image_path, img, params):
+        return False
+    if image_format == 'npy':
+        np.save(os.path.splitext(save_image_path)[0] + '.npy', img)
+    return True
+
+
+def load_mosaic_image(image_path: str) -> Optional[np.ndarray]:
+    """
+    与 ultralytics 读取训练图片的方式一致 有同名的 .npy 时读取 .npy
+
+    Args:
+        image_path: 图片路径
+
+    Returns:
+        图片 读取失败时返回 None
+    """
+    npy_path = os.path.splitext(image_path)[0] + '.npy'
+    if os.path.exists(npy_path):
+        return np.load(npy_path)
+    return cv2.imread(image_path)
+
+
+def benchmark_image_formats(img: np.ndarray, formats: Optional[List[str]] = None,
+                            repeat: int = 3) -> List[dict]:
+    """
+    比较各种保存格式的 编码耗时、文件大小、读取耗时 以及是否无损
+
+    Args:
+        img: 一张拼接图片 最好使用真实的数据
+        formats: 需要比较的格式 为空时比较全部格式
+        repeat: 重复次数 耗时取平均
+
+    Returns:
+        每种格式的结果
+    """
+    report: List[dict] = []
+    tmp_dir = tempfile.mkdtemp(prefix='mosaic_format_')
+    try:
+        for image_format in (formats or list(MOSAIC_IMAGE_FORMATS.keys())):
+            save_path = os.path.join(tmp_dir, f'{image_format}{get_image_ext(image_format)}')
+
+            start_time = time.perf_counter()
+            for _ in range(repeat):
+                save_mosaic_image(save_path, img, image_format)
+            save_seconds = (time.perf_counter() - start_time) / repeat
+
+            start_time = time.perf_counter()
+            for _ in range(repeat):
+                loaded = load_mosaic_image(save_path)
+            load_seconds = (time.perf_counter() - start_time) / repeat
+
+            disk_bytes = os.path.getsize(save_path)
+            npy_path = os.path.splitext(save_path)[0] + '.npy'
+            if os.path.exists(npy_path):
+                disk_bytes += os.path.getsize(npy_path)
+                os.remove(npy_path)  # 不影响之后同扩展名的格式
+
+            report.append({
+                'format': image_format,
+                'save_seconds': round(save_seconds, 4),
+                'disk_mb': round(disk_bytes / 1024 / 1024, 2),
+                'load_seconds': round(load_seconds, 4),
+                'lossless': loaded is not None and np.array_equal(loaded, img),
+            })
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return report
+
+
+def build_mosaic(job: MosaicJob, cache: Optional[FrameCache] = None) -> bool:
+    """
+    生成一张拼接图片和对应的标签
+
+    Args:
+        job: 拼接任务
+        cache: 解码后的原图和标签的缓存 为空时每次都读取
+
+    Returns:
+        是否生成成功
+    """
+    if cache is None:
+        cache = FrameCache(max_mb=0)
+    try:
+        img1 = cache.get_image(job.image1_path)
+        img2 = img1 if job.image2_path == job.image1_path else cache.get_image(job.image2_path)
+        if img1 is None or img2 is None:
+            print(f'无法读取图片 {job.image1_path} {job.image2_path}')
+            return False
+
+        labels1 = job.labels1 if job.labels1 is not None else cache.get_labels(job.label1_path)
+        labels2 = job.labels2 if job.labels2 is not None else cache.get_labels(job.label2_path)
+        save_img, save_labels = compose_mosaic(img1, labels1, img2, labels2, job.target_img_size)
+        if not save_mosaic_image(job.save_image_path, save_img, job.image_format):
+            print(f'保存拼接图片失败 {job.save_image_path}')
+            return False
+        yolo_label_utils.write_label_txt(job.save_label_path, save_labels)
+        return True
+    except Exception as e:
+        print(f'生成拼接图片失败 {job.save_image_path}: {str(e)}')
+        return False
+
+
+def schedule_cache_local(jobs: List[MosaicJob]) -> List[List[int]]:
+    """
+    安排任务顺序 使相邻的任务共用一张原图
+
+    把原图看作点 任务看作连接两张原图的边 沿着边不断走下去得到一条路径
+    路径上相邻的两个任务共用一张原图 只要缓存中至少有两张图片 每个任务只需要解码一张新的原图
+    与一笔画一样 先从连接了奇数个任务的原图出发 路径的数量更少
+
+    Args:
+        jobs: 拼接任务列表
+
+    Returns:
+        若干条路径 每条是任务下标的列表 覆盖全部任务
+    """
+    frame_2_jobs: dict = {}
+    for job_idx, job in enumerate(jobs):
+        frame_2_jobs.setdefault(job.image1_path, []).append(job_idx)
+        if job.image2_path != job.image1_path:
+            frame_2_jobs.setdefault(job.image2_path, []).append(job_idx)
+    frame_cursor: dict = {frame: 0 for frame in frame_2_jobs}  # 每张原图下一个需要检查的任务
+
+    used = [False] * len(jobs)
+
+    def next_job(frame: str) -> Optional[int]:
+        candidates = frame_2_jobs[frame]
+        cursor = frame_cursor[frame]
+        while cursor < len(candidates) and used[candidates[cursor]]:
+            cursor += 1
+        frame_cursor[frame] = cursor
+        return candidates[cursor] if cursor < len(candidates) else None
+
+    odd_frames = [frame for frame, job_list in frame_2_jobs.items() if len(job_list) % 2 == 1]
+    trails: List[List[int]] = []
+    for start_frame in odd_frames + list(frame_2_jobs.keys()):
+        current = start_frame
+        trail: List[int] = []
+        while True:
+            job_idx = next_job(current)
+            if job_idx is None:
+                break
+            used[job_idx] = True
+            trail.append(job_idx)
+            job = jobs[job_idx]
+            current = job.image2_path if job.image1_path == current else job.image1_path
+        if len(trail) > 0:
+            trails.append(trail)
+    return trails
+
+
+def split_trails(trails: List[List[int]], chunk_size: int) -> List[List[int]]:
+    """
+    把路径打包成不超过 chunk_size 的分块 分发给进程池 过长的路径会被切开
+
+    Args:
+        trails: schedule_cache_local 的结果
+        chunk_size: 每块的最大任务数量
+
+    Returns:
+        分块列表
+    """
+    chunks: List[List[int]] = []
+    current: List[int] = []
+    for trail in trails:
+        for start in range(0, len(trail), chunk_size):
+            segment = trail[start:start + chunk_size]
+            if len(current) + len(segment) > chunk_size:
+                chunks.append(current)
+                current = []
+            current.extend(segment)
+    if len(current) > 0:
+        chunks.append(current)
+    return chunks
+
+
+_worker_cache: Optional[FrameCache] = None  # 进程池中每个进程自己的缓存
+
+
+def _init_worker_cache(max_mb: float) -> None:
+    global _worker_cache
+    _worker_cache = FrameCache(max_mb=max_mb)
+
+
+def _build_mosaic_chunk(jobs: List[MosaicJob]) -> Tuple[List[bool], FrameCacheStats]:
+    """
+    在进程池中按顺序生成一块任务 使用这个进程的缓存
+
+    Returns:
+        (每个任务是否生成成功, 这一块的缓存统计)
+    """
+    before = _worker_cache.stats.copy()
+    results = [build_mosaic(job, _worker_cache) for job in jobs]
+    return results, _worker_cache.stats.diff(before)
+
+
+def run_mosaic_jobs(jobs: List[MosaicJob], num_workers: int = 1, desc: str = '初始化数据集图片',
+                    cache_mb: float = 256, chunk_size: int = 16) -> List[bool]:
+    """
+    生成全部拼接图片 进度显示在 tqdm 中
+    按 schedule_cache_local 的顺序生成 配合解码缓存 每张原图大多只需要解码一次 结束时输出缓存的命中率
+
+    Args:
+        jobs: 拼接任务列表
+        num_workers: 并行进程数 1 表示在当前进程中逐张生成
+        desc: 进度条的描述
+        cache_mb: 解码缓存的总大小 单位 MB 多进程时平分给每个进程
+        chunk_size: 多进程时每次分发的任务数量
+
+    Returns:
+        每个任务是否生成成功 顺序与 jobs 一致
+    """
+    results: List[bool] = [False] * len(jobs)
+    trails = schedule_cache_local(jobs)
+    if num_workers <= 1 or len(jobs) <= 1:
+        cache = FrameCache(max_mb=cache_mb)
+        with tqdm(total=len(jobs), desc=desc) as pbar:
+            for trail in trails:
+                for job_idx in trail:
+                    results[job_idx] = build_mosaic(jobs[job_idx], cache)
+                    pbar.update(1)
+        stats = cache.stats
+    else:
+        # 同一块任务在同一个进程中按顺序生成 路径上相邻的任务才能共用缓存
+        worker_cnt = min(num_workers, len(jobs))
+        chunks = split_trails(trails, chunk_size)
+        stats = FrameCacheStats()
+        with ProcessPoolExecutor(max_workers=worker_cnt, initializer=_init_worker_cache,
+                                 initargs=(cache_mb / worker_cnt,)) as executor:
+            with tqdm(total=len(jobs), desc=desc) as pbar:
+                chunk_jobs = [[jobs[job_idx] for job_idx in chunk] for chunk in chunks]
+                for chunk, (chunk_results, chunk_stats) in zip(chunks, executor.map(_build_mosaic_chunk, chunk_jobs)):
+                    for job_idx, success in zip(chunk, chunk_results):
+                        results[job_idx] = success
+                    stats.add(chunk_stats)
+                    pbar.update(len(chunk))
+
+    if len(jobs) > 0:
+        print(f'原图解码缓存 {stats}')
+    return results
+
+
+def run_incremental_mosaic_jobs(manifest: dataset_build_utils.BuildManifest,
+                                pair_jobs: List[Tuple[Tuple[str, str], MosaicJob]],
+                                images_dir: str, labels_dir: str,
+                                num_workers: int = 1, desc: str = '初始化数据集图片') -> List[str]:
+    """
+    只生成清单中没有或输入变化了的拼接图片 删除不再需要的图片和标签 并更新清单中的生成记录
+
+    Args:
+        manifest: 上一次生成的清单 参数变化时是一份空的清单
+        pair_jobs: [((样例ID, 配对的样例ID), 拼接任务)]
+        images_dir: 生成图片的文件夹
+        labels_dir: 生成标签的文件夹
+        num_workers: 并行进程数
+        desc: 进度条的描述
+
+    Returns:
+        生成成功的全部图片文件名 包括沿用的
+    """
+    outputs: dict = {}
+    image_names: List[str] = []
+    to_build: List[Tuple[str, dict, MosaicJob]] = []
+    for pair, job in tqdm(pair_jobs, desc='检查输入变化'):
+        name = os.path.splitext(os.path.basename(job.save_image_path))[0]
+        input_paths = [job.image1_path, job.label1_path, job.image2_path, job.label2_path]
+        record = {
+            'pair': list(pair),
+            'inputs': [manifest.get_file_hash(path) for path in input_paths],
+        }
+        if (manifest.outputs.get(name) == record
+                and os.path.exists(job.save_image_path) and os.path.exists(job.save_label_path)):
+            outputs[name] = record
+            image_names.append(os.path.basename(job.save_image_path))
+        else:
+            to_build.append((name, record, job))
+
+    keep_names = set(outputs.keys()) | {name for name, _, _ in to_build}
+    stale_cnt = dataset_build_utils.remove_stale_outputs(images_dir, keep_names)
+    dataset_build_utils.remove_stale_outputs(labels_dir, keep_names)
+
+    results = run_mosaic_jobs([job for _, _, job in to_build], num_workers=num_workers, desc=desc)
+    fail_cnt = 0
+    for (name, record, job), success in zip(to_build, results):
+        if success:
+            outputs[name] = record
+            image_names.append(os.path.basename(job.save_image_path))
+            continue
+        fail_cnt += 1
+        npy_path = os.path.splitext(job.save_image_path)[0] + '.npy'
+        for path in (job.save_image_path, job.save_label_path, npy_path):  # 不留下旧的结果
+            if os.path.exists(path):
+                os.remove(path)
+
+    manifest.outputs = outputs
+    print(f'沿用 {len(pair_jobs) - len(to_build)} 张 生成 {len(to_build) - fail_cnt} 张 '
+          f'失败 {fail_cnt} 张 删除 {stale_cnt} 张')
+    if len(to_build) > 0 or stale_cnt > 0:
+        dataset_build_utils.remove_label_caches(labels_dir)
+    return image_names
+
+
+def get_default_num_workers() -> int:
+    """
+    默认的并行进程数 留一个核心给其它程序
+    """
+    return max(1, (os.cpu_count() or 1) - 1)
@@ -1,6 +1,8 @@
 import os
 
-from one_dragon_yolo.devtools import env_utils
+import numpy as np
+
+from one_dragon_yolo.devtools import env_utils, label_store_utils
 
 
 def get_dataset_project_dir(project: str) -> str:
@@ -91,6 +93,23 @@ def get_yolo_data_txt_path(
     return result
 
 
+def get_yolo_data_labels(
+        project_dir: str,
+        update: bool = True,
+) -> dict[str, np.ndarray]:
+    """
+    从标签汇总文件中读取数据集的全部 YOLO 标注 不需要逐个打开txt文件
+
+    Args:
+        project_dir: 数据集项目根目录
+        update: 是否先按txt文件的修改时间增量更新汇总文件
+
+    Returns:
+        dict[str, np.ndarray]: key=数据ID value=(n, 5) 的标签数组
+    """
+    return label_store_utils.load_label_store(get_yolo_txt_dir(project_dir), update=update).to_dict()
+
+
 def rename_file_in_yolo_project(project_dir: str) -> None:
     """
     对原图的文件夹下的图片进行重命名
@@ -1,4 +1,6 @@
+import errno
 import os
+import shutil
 
 
 def get_work_dir() -> str:
@@ -37,4 +39,91 @@ def get_path_under_work_dir(*sub_paths: str) -> str:
     :param sub_paths: 子目录路径 可以传入多个表示多级
     :return: 拼接后的子目录路径
     """
-    return join_dir_path_with_mk(get_work_dir(), *sub_paths)
\ No newline at end of file
+    return join_dir_path_with_mk(get_work_dir(), *sub_paths)
+
+
+MATERIALIZE_STRATEGIES = ['hardlink', 'reflink', 'symlink', 'copy']
+
+# 当前文件系统不支持时返回这些错误码 可以换用下一种方式
+_FALLBACK_ERRNOS = {errno.EXDEV, errno.EPERM, errno.EACCES, errno.EMLINK, errno.ENOTSUP, errno.EOPNOTSUPP,
+                    errno.EINVAL, errno.ENOTTY, errno.ENOSYS}
+_FICLONE = 0x40049409  # Linux ioctl FICLONE 在 btrfs/xfs 上共享数据块
+
+
+def _reflink(src: str, dst: str) -> None:
+    """
+    写时复制 目前只支持 Linux 的 FICLONE 其它系统抛出 OSError 由调用方换用复制
+    """
+    try:
+        import fcntl
+    except ImportError:
+        raise OSError(errno.ENOTSUP, 'reflink is not supported on this platform')
+    with open(src, 'rb') as src_file, open(dst, 'wb') as dst_file:
+        try:
+            fcntl.ioctl(dst_file.fileno(), _FICLONE, src_file.fileno())
+        except OSError:
+            dst_file.close()
+            os.remove(dst)
+            raise
+
+
+class FileMaterializer:
+    """
+    把原文件放到数据集中 按 strategy 使用硬链接、写时复制、软链接或者复制
+    文件系统不支持时 (例如跨盘的硬链接、没有权限的软链接) 自动换成下一种方式 最后使用复制
+    硬链接和软链接与原文件共用数据 数据集中的文件不能直接修改
+    """
+
+    _FALLBACKS = {
+        'hardlink': ['hardlink', 'reflink', 'copy'],
+        'reflink': ['reflink', 'copy'],
+        'symlink': ['symlink', 'copy'],
+        'copy': ['copy'],
+    }
+
+    def __init__(self, strategy: str = 'hardlink'):
+        """
+        :param strategy: MATERIALIZE_STRATEGIES 中的一种
+        """
+        if strategy not in MATERIALIZE_STRATEGIES:
+            raise ValueError(f'不支持的方式: {strategy}')
+        self.strategy: str = strategy
+        self.counts: dict[str, int] = {}  # 实际使用的方式 -> 文件数量
+        self._unsupported: set[tuple[int, int, str]] = set()  # (原文件所在设备, 目标文件夹所在设备, 方式)
+
+    def materialize(self, src: str, dst: str) -> str:
+        """
+        把 src 放到 dst 已存在的 dst 会被替换
+        :param src: 原文件路径
+        :param dst: 目标文件路径
+        :return: 实际使用的方式
+        """
+        if os.path.lexists(dst):
+            os.remove(dst)
+        devices = (os.stat(src).st_dev, os.stat(os.path.dirname(os.path.abspath(dst))).st_dev)
+        for method in FileMaterializer._FALLBACKS[self.strategy]:
+            if (devices[0], devices[1], method) in self._unsupported:
+                continue
+            try:
+                if method == 'hardlink':
+                    os.link(src, dst)
+                elif method == 'reflink':
+                    _reflink(src, dst)
+                elif method == 'symlink':
+                    os.symlink(os.path.abspath(src), dst)
+                else:
+                    shutil.copyfile(src, dst)
+            except OSError as e:
+                if method == 'copy' or e.errno not in _FALLBACK_ERRNOS:
+                    raise
+                self._unsupported.add((devices[0], devices[1], method))
+                continue
+            self.counts[method] = self.counts.get(method, 0) + 1
+            return method
+        raise OSError(f'无法放置文件 {src} -> {dst}')
+
+    def summary(self) -> str:
+        """
+        :return: 各种方式的文件数量
+        """
+        return ' '.join(f'{method} {cnt}' for method, cnt in self.counts.items())
@@ -0,0 +1,238 @@
+"""
+图片相似度处理的基准测试
+
+临时生成 N 个类别 × M 张图片的文件夹 其中一部分是已知的近似重复图片，
+运行 ImageSimilarityProcessor 后分别统计哈希、比较、删除三个阶段的耗时、吞吐量和内存峰值，
+并用已知的重复关系计算删除结果的精确率和召回率，保证性能优化不会悄悄改变结果。
+"""
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import cv2
+import numpy as np
+
+BENCHMARK_MODES = ['within_folder', 'incremental']  # 这两种模式的正确结果都是每个重复分组只保留一张
+
+
+def make_base_image(rng: np.random.Generator, size: int = 256) -> np.ndarray:
+    """
+    生成一张随机图片 低频的随机色块加上几个随机形状 不同图片的感知哈希差异足够大
+
+    Args:
+        rng: 随机数生成器
+        size: 图片边长
+
+    Returns:
+        np.ndarray: BGR 图片
+    """
+    grid = rng.integers(0, 256, size=(6, 6, 3), dtype=np.uint8)
+    image = cv2.resize(grid, (size, size), interpolation=cv2.INTER_CUBIC)
+    for _ in range(int(rng.integers(3, 8))):
+        color = tuple(int(c) for c in rng.integers(0, 256, size=3))
+        x1, y1, x2, y2 = (int(v) for v in rng.integers(0, size, size=4))
+        if rng.random() < 0.5:
+            cv2.rectangle(image, (x1, y1), (x2, y2), color, thickness=-1)
+        else:
+            cv2.circle(image, (x1, y1), int(rng.integers(size // 16, size // 4)), color, thickness=-1)
+    return image
+
+
+def make_near_duplicate(image: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    """
+    对图片做轻微的扰动 模拟连续截图中的重复画面: 小幅缩放裁剪、亮度变化、噪声
+
+    Args:
+        image: BGR 图片
+        rng: 随机数生成器
+
+    Returns:
+        np.ndarray: 扰动后的 BGR 图片
+    """
+    h, w = image.shape[:2]
+    margin = int(rng.integers(0, max(1, w // 50) + 1))
+    result = cv2.resize(image[margin:h - margin, margin:w - margin], (w, h), interpolation=cv2.INTER_LINEAR)
+    noise = rng.normal(rng.uniform(-8, 8), 3, size=result.shape)
+    return np.clip(result.astype(np.float32) + noise, 0, 255).astype(np.uint8)
+
+
+def make_synthetic_dataset(root_folder: str, class_cnt: int = 10, image_cnt: int = 100,
+                           duplicate_rate: float = 0.2, image_size: int = 256, seed: int = 0) -> Dict[str, int]:
+    """
+    在根文件夹下生成 class_cnt 个子文件夹 每个子文件夹 image_cnt 张图片
+    每张图片以 duplicate_rate 的概率是同一文件夹中某张原图的近似重复图片
+
+    Args:
+        root_folder: 根文件夹路径
+        class_cnt: 类别数量
+        image_cnt: 每个类别的图片数量
+        duplicate_rate: 近似重复图片的比例
+        image_size: 图片边长
+        seed: 随机种子
+
+    Returns:
+        Dict[str, int]: 图片路径 -> 重复分组编号 同一分组的图片互为重复
+    """
+    rng = np.random.default_rng(seed)
+    groups: Dict[str, int] = {}
+    group_id = 0
+    for class_idx in range(class_cnt):
+        folder_path = os.path.join(root_folder, f'class_{class_idx:03d}')
+        os.makedirs(folder_path, exist_ok=True)
+        originals: List[tuple] = []  # (图片, 分组编号)
+        for image_idx in range(image_cnt):
+            if len(originals) > 0 and rng.random() < duplicate_rate:
+                base_image, image_group = originals[int(rng.integers(0, len(originals)))]
+                image = make_near_duplicate(base_image, rng)
+            else:
+                image = make_base_image(rng, image_size)
+                image_group = group_id
+                group_id += 1
+                originals.append((image, image_group))
+            ext = '.jpg' if image_idx % 2 == 0 else '.png'
+            image_path = os.path.join(folder_path, f'{image_idx:05d}{ext}')
+            cv2.imwrite(image_path, image)
+            groups[image_path] = image_group
+    return groups
+
+
+def evaluate_deletion(groups: Dict[str, int], deleted_paths: List[str]) -> Dict[str, float]:
+    """
+    根据已知的重复分组计算删除结果的精确率和召回率
+    每个分组应删除除一张以外的全部图片 分组内删除的数量超过这个数 多出的部分算误删
+
+    Args:
+        groups: 图片路径 -> 重复分组编号
+        deleted_paths: 删除的图片路径
+
+    Returns:
+        Dict[str, float]: 精确率、召回率和各项数量
+    """
+    group_size: Dict[int, int] = {}
+    for group in groups.values():
+        group_size[group] = group_size.get(group, 0) + 1
+    group_deleted: Dict[int, int] = {}
+    unknown_cnt = 0
+    for path in deleted_paths:
+        if path not in groups:
+            unknown_cnt += 1
+            continue
+        group = groups[path]
+        group_deleted[group] = group_deleted.get(group, 0) + 1
+
+    expected_cnt = sum(size - 1 for size in group_size.values())
+    correct_cnt = sum(min(cnt, group_size[group] - 1) for group, cnt in group_deleted.items())
+    deleted_cnt = len(deleted_paths)
+    return {
+        'expected_deletions': expected_cnt,
+        'deleted': deleted_cnt,
+        'true_positive': correct_cnt,
+        'false_positive': deleted_cnt - correct_cnt,
+        'false_negative': expected_cnt - correct_cnt,
+        'precision': correct_cnt / deleted_cnt if deleted_cnt > 0 else 1.0,
+        'recall': correct_cnt / expected_cnt if expected_cnt > 0 else 1.0,
+    }
+
+
+def get_peak_rss_mb() -> Optional[float]:
+    """
+    当前进程的内存峰值 不包含计算哈希的子进程
+
+    Returns:
+        Optional[float]: 单位 MB 无法获取时返回 None
+    """
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux 的单位是 KB macOS 是字节
+        return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+    except ImportError:
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().peak_wset / 1024 / 1024
+    except (ImportError, AttributeError):
+        return None
+
+
+def run_benchmark(class_cnt: int = 10, image_cnt: int = 100, duplicate_rate: float = 0.2,
+                  mode: str = 'within_folder', processor_kwargs: Optional[Dict] = None,
+                  image_size: int = 256, seed: int = 0, work_folder: Optional[str] = None,
+                  report_path: Optional[str] = None) -> Dict:
+    """
+    生成一份合成数据集并运行一次相似度处理 统计耗时、吞吐量、内存峰值和删除结果的准确度
+    数据集生成在临时文件夹中 运行结束后删除
+
+    Args:
+        class_cnt: 类别数量
+        image_cnt: 每个类别的图片数量
+        duplicate_rate: 近似重复图片的比例
+        mode: 处理模式 within_folder 或 incremental
+        processor_kwargs: 传给 ImageSimilarityProcessor 的参数
+        image_size: 图片边长
+        seed: 随机种子
+        work_folder: 生成临时文件夹的位置 为空时使用系统的临时文件夹
+        report_path: 非空时将结果以 JSON 格式保存到这个路径
+
+    Returns:
+        Dict: 基准测试结果
+    """
+    from one_dragon_yolo.gui.similarity_processor import ImageSimilarityProcessor
+
+    if mode not in BENCHMARK_MODES:
+        raise ValueError(f'不支持的基准测试模式: {mode}')
+    processor_kwargs = dict(processor_kwargs or {})
+    processor_kwargs['dry_run'] = False  # 需要统计删除的耗时
+    processor_kwargs['quarantine'] = False
+
+    root_folder = tempfile.mkdtemp(prefix='similarity_benchmark_', dir=work_folder)
+    try:
+        start_time = time.perf_counter()
+        groups = make_synthetic_dataset(root_folder, class_cnt, image_cnt, duplicate_rate, image_size, seed)
+        generate_time = time.perf_counter() - start_time
+
+        processor = ImageSimilarityProcessor(**processor_kwargs)
+        start_time = time.perf_counter()
+        if mode == 'within_folder':
+            result = processor.process_within_folder_similarity(root_folder)
+        else:
+            result = processor.process_incremental_similarity(root_folder)
+        total_time = time.perf_counter() - start_time
+    finally:
+        shutil.rmtree(root_folder, ignore_errors=True)
+
+    timings = result['timings']
+    total_images = len(groups)
+    report = {
+        'mode': mode,
+        'class_cnt': class_cnt,
+        'image_cnt': image_cnt,
+        'total_images': total_images,
+        'duplicate_rate': duplicate_rate,
+        'seed': seed,
+        'processor_kwargs': processor_kwargs,
+        'generate_seconds': round(generate_time, 4),
+        'total_seconds': round(total_time, 4),
+        'timings': {key: round(value, 4) for key, value in timings.items()},
+        'hash_images_per_second': total_images / timings['hash'] if timings['hash'] > 0 else None,
+        'total_comparisons': result['total_comparisons'],
+        'comparisons_per_second': (
+            result['total_comparisons'] / timings['compare'] if timings['compare'] > 0 else None
+        ),
+        'peak_rss_mb': get_peak_rss_mb(),
+        'cascade': result.get('cascade'),
+        'accuracy': evaluate_deletion(groups, result['deleted_file_paths']),
+    }
+
+    if report_path is not None:
+        with open(report_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return report
+
+
+if __name__ == '__main__':
+    print(json.dumps(run_benchmark(), ensure_ascii=False, indent=2))
@@ -0,0 +1,291 @@
+"""
+训练时在内存中拼接图片 不需要先生成数据集图片
+
+yolo_dataset_utils.init_dataset 会把两张 1920*1080 的原图拼接成几千张 2208*2208 的图片保存到硬盘
+训练时 ultralytics 再读取这些图片缩小到 736
+这里直接读取数据集项目中的原图和标签 在 __getitem__ 中拼接 每次取样时重新抽取配对的图片
+- 训练集每个 epoch 都是新的配对
+- 验证集使用固定的配对 不同 epoch 的结果可以比较
+- 原图大小在初始化时读取 写入 dataset.yaml 全部原图需要大小一致
+- 不使用 ultralytics 的 mosaic 增强 训练时 mosaic 会被设置为 0
+
+使用方法
+    virtual_mosaic_utils.init_virtual_dataset(project_dir, dataset_name, labels, mosaic_size=2208)
+    model.train(data=ultralytics_utils.get_dataset_yaml_path(dataset_name), trainer=VirtualMosaicTrainer, mosaic=0, ...)
+"""
+import math
+import os
+import random
+from typing import List, Optional, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image
+from ultralytics.data import YOLODataset
+from ultralytics.models.yolo.detect import DetectionTrainer, DetectionValidator
+from ultralytics.utils import DEFAULT_CFG, colorstr
+from ultralytics.utils.torch_utils import de_parallel
+
+from one_dragon_yolo.devtools import (dataset_build_utils, label_store_utils, mosaic_utils, od_dataset_utils,
+                                      ultralytics_utils, yolo_label_utils)
+
+VIRTUAL_SPLIT_TXT_NAMES = ['virtual_train.txt', 'virtual_val.txt', 'virtual_test.txt']
+
+
+class VirtualMosaicDataset(YOLODataset):
+
+    def __init__(self, *args, yolo_txt_dir: str, frame_width: int, frame_height: int, mosaic_size: int = 2208,
+                 seed: int = 0, classes: Optional[List[int]] = None, **kwargs):
+        """
+        Args:
+            img_path: 原图列表的txt文件 与 YOLODataset 一致
+            yolo_txt_dir: 数据集项目中的 YOLO txt 标签文件夹
+            frame_width: 原图宽度
+            frame_height: 原图高度
+            mosaic_size: 拼接后的正方形画布大小 与 init_dataset 的 target_img_size 一致
+            seed: 固定配对的随机种子 用于验证集和 self.labels 的统计
+            classes: 只保留的类别
+        """
+        # YOLODataset.__init__ 中会调用 get_labels 需要先设置
+        self.yolo_txt_dir: str = yolo_txt_dir
+        self.frame_width: int = frame_width
+        self.frame_height: int = frame_height
+        self.mosaic_size: int = mosaic_size
+        self.seed: int = seed
+        self.include_class: Optional[List[int]] = classes
+        self.frame_labels: List[np.ndarray] = []  # 每张原图的标签
+        self.fixed_pairing: List[int] = []  # 固定配对 第 i 张原图与 fixed_pairing[i] 配对
+        kwargs['cache'] = False  # 每次取样的配对不同 不能缓存拼接后的图片
+        YOLODataset.__init__(self, *args, classes=classes, **kwargs)
+
+    def get_labels(self) -> List[dict]:
+        """
+        从标签汇总中读取每张原图的标签 不需要 ultralytics 逐张校验图片
+        返回的是固定配对的标签 只用于 ultralytics 的统计和绘图 训练时的标签在 get_image_and_label 中生成
+        原图大小使用初始化时记录的大小 single_cls 和 classes 由 update_labels 处理
+        """
+        store = label_store_utils.load_label_store(self.yolo_txt_dir)
+        self.frame_labels = []
+        for im_file in self.im_files:
+            labels = store.get(os.path.splitext(os.path.basename(im_file))[0])
+            self.frame_labels.append(labels if labels is not None else yolo_label_utils.empty_labels())
+        self.fixed_pairing = [partner for _, partner in
+                              mosaic_utils.draw_random_pairing(len(self.im_files), self.seed)]
+
+        result: List[dict] = []
+        for idx, im_file in enumerate(self.im_files):
+            labels = yolo_label_utils.merge_vertical_labels(self.frame_labels[idx],
+                                                            self.frame_labels[self.fixed_pairing[idx]],
+                                                            self.frame_width, self.frame_height,
+                                                            self.mosaic_size)
+            result.append({
+                'im_file': im_file,
+                'shape': (self.mosaic_size, self.mosaic_size),
+                'cls': labels[:, 0:1],
+                'bboxes': labels[:, 1:],
+                'segments': [],
+                'keypoints': None,
+                'normalized': True,
+                'bbox_format': 'xywh',
+            })
+        return result
+
+    def draw_partner(self, index: int) -> int:
+        """
+        抽取与第 index 张原图配对的原图
+        训练时每次取样都重新抽取 每个 epoch 每张原图只取样一次 所以每个 epoch 都是新的配对
+        ultralytics 会为每个 dataloader 进程设置随机种子
+        """
+        if self.augment:
+            return random.randint(0, len(self.im_files) - 1)
+        return self.fixed_pairing[index]
+
+    def filter_labels(self, labels: np.ndarray) -> np.ndarray:
+        """
+        按 classes 和 single_cls 处理拼接后的标签 与 update_labels 一致
+        """
+        if self.include_class is not None:
+            labels = labels[np.isin(labels[:, 0], self.include_class)]
+        if self.single_cls:
+            labels[:, 0] = 0
+        return labels
+
+    def compose(self, idx1: int, idx2: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        读取两张原图并拼接
+
+        Args:
+            idx1: 上方原图的下标
+            idx2: 下方原图的下标
+
+        Returns:
+            (拼接后的图片, 拼接后的标签)
+        """
+        img1 = cv2.imread(self.im_files[idx1])
+        img2 = img1 if idx2 == idx1 else cv2.imread(self.im_files[idx2])
+        if img1 is None or img2 is None:
+            raise FileNotFoundError(f'无法读取图片 {self.im_files[idx1]} {self.im_files[idx2]}')
+        for idx, img in ((idx1, img1), (idx2, img2)):
+            if img.shape[:2] != (self.frame_height, self.frame_width):
+                raise ValueError(f'原图大小 {img.shape[1]}*{img.shape[0]} 与数据集记录的 '
+                                 f'{self.frame_width}*{self.frame_height} 不一致 {self.im_files[idx]}')
+        img, labels = mosaic_utils.compose_mosaic(img1, self.frame_labels[idx1],
+                                                  img2, self.frame_labels[idx2], self.mosaic_size)
+        return img, self.filter_labels(labels)
+
+    def get_image_and_label(self, index: int) -> dict:
+        """
+        在内存中拼接图片 代替 BaseDataset 的读取图片
+        缩放方式与 BaseDataset.load_image 一致
+        """
+        img, labels = self.compose(index, self.draw_partner(index))
+        h0, w0 = img.shape[:2]
+        r = self.imgsz / max(h0, w0)
+        if r != 1:
+            interp = cv2.INTER_LINEAR if (self.augment or r > 1) else cv2.INTER_AREA
+            img = cv2.resize(img, (min(math.ceil(w0 * r), self.imgsz), min(math.ceil(h0 * r), self.imgsz)),
+                             interpolation=interp)
+
+        label = {
+            'im_file': self.im_files[index],
+            'cls': labels[:, 0:1].copy(),
+            'bboxes': labels[:, 1:].copy(),
+            'segments': [],
+            'keypoints': None,
+            'normalized': True,
+            'bbox_format': 'xywh',
+            'img': img,
+            'ori_shape': (h0, w0),
+            'resized_shape': img.shape[:2],
+        }
+        label['ratio_pad'] = (label['resized_shape'][0] / h0, label['resized_shape'][1] / w0)
+        if self.rect:
+            label['rect_shape'] = self.batch_shapes[self.batch[index]]
+        return self.update_labels_info(label)
+
+
+def build_virtual_dataset(args, img_path: str, batch: int, data: dict, mode: str = 'train',
+                          stride: int = 32) -> VirtualMosaicDataset:
+    """
+    与 ultralytics 的 build_yolo_dataset 参数一致
+    数据集配置中需要有 yolo_txt_dir frame_width frame_height 和 mosaic_size 见 init_virtual_dataset
+    拼接已在 get_image_and_label 中完成 且没有填充 ultralytics mosaic 使用的 buffer 所以训练时把 mosaic 设置为 0
+    """
+    if mode == 'train' and args.mosaic > 0:
+        print(f'在内存中拼接的数据集不支持 mosaic 增强 mosaic={args.mosaic} 已改为 0')
+        args.mosaic = 0.0
+    return VirtualMosaicDataset(
+        img_path=img_path,
+        imgsz=args.imgsz,
+        batch_size=batch,
+        augment=mode == 'train',
+        hyp=args,
+        rect=args.rect or mode == 'val',
+        single_cls=args.single_cls or False,
+        stride=int(stride),
+        pad=0.0 if mode == 'train' else 0.5,
+        prefix=colorstr(f'{mode}: '),
+        task=args.task,
+        classes=args.classes,
+        data=data,
+        fraction=args.fraction if mode == 'train' else 1.0,
+        yolo_txt_dir=data['yolo_txt_dir'],
+        frame_width=data['frame_width'],
+        frame_height=data['frame_height'],
+        mosaic_size=data['mosaic_size'],
+        seed=args.seed,
+    )
+
+
+class VirtualMosaicTrainer(DetectionTrainer):
+
+    def __init__(self, cfg=DEFAULT_CFG, overrides=None, _callbacks=None):
+        DetectionTrainer.__init__(self, cfg=cfg, overrides=overrides, _callbacks=_callbacks)
+
+    def build_dataset(self, img_path, mode='train', batch=None):
+        gs = max(int(de_parallel(self.model).stride.max() if self.model else 0), 32)
+        return build_virtual_dataset(self.args, img_path, batch, self.data, mode=mode, stride=gs)
+
+
+class VirtualMosaicValidator(DetectionValidator):
+
+    def __init__(self, dataloader=None, save_dir=None, args=None, _callbacks=None):
+        DetectionValidator.__init__(
+            self,
+            dataloader=dataloader,
+            save_dir=save_dir,
+            args=args,
+            _callbacks=_callbacks
+        )
+
+    def build_dataset(self, img_path, mode='val', batch=None):
+        return build_virtual_dataset(self.args, img_path, batch, self.data, mode=mode, stride=self.stride)
+
+
+def init_virtual_dataset(
+        project_dir: str,
+        dataset_name: str,
+        labels: list[str],
+        mosaic_size: int = 2208,
+        split_weights=(0.9, 0.1, 0),
+) -> None:
+    """
+    初始化一个在训练时拼接的数据集 只写入原图列表和 dataset.yaml 不生成图片
+    原图按数据ID的哈希划分 与 init_dataset 的划分方式一致
+
+    Args:
+        project_dir: 数据集项目根目录
+        dataset_name: ultralytics数据集名称 在 ultralytics/datasets/{dataset_name}
+        labels: 类别名称
+        mosaic_size: 拼接后的正方形画布大小 需要是32的倍数 且能放下上下两张原图
+        split_weights: 训练集、验证集、测试集的比例
+    """
+    # 选取同时有图片和标注的原图 同时更新标签汇总
+    txt_dir = od_dataset_utils.get_yolo_txt_dir(project_dir)
+    store = label_store_utils.load_label_store(txt_dir)
+    id_2_image = od_dataset_utils.get_yolo_data_image_path(project_dir)
+    data_ids = sorted(data_id for data_id in id_2_image.keys() if data_id in store)
+    if len(data_ids) == 0:
+        print('没有同时有图片和标注的原图')
+        return
+
+    # 只读取图片文件头 得到原图大小 拼接要求全部原图大小一致
+    frame_sizes = set()
+    for data_id in data_ids:
+        with Image.open(id_2_image[data_id]) as img:
+            frame_sizes.add(img.size)
+    if len(frame_sizes) > 1:
+        print(f'原图大小不一致 无法拼接 {sorted(frame_sizes)}')
+        return
+    frame_width, frame_height = frame_sizes.pop()
+
+    if (mosaic_size < frame_height * 2) or (mosaic_size < frame_width) or (mosaic_size % 32 != 0):
+        print('传入的图片大小不合法')
+        return
+
+    split_lines: list[list[str]] = [[] for _ in VIRTUAL_SPLIT_TXT_NAMES]
+    for data_id in data_ids:
+        split_idx = dataset_build_utils.get_split_idx(data_id, split_weights)
+        split_lines[split_idx].append(os.path.abspath(id_2_image[data_id]) + '\n')
+    if split_weights[1] == 0:
+        split_lines[1] = split_lines[0]
+
+    dataset_dir = ultralytics_utils.get_dataset_dir(dataset_name)
+    for txt_name, lines in zip(VIRTUAL_SPLIT_TXT_NAMES, split_lines):
+        with open(os.path.join(dataset_dir, txt_name), 'w', encoding='utf-8') as file:
+            file.writelines(lines)
+
+    with open(os.path.join(dataset_dir, 'dataset.yaml'), 'w', encoding='utf-8') as file:
+        file.write('path: %s\n' % dataset_name)
+        file.write('train: %s\n' % VIRTUAL_SPLIT_TXT_NAMES[0])
+        file.write('val: %s\n' % VIRTUAL_SPLIT_TXT_NAMES[1])
+        file.write('test: %s\n' % VIRTUAL_SPLIT_TXT_NAMES[2])
+        file.write('yolo_txt_dir: %s\n' % os.path.abspath(txt_dir).replace('\\', '/'))
+        file.write('frame_width: %d\n' % frame_width)
+        file.write('frame_height: %d\n' % frame_height)
+        file.write('mosaic_size: %d\n' % mosaic_size)
+        file.write('names:\n')
+        for label_idx, label in enumerate(labels):
+            file.write('  %d: %s\n' % (label_idx, label))
+
+    print(f'训练集 {len(split_lines[0])} 张 验证集 {len(split_lines[1])} 张 测试集 {len(split_lines[2])} 张原图')
@@ -1,8 +1,11 @@
 import json
 import os
 
+import numpy as np
 from tqdm import tqdm
 
+from one_dragon_yolo.devtools import label_store_utils, yolo_label_utils
+
 
 class DataWrapper:
 
@@ -142,10 +145,13 @@ def convert_yolo_2_x(
         labels: list[str],
         image_width: int = 1920,
         image_height: int = 1080,
+        use_label_store: bool = False,
 ) -> None:
     """
     遍历文件夹
     将 txt格式的YOLO结果 转成 X-AnyLabeling 的 json 格式
+    use_label_store=True 时从 yolo_txt_dir 中的标签汇总文件读取 不逐个打开txt文件
+    标签汇总中的坐标是 float32 换算到像素后有不超过 0.001 像素的误差 需要与txt完全一致时不要使用
 
     ```txt
     0 0.773914433084428 0.273859746754169 0.026951028034091 0.046918287873268
@@ -194,26 +200,22 @@ def convert_yolo_2_x(
     }
     ```
     """
-    for txt_name in tqdm(os.listdir(yolo_txt_dir)):
-        txt_path = os.path.join(yolo_txt_dir, txt_name)
-
-        yolo_arr = []
+    if use_label_store:
+        id_2_labels = label_store_utils.load_label_store(yolo_txt_dir).to_dict()
+    else:
+        id_2_labels = yolo_label_utils.read_label_dir(yolo_txt_dir, dtype=np.float64)
 
-        with open(txt_path, 'r', encoding='utf-8') as f:
-            txt_lines = f.readlines()
-            for txt_line in txt_lines:
-                txt_line = txt_line.strip()
-                if not txt_line:
-                    continue
-                yolo_arr.append([float(x) for x in txt_line.split(' ')])
+    for data_id, box_arr in tqdm(id_2_labels.items()):
+        yolo_arr = box_arr.astype(np.float64).tolist()
 
-        image_name = txt_name.replace('.txt', '.png')
-        json_name = txt_name.replace('.txt', '.json')
+        image_name = f'{data_id}.png'
+        json_name = f'{data_id}.json'
         json_path = os.path.join(x_json_dir, json_name)
         json_data = empty_x_data(image_name, image_width, image_height)
 
         for yolo in yolo_arr:
             json_data['shapes'].append(yolo_2_x(yolo, labels, image_width, image_height))
 
+        json_text = json.dumps(json_data, ensure_ascii=False, indent=4)  # 先转换 出错时不留下写了一半的文件
         with open(json_path, 'w', encoding='utf-8') as f:
-            json.dump(json_data, f, ensure_ascii=False, indent=4)
+            f.write(json_text)
@@ -1,29 +1,29 @@
 import os
-import random
-import shutil
+from typing import Optional
 
-import cv2
 import numpy as np
-import pandas as pd
-from tqdm import tqdm
-from ultralytics.data.split import autosplit
 
-from one_dragon_yolo.devtools import ultralytics_utils, od_dataset_utils
+from one_dragon_yolo.devtools import dataset_build_utils, mosaic_utils, ultralytics_utils, od_dataset_utils
 
 
 class DataWrapper:
 
-    def __init__(self, data_id: str, image_path: str, yolo_txt_path: str):
+    def __init__(self, data_id: str, image_path: str, yolo_txt_path: str, labels: Optional[np.ndarray] = None):
         self.data_id: str = data_id
         self.image_path: str = image_path
         self.yolo_txt_path: str = yolo_txt_path
+        self.labels: Optional[np.ndarray] = labels  # 从标签汇总中读取的标签 为空时读取txt
 
 
 def init_dataset_images_and_labels(
         dataset_name: str,
         data_list: list[DataWrapper],
-        target_img_size: int = 2176
-) -> bool:
+        target_img_size: int = 2176,
+        num_workers: int = 1,
+        seed: Optional[int] = None,
+        force_rebuild: bool = False,
+        image_format: str = 'png',
+) -> Optional[list[str]]:
     """
     初始化一个数据集的图片和标签
 
@@ -34,82 +34,59 @@ def init_dataset_images_and_labels(
     图片大小需要是32倍数 是因为 YOLO 模型需要5次下采样
     正方形是ultralytics默认的处理图片方式，合并后整张图信息更多，不会有很多空白区域
 
+    数据集文件夹中会记录生成清单 再次生成时只重新生成输入变化了的图片 见 dataset_build_utils
+    再次生成时沿用上一次的配对 只有新增的原图重新抽取 需要全部重新配对时使用 force_rebuild
+
     Args:
         dataset_name: ultralytics数据集名称 在 ultralytics/datasets/{dataset_name}
         data_list: 原始数据
         target_img_size: 目标图片大小
+        num_workers: 生成图片的并行进程数 1 表示在当前进程中逐张生成
+        seed: 随机配对的种子 相同的种子和数据得到相同的数据集 None 时首次生成的配对每次不同
+        force_rebuild: 是否忽略生成清单 全部重新生成
+        image_format: 图片的保存格式 见 mosaic_utils.MOSAIC_IMAGE_FORMATS 改变格式时全部重新生成
 
     Returns:
-
+        生成的全部图片文件名 图片大小不合法时返回 None
     """
     if (target_img_size < 1080 * 2) or (target_img_size % 32 != 0):
         print('传入的图片大小不合法')
-        return False
+        return None
 
-    # 删除已存在的数据集
     target_dataset_dir = ultralytics_utils.get_dataset_dir(dataset_name)
-    shutil.rmtree(target_dataset_dir, ignore_errors=True)
-    os.mkdir(target_dataset_dir)
-
     target_img_dir = ultralytics_utils.get_dataset_images_dir(dataset_name)
-    os.mkdir(target_img_dir)
-
     target_label_dir = ultralytics_utils.get_dataset_labels_dir(dataset_name)
-    os.mkdir(target_label_dir)
-
-    total_cnt = len(data_list)
-
-    for case1_idx in tqdm(range(total_cnt), desc='初始化数据集图片'):
-        case2_idx = random.randint(0, total_cnt-1)
-        
-        case1 = data_list[case1_idx]
-        case2 = data_list[case2_idx]
-
-        img1 = cv2.imread(case1.image_path)
-        label1_df = read_label_txt(case1.yolo_txt_path)
-
-        img2 = cv2.imread(case2.image_path)
-        label2_df = read_label_txt(case2.yolo_txt_path)
-
-        height = img1.shape[0]
-        width = img1.shape[1]
-        radius = target_img_size
-
-        save_img = np.full((radius, radius, 3), 114, dtype=np.uint8)
-        save_img[0:height, 0:width, :] = img1
-        save_img[height:height+height, 0:width, :] = img2
-
-        label1_df['x'] *= width
-        label1_df['y'] *= height
-        label1_df['w'] *= width
-        label1_df['h'] *= height
-
-        label2_df['x'] *= width
-        label2_df['y'] *= height
-        label2_df['y'] += height
-        label2_df['w'] *= width
-        label2_df['h'] *= height
-
-        save_label_df = pd.concat([label1_df, label2_df])
-        save_label_df['x'] /= radius
-        save_label_df['y'] /= radius
-        save_label_df['w'] /= radius
-        save_label_df['h'] /= radius
-
-        save_img_path = os.path.join(target_img_dir, '%s-%s.png' % (case1.data_id, case2.data_id))
-        cv2.imwrite(save_img_path, save_img)
-
-        save_label_path = os.path.join(target_label_dir, '%s-%s.txt' % (case1.data_id, case2.data_id))
-        save_label_df.to_csv(save_label_path, sep=' ', index=False, header=False)
-
-    return True
-
-
-def read_label_txt(txt_path) -> pd.DataFrame:
-    """
-    读取一个标签文件
-    """
-    return pd.read_csv(txt_path, sep=' ', header=None, encoding='utf-8', names=['idx', 'x', 'y', 'w', 'h'])
+    os.makedirs(target_img_dir, exist_ok=True)
+    os.makedirs(target_label_dir, exist_ok=True)
+
+    image_ext = mosaic_utils.get_image_ext(image_format)
+    params = {'builder': 'yolo_random_pairing', 'target_img_size': target_img_size, 'seed': seed,
+              'image_format': image_format}
+    manifest, reusable = dataset_build_utils.load_manifest(
+        target_dataset_dir, params, force_rebuild=force_rebuild, output_dirs=[target_img_dir, target_label_dir])
+
+    # 先抽取全部配对 再分发生成 清单可以复用时沿用上一次的配对 不论是否固定种子
+    id_2_case = {case.data_id: case for case in data_list}
+    previous_pairs = manifest.get_pairs() if reusable else []
+    pair_jobs: list[tuple[tuple[str, str], mosaic_utils.MosaicJob]] = []
+    for pair in mosaic_utils.reuse_random_pairing([case.data_id for case in data_list], previous_pairs, seed):
+        case1 = id_2_case[pair[0]]
+        case2 = id_2_case[pair[1]]
+        save_name = '%s-%s' % (case1.data_id, case2.data_id)
+        pair_jobs.append((pair, mosaic_utils.MosaicJob(
+            case1.image_path, case1.yolo_txt_path, case2.image_path, case2.yolo_txt_path,
+            os.path.join(target_img_dir, save_name + image_ext),
+            os.path.join(target_label_dir, '%s.txt' % save_name),
+            target_img_size,
+            labels1=case1.labels,
+            labels2=case2.labels,
+            image_format=image_format,
+        )))
+
+    image_names = mosaic_utils.run_incremental_mosaic_jobs(
+        manifest, pair_jobs, target_img_dir, target_label_dir, num_workers=num_workers)
+    manifest.save(dataset_build_utils.get_manifest_path(target_dataset_dir))
+    return image_names
 
 
 def init_dataset(
@@ -118,39 +95,51 @@ def init_dataset(
         labels: list[str],
         target_img_size: int = 2176,
         split_weights=(0.9, 0.1, 0),
+        num_workers: int = 1,
+        seed: Optional[int] = None,
+        use_label_store: bool = False,
+        force_rebuild: bool = False,
+        image_format: str = 'png',
 ):
+    """
+    use_label_store=True 时从 yolo/.label_store.npz 中读取全部标注 只打开一个文件
+    再次调用时只重新生成输入变化了的图片 force_rebuild=True 时全部重新生成
+    image_format 见 mosaic_utils.MOSAIC_IMAGE_FORMATS 可以用 mosaic_utils.benchmark_image_formats 比较
+    """
     # 读取图片和标签
     id_2_image = od_dataset_utils.get_yolo_data_image_path(project_dir)
-    id_2_txt = od_dataset_utils.get_yolo_data_txt_path(project_dir)
+    if use_label_store:
+        id_2_labels = od_dataset_utils.get_yolo_data_labels(project_dir)
+        txt_dir = od_dataset_utils.get_yolo_txt_dir(project_dir)
+        id_2_txt = {data_id: os.path.join(txt_dir, f'{data_id}.txt') for data_id in id_2_labels}
+    else:
+        id_2_labels = {}
+        id_2_txt = od_dataset_utils.get_yolo_data_txt_path(project_dir)
 
     # 选取同时有图片和标注的id
     data_list: list[DataWrapper] = []
     for data_id in id_2_image.keys():
         if not data_id in id_2_txt:
             continue
-        data_list.append(DataWrapper(data_id, id_2_image[data_id], id_2_txt[data_id]))
+        data_list.append(DataWrapper(data_id, id_2_image[data_id], id_2_txt[data_id], id_2_labels.get(data_id)))
+    data_list.sort(key=lambda case: case.data_id)  # 与文件系统的遍历顺序无关
 
     # 初始化数据集
-    init_dataset_images_and_labels(
+    image_names = init_dataset_images_and_labels(
         dataset_name=dataset_name,
         data_list=data_list,
-        target_img_size=target_img_size
+        target_img_size=target_img_size,
+        num_workers=num_workers,
+        seed=seed,
+        force_rebuild=force_rebuild,
+        image_format=image_format,
     )
+    if image_names is None:
+        return
 
-    # 划分数据集
+    # 划分数据集 按图片名称稳定划分
     target_dataset_dir = ultralytics_utils.get_dataset_dir(dataset_name)
-    autosplit(path=ultralytics_utils.get_dataset_images_dir(dataset_name), weights=split_weights, annotated_only=True)
-    if split_weights[1] == 0:
-        train_txt_path = os.path.join(target_dataset_dir, 'autosplit_train.txt')
-        val_txt_path = os.path.join(target_dataset_dir, 'autosplit_val.txt')
-        shutil.copy(train_txt_path, val_txt_path)
+    dataset_build_utils.write_split_lists(target_dataset_dir, image_names, split_weights)
 
     # 保存dataset.yaml
-    with open(os.path.join(target_dataset_dir, 'dataset.yaml'), 'w', encoding='utf-8') as file:
-        file.write('path: %s\n' % dataset_name)
-        file.write('train: autosplit_train.txt\n')
-        file.write('val: autosplit_val.txt\n')
-        file.write('test: autosplit_test.txt\n')
-        file.write('names:\n')
-        for label_idx, label in enumerate(labels):
-            file.write('  %d: %s\n' % (label_idx, label))
+    dataset_build_utils.write_dataset_yaml(target_dataset_dir, dataset_name, labels)
@@ -0,0 +1,154 @@
+"""
+YOLO 标签文件的读写
+
+每个标签文件只有几行 `类别 x y w h` 使用 pandas 读取时 固定开销远大于解析本身
+这里直接解析成 (n, 5) 的 float32 数组 第0列是类别 后4列是相对于图片宽高的中心点和宽高
+"""
+import os
+from typing import Dict, List
+
+import numpy as np
+
+LABEL_COLUMNS = 5  # 类别 x y w h
+
+
+def empty_labels() -> np.ndarray:
+    """
+    Returns:
+        np.ndarray: 形状为 (0, 5) 的 float32 数组
+    """
+    return np.zeros((0, LABEL_COLUMNS), dtype=np.float32)
+
+
+def parse_labels(text: str, dtype=np.float32) -> np.ndarray:
+    """
+    解析标签文件的内容
+
+    Args:
+        text: 标签文件的内容 每行 `类别 x y w h` 空内容表示没有标签
+        dtype: 数组类型 需要保留txt中的全部精度时使用 np.float64
+
+    Returns:
+        np.ndarray: 形状为 (n, 5) 的数组
+    """
+    values = text.split()
+    if len(values) == 0:
+        return empty_labels().astype(dtype)
+    if len(values) % LABEL_COLUMNS != 0:
+        raise ValueError('标签格式错误 每行需要是 类别 x y w h')
+    return np.array(values, dtype=dtype).reshape(-1, LABEL_COLUMNS)
+
+
+def read_label_txt(txt_path: str, dtype=np.float32) -> np.ndarray:
+    """
+    读取一个标签文件 空文件返回 (0, 5) 的数组
+
+    Args:
+        txt_path: 标签文件路径
+        dtype: 数组类型
+
+    Returns:
+        np.ndarray: 形状为 (n, 5) 的数组
+    """
+    with open(txt_path, 'r', encoding='utf-8') as file:
+        return parse_labels(file.read(), dtype=dtype)
+
+
+def read_label_dir(labels_dir: str, dtype=np.float32) -> Dict[str, np.ndarray]:
+    """
+    读取文件夹中的全部标签文件
+
+    Args:
+        labels_dir: 标签文件夹
+        dtype: 数组类型
+
+    Returns:
+        Dict[str, np.ndarray]: 样例id (文件名去掉 .txt) -> 标签数组
+    """
+    result: Dict[str, np.ndarray] = {}
+    for label_txt in os.listdir(labels_dir):
+        if not label_txt.endswith('.txt'):
+            continue
+        result[label_txt[:-4]] = read_label_txt(os.path.join(labels_dir, label_txt), dtype=dtype)
+    return result
+
+
+def format_labels(labels: np.ndarray) -> str:
+    """
+    将标签数组转换成标签文件的内容 类别写成整数
+
+    Args:
+        labels: 形状为 (n, 5) 的数组
+
+    Returns:
+        str: 标签文件的内容 每行以换行结尾
+    """
+    return ''.join('%d %.6f %.6f %.6f %.6f\n' % (int(row[0]), row[1], row[2], row[3], row[4])
+                   for row in np.asarray(labels, dtype=np.float64).tolist())
+
+
+def write_label_txt(txt_path: str, labels: np.ndarray) -> None:
+    """
+    将标签数组写入一个标签文件 一次写入整个文件
+
+    Args:
+        txt_path: 标签文件路径
+        labels: 形状为 (n, 5) 的数组
+    """
+    with open(txt_path, 'w', encoding='utf-8') as file:
+        file.write(format_labels(labels))
+
+
+def remap_classes(labels: np.ndarray, id_old_2_new: Dict[int, int]) -> np.ndarray:
+    """
+    按映射转换类别 不在映射中的标签会被去掉
+
+    Args:
+        labels: 形状为 (n, 5) 的数组
+        id_old_2_new: 旧类别 -> 新类别
+
+    Returns:
+        np.ndarray: 转换后的标签
+    """
+    if len(labels) == 0 or len(id_old_2_new) == 0:
+        return empty_labels()
+    max_id = max(int(labels[:, 0].max()), max(id_old_2_new.keys())) + 1
+    mapping = np.full(max_id, -1, dtype=np.int64)
+    for id_old, id_new in id_old_2_new.items():
+        mapping[id_old] = id_new
+    new_classes = mapping[labels[:, 0].astype(np.int64)]
+    keep = new_classes >= 0
+    result = labels[keep].copy()
+    result[:, 0] = new_classes[keep]
+    return result
+
+
+def merge_vertical_labels(labels1: np.ndarray, labels2: np.ndarray,
+                          width: int, height: int, canvas_size: int) -> np.ndarray:
+    """
+    两张 width*height 的图片上下放到 canvas_size*canvas_size 的画布左上角 将两者的标签换算到画布上
+
+    Args:
+        labels1: 上方图片的标签
+        labels2: 下方图片的标签
+        width: 原图宽度
+        height: 原图高度
+        canvas_size: 画布大小
+
+    Returns:
+        np.ndarray: 合并后的标签
+    """
+    scale = np.array([1, width / canvas_size, height / canvas_size, width / canvas_size, height / canvas_size],
+                     dtype=np.float64)
+    result = np.concatenate([labels1, labels2]).astype(np.float64) * scale
+    result[len(labels1):, 2] += height / canvas_size
+    return result.astype(np.float32)
+
+
+def concat_labels(labels_list: List[np.ndarray]) -> np.ndarray:
+    """
+    合并多个标签数组
+    """
+    if len(labels_list) == 0:
+        return empty_labels()
+    return np.concatenate(labels_list).astype(np.float32, copy=False)
@@ -1,65 +1,226 @@
 import os
-from typing import Dict
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional
 
-from PySide6.QtCore import QThread, Signal
+from PySide6.QtCore import Qt, QThread, Signal
+from PySide6.QtGui import QColor, QPainter
 from PySide6.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QFileDialog, 
-                               QProgressBar, QTextEdit, QGroupBox, QGridLayout)
+                               QProgressBar, QPlainTextEdit, QGroupBox, QGridLayout)
 from qfluentwidgets import (PushButton, PrimaryPushButton, BodyLabel,
-                            DoubleSpinBox, SubtitleLabel, LineEdit, ComboBox,
-                            InfoBar, InfoBarPosition)
+                            DoubleSpinBox, SpinBox, SubtitleLabel, LineEdit, ComboBox,
+                            CheckBox, InfoBar, InfoBarPosition)
 
-from one_dragon_yolo.gui.similarity_processor import ImageSimilarityProcessor
+from one_dragon_yolo.gui.similarity_processor import (ImageSimilarityProcessor, SimilarityPlan, PLAN_MODES,
+                                                      KEEP_POLICY_SHORTEST_NAME,
+                                                      KEEP_POLICY_LARGEST_FILE, KEEP_POLICY_EARLIEST_MTIME,
+                                                      HASH_TYPE_AHASH, HASH_TYPE_DHASH,
+                                                      PIXEL_CHECK_SSIM, PIXEL_CHECK_MSE,
+                                                      SIMILARITY_BACKEND_PHASH, SIMILARITY_BACKEND_EMBEDDING)
+
+LOG_EMIT_INTERVAL = 0.2  # 工作线程合并日志和进度 每隔多少秒最多发送一次信号
+LOG_MAX_LINES = 5000  # 日志框最多保留的行数 每次发送的日志也最多这么多行
+
+# 处理模式下拉框对应的模式
+MODE_OPTIONS = ['cross_folder', 'within_folder', 'incremental', 'subsample']
+
+# 工作线程对预览的操作
+PLAN_ACTION_BUILD = 'build'  # 计算相似对
+PLAN_ACTION_COMMIT = 'commit'  # 按预览的相似对删除
+
+# 保留策略下拉框的选项 (显示文本, 策略)
+KEEP_POLICY_OPTIONS = [
+    ("文件名最短", KEEP_POLICY_SHORTEST_NAME),
+    ("文件最大", KEEP_POLICY_LARGEST_FILE),
+    ("修改时间最早", KEEP_POLICY_EARLIEST_MTIME),
+]
+
+# 预筛选哈希下拉框的选项 (显示文本, 哈希种类)
+PREFILTER_OPTIONS = [
+    ("不预筛选", None),
+    ("差异哈希 dHash", HASH_TYPE_DHASH),
+    ("均值哈希 aHash", HASH_TYPE_AHASH),
+]
+
+# 相似度计算方式下拉框的选项 (显示文本, 计算方式)
+BACKEND_OPTIONS = [
+    ("感知哈希", SIMILARITY_BACKEND_PHASH),
+    ("分类模型特征", SIMILARITY_BACKEND_EMBEDDING),
+]
+
+# 像素校验下拉框的选项 (显示文本, 校验方式, 阈值范围, 默认阈值, 后缀)
+PIXEL_CHECK_OPTIONS = [
+    ("不校验", None, (0.0, 1.0), 0.9, ""),
+    ("SSIM", PIXEL_CHECK_SSIM, (0.0, 1.0), 0.9, " (不低于)"),
+    ("MSE", PIXEL_CHECK_MSE, (0.0, 65025.0), 100.0, " (不高于)"),
+]
 
 
 class ImageSimilarityWorker(QThread):
     """图片相似度处理工作线程"""
     
     progress_updated = Signal(int, int, str)  # current, total, message
-    log_message = Signal(str)
-    finished = Signal(dict)  # 返回处理结果统计
+    log_message = Signal(str)  # 合并后的多行日志
+    finished = Signal(dict)  # 返回处理结果统计 取消时只包含已完成的部分
+    plan_ready = Signal(object)  # 预览完成 返回 SimilarityPlan 取消时为 None
     
-    def __init__(self, root_folder: str, similarity_threshold: float, mode: str):
+    def __init__(self, root_folder: str, similarity_threshold: float, mode: str,
+                 use_hash_cache: bool = True, num_workers: int = 1,
+                 keep_policy: str = KEEP_POLICY_SHORTEST_NAME, dry_run: bool = False,
+                 cascade_kwargs: Optional[Dict] = None, quarantine: bool = False,
+                 subsample_cnt: int = 0, plan_action: Optional[str] = None,
+                 plan: Optional[SimilarityPlan] = None):
         """
         初始化工作线程
 
         Args:
             root_folder: 根文件夹路径
             similarity_threshold: 相似度阈值 (0-1)
-            mode: 处理模式 ('cross_folder' 或 'within_folder')
+            mode: 处理模式 ('cross_folder'、'within_folder'、'incremental' 或 'subsample')
+            use_hash_cache: 是否使用根文件夹中的持久化哈希缓存
+            num_workers: 计算哈希的并行进程数
+            keep_policy: 文件夹内模式中 每个相似分组保留图片的策略
+            dry_run: 只生成报告 不删除任何文件
+            cascade_kwargs: 级联筛选的参数 直接传给 ImageSimilarityProcessor
+            quarantine: 将相似图片移动到根文件夹的 .quarantine 中 而不是直接删除
+            subsample_cnt: 下采样模式中 每个子文件夹最多保留的图片数量
+            plan_action: 为空时直接处理 build 时只计算预览 commit 时按 plan 删除
+            plan: plan_action 为 commit 时使用的预览结果
         """
         super().__init__()
         self.root_folder = root_folder
         self.similarity_threshold = similarity_threshold
         self.mode = mode
-        self.is_cancelled = False
-        self.processor = ImageSimilarityProcessor(similarity_threshold)
-        
+        self.plan_action = plan_action
+        self.plan = plan
+        self.cancel_event = threading.Event()
+        self.processor = ImageSimilarityProcessor(similarity_threshold, use_hash_cache=use_hash_cache,
+                                                  num_workers=num_workers, keep_policy=keep_policy,
+                                                  dry_run=dry_run, quarantine=quarantine,
+                                                  subsample_cnt=subsample_cnt,
+                                                  cancel_event=self.cancel_event,
+                                                  **(cascade_kwargs or {}))
+
+        # 日志和进度先在工作线程中合并 按 LOG_EMIT_INTERVAL 限速发送 避免大量信号阻塞界面
+        self._pending_logs: deque = deque(maxlen=LOG_MAX_LINES)
+        self._dropped_log_cnt: int = 0
+        self._pending_progress: Optional[tuple] = None
+        self._last_emit_time: float = 0
+
+    @property
+    def is_cancelled(self) -> bool:
+        return self.cancel_event.is_set()
+
     def cancel(self):
-        """取消处理"""
-        self.is_cancelled = True
-        
+        """取消处理 处理器会在当前这一批完成后停止 并返回已完成的部分"""
+        self.cancel_event.set()
+
+    def _emit_pending(self, force: bool = False):
+        """
+        发送合并的日志和最新的进度
+
+        Args:
+            force: 不受发送间隔限制
+        """
+        now = time.monotonic()
+        if not force and now - self._last_emit_time < LOG_EMIT_INTERVAL:
+            return
+        self._last_emit_time = now
+        if len(self._pending_logs) > 0:
+            lines = list(self._pending_logs)
+            if self._dropped_log_cnt > 0:
+                lines.insert(0, f"... 省略 {self._dropped_log_cnt} 条日志")
+                self._dropped_log_cnt = 0
+            self._pending_logs.clear()
+            self.log_message.emit('\n'.join(lines))
+        if self._pending_progress is not None:
+            self.progress_updated.emit(*self._pending_progress)
+            self._pending_progress = None
+
     def run(self):
         """执行图片相似度处理"""
         try:
             def progress_callback(current, total, message):
-                if not self.is_cancelled:
-                    self.progress_updated.emit(current, total, message)
+                self._pending_progress = (current, total, message)
+                self._emit_pending(force=current >= total)
 
             def log_callback(message):
-                if not self.is_cancelled:
-                    self.log_message.emit(message)
+                if len(self._pending_logs) == self._pending_logs.maxlen:
+                    self._dropped_log_cnt += 1
+                self._pending_logs.append(message)
+                self._emit_pending()
 
-            if self.mode == 'cross_folder':
+            if self.plan_action == PLAN_ACTION_BUILD:
+                plan = self.processor.build_plan(self.root_folder, self.mode,
+                                                 progress_callback=progress_callback, log_callback=log_callback)
+                if plan is not None:
+                    plan.deletion_counts()  # 在工作线程中算好 之后调整阈值时不需要等待
+                self._emit_pending(force=True)
+                self.plan_ready.emit(plan)
+                return
+            if self.plan_action == PLAN_ACTION_COMMIT:
+                result = self.processor.commit_plan(self.plan, progress_callback, log_callback)
+            elif self.mode == 'cross_folder':
                 result = self.processor.process_cross_folder_similarity(
                     self.root_folder, progress_callback, log_callback)
+            elif self.mode == 'incremental':
+                result = self.processor.process_incremental_similarity(
+                    self.root_folder, progress_callback, log_callback)
+            elif self.mode == 'subsample':
+                result = self.processor.process_subsample(
+                    self.root_folder, progress_callback, log_callback)
             else:
                 result = self.processor.process_within_folder_similarity(
                     self.root_folder, progress_callback, log_callback)
 
-            if not self.is_cancelled:
-                self.finished.emit(result)
+            self._emit_pending(force=True)
+            self.finished.emit(result)
         except Exception as e:
+            self._emit_pending(force=True)
             self.log_message.emit(f"处理过程中发生错误: {str(e)}")
+            if self.plan_action == PLAN_ACTION_BUILD:
+                self.plan_ready.emit(None)
+
+
+class PairHistogramWidget(QWidget):
+    """相似对的汉明距离直方图 距离不超过当前阈值的柱子高亮显示"""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.histogram: Optional[list] = None
+        self.threshold_distance: int = -1
+        self.setMinimumHeight(120)
+
+    def set_histogram(self, histogram: Optional[list]):
+        """设置每个汉明距离的相似对数量 None 表示清空"""
+        self.histogram = histogram
+        self.update()
+
+    def set_threshold_distance(self, threshold_distance: int):
+        """设置当前阈值对应的最大汉明距离"""
+        self.threshold_distance = threshold_distance
+        self.update()
+
+    def paintEvent(self, event):
+        if not self.histogram:
+            return
+        painter = QPainter(self)
+        label_height = 16
+        width = self.width()
+        height = self.height() - label_height
+        bar_width = width / len(self.histogram)
+        max_cnt = max(max(self.histogram), 1)
+        for distance, cnt in enumerate(self.histogram):
+            x = int(distance * bar_width)
+            bar_height = int(height * cnt / max_cnt)
+            color = QColor(220, 80, 80) if distance <= self.threshold_distance else QColor(150, 150, 150)
+            painter.fillRect(x + 1, height - bar_height, max(1, int(bar_width) - 2), bar_height, color)
+            if distance % 4 == 0:
+                painter.setPen(QColor(120, 120, 120))
+                painter.drawText(x, height, int(bar_width) * 4, label_height,
+                                 Qt.AlignmentFlag.AlignLeft, str(distance))
+        painter.end()
 
 
 
@@ -71,8 +232,9 @@ class ImageSimilarityTab(QWidget):
         """初始化图片相似度删除Tab"""
         super().__init__()
         self._init_ui()
-        self._connect_signals()
         self.worker = None
+        self.plan: Optional[SimilarityPlan] = None  # 预览的结果 调整阈值时直接使用
+        self._connect_signals()
         
     def _init_ui(self):
         """初始化用户界面"""
@@ -118,21 +280,119 @@ class ImageSimilarityTab(QWidget):
         self.mode_combo = ComboBox()
         self.mode_combo.addItems([
             "跨文件夹比较 (平衡各文件夹图片数量)",
-            "文件夹内比较 (删除每个文件夹内的重复图片)"
+            "文件夹内比较 (删除每个文件夹内的重复图片)",
+            "增量去重 (只比较新增的图片)",
+            "按类别下采样 (每个文件夹保留差异最大的N张)"
         ])
         settings_layout.addWidget(self.mode_combo, 1, 1)
+
+        # 哈希缓存
+        self.hash_cache_checkbox = CheckBox("使用哈希缓存 (未变化的图片不再重新计算)")
+        self.hash_cache_checkbox.setChecked(True)
+        settings_layout.addWidget(self.hash_cache_checkbox, 2, 0, 1, 2)
+
+        # 并行进程数
+        settings_layout.addWidget(BodyLabel("并行进程数:"), 3, 0)
+        cpu_count = os.cpu_count() or 1
+        self.workers_spinbox = SpinBox()
+        self.workers_spinbox.setRange(1, cpu_count)
+        self.workers_spinbox.setValue(max(1, cpu_count - 1))  # 留一个核心给界面
+        settings_layout.addWidget(self.workers_spinbox, 3, 1)
+
+        # 保留策略 只用于文件夹内比较
+        settings_layout.addWidget(BodyLabel("保留策略:"), 4, 0)
+        self.keep_policy_combo = ComboBox()
+        self.keep_policy_combo.addItems([text for text, _ in KEEP_POLICY_OPTIONS])
+        settings_layout.addWidget(self.keep_policy_combo, 4, 1)
+
+        # 预览
+        self.dry_run_checkbox = CheckBox("仅预览 (不删除文件 文件夹内比较时生成分组报告)")
+        settings_layout.addWidget(self.dry_run_checkbox, 5, 0, 1, 2)
+
+        # 隔离
+        self.quarantine_checkbox = CheckBox("移动到根文件夹的 .quarantine 中 (不直接删除)")
+        settings_layout.addWidget(self.quarantine_checkbox, 8, 0, 1, 2)
+
+        # 下采样数量 只用于按类别下采样
+        settings_layout.addWidget(BodyLabel("每类保留数量:"), 9, 0)
+        self.subsample_spinbox = SpinBox()
+        self.subsample_spinbox.setRange(1, 1000000)
+        self.subsample_spinbox.setValue(1000)
+        settings_layout.addWidget(self.subsample_spinbox, 9, 1)
+
+        # 相似度计算方式 使用分类模型特征时需要选择 export_cls_model 导出的 model.onnx
+        settings_layout.addWidget(BodyLabel("相似度计算:"), 10, 0)
+        backend_layout = QHBoxLayout()
+        self.backend_combo = ComboBox()
+        self.backend_combo.addItems([text for text, _ in BACKEND_OPTIONS])
+        self.model_path_edit = LineEdit()
+        self.model_path_edit.setPlaceholderText("分类模型 model.onnx")
+        self.model_path_edit.setReadOnly(True)
+        self.btn_select_model = PushButton("选择模型")
+        self.embedding_spinbox = DoubleSpinBox()
+        self.embedding_spinbox.setRange(0.5, 1.0)
+        self.embedding_spinbox.setSingleStep(0.01)
+        self.embedding_spinbox.setDecimals(3)
+        self.embedding_spinbox.setValue(0.95)
+        self.embedding_spinbox.setSuffix(" (余弦相似度)")
+        backend_layout.addWidget(self.backend_combo)
+        backend_layout.addWidget(self.model_path_edit, 1)
+        backend_layout.addWidget(self.btn_select_model)
+        backend_layout.addWidget(self.embedding_spinbox)
+        settings_layout.addLayout(backend_layout, 10, 1)
+
+        # 级联筛选 预筛选哈希先排除明显不同的图片对
+        settings_layout.addWidget(BodyLabel("预筛选:"), 6, 0)
+        prefilter_layout = QHBoxLayout()
+        self.prefilter_combo = ComboBox()
+        self.prefilter_combo.addItems([text for text, _ in PREFILTER_OPTIONS])
+        self.prefilter_spinbox = DoubleSpinBox()
+        self.prefilter_spinbox.setRange(0.1, 1.0)
+        self.prefilter_spinbox.setSingleStep(0.05)
+        self.prefilter_spinbox.setValue(0.75)
+        self.prefilter_spinbox.setDecimals(2)
+        self.prefilter_spinbox.setSuffix(" (应比相似度阈值宽松)")
+        prefilter_layout.addWidget(self.prefilter_combo)
+        prefilter_layout.addWidget(self.prefilter_spinbox, 1)
+        settings_layout.addLayout(prefilter_layout, 6, 1)
+
+        # 像素校验 只对通过感知哈希的图片对计算
+        settings_layout.addWidget(BodyLabel("像素校验:"), 7, 0)
+        pixel_check_layout = QHBoxLayout()
+        self.pixel_check_combo = ComboBox()
+        self.pixel_check_combo.addItems([option[0] for option in PIXEL_CHECK_OPTIONS])
+        self.pixel_check_spinbox = DoubleSpinBox()
+        self.pixel_check_spinbox.setDecimals(3)
+        pixel_check_layout.addWidget(self.pixel_check_combo)
+        pixel_check_layout.addWidget(self.pixel_check_spinbox, 1)
+        settings_layout.addLayout(pixel_check_layout, 7, 1)
+        self._on_pixel_check_changed(0)
         
         layout.addWidget(settings_group)
         
         # 控制按钮
         button_layout = QHBoxLayout()
         self.btn_start = PrimaryPushButton("开始处理")
+        self.btn_preview = PushButton("预览阈值")
+        self.btn_commit_plan = PushButton("按预览删除")
+        self.btn_commit_plan.setEnabled(False)
         self.btn_cancel = PushButton("取消处理")
         self.btn_cancel.setEnabled(False)
         button_layout.addWidget(self.btn_start)
+        button_layout.addWidget(self.btn_preview)
+        button_layout.addWidget(self.btn_commit_plan)
         button_layout.addWidget(self.btn_cancel)
         button_layout.addStretch()
         layout.addLayout(button_layout)
+
+        # 阈值预览 只计算一次相似对 调整相似度阈值时立即更新直方图和预计删除数量
+        plan_group = QGroupBox("阈值预览 (跨文件夹比较和文件夹内比较)")
+        plan_layout = QVBoxLayout(plan_group)
+        self.plan_label = BodyLabel("点击\"预览阈值\"计算相似对 之后调整相似度阈值可以立即看到预计删除的数量")
+        self.plan_histogram = PairHistogramWidget()
+        plan_layout.addWidget(self.plan_label)
+        plan_layout.addWidget(self.plan_histogram)
+        layout.addWidget(plan_group)
         
         # 进度条
         self.progress_bar = QProgressBar()
@@ -142,9 +402,10 @@ class ImageSimilarityTab(QWidget):
         # 日志显示
         log_group = QGroupBox("处理日志")
         log_layout = QVBoxLayout(log_group)
-        self.log_text = QTextEdit()
+        self.log_text = QPlainTextEdit()
         self.log_text.setMaximumHeight(200)
         self.log_text.setReadOnly(True)
+        self.log_text.setMaximumBlockCount(LOG_MAX_LINES)  # 超出时丢弃最早的日志
         log_layout.addWidget(self.log_text)
         layout.addWidget(log_group)
         
@@ -152,7 +413,27 @@ class ImageSimilarityTab(QWidget):
         """连接信号和槽"""
         self.btn_select_folder.clicked.connect(self._select_folder)
         self.btn_start.clicked.connect(self._start_processing)
+        self.btn_preview.clicked.connect(self._start_preview)
+        self.btn_commit_plan.clicked.connect(self._commit_plan)
+        self.similarity_spinbox.valueChanged.connect(self._update_plan_summary)
+        self.mode_combo.currentIndexChanged.connect(lambda _: self._set_plan(None))
         self.btn_cancel.clicked.connect(self._cancel_processing)
+        self.pixel_check_combo.currentIndexChanged.connect(self._on_pixel_check_changed)
+        self.btn_select_model.clicked.connect(self._select_model)
+
+    def _select_model(self):
+        """选择分类模型"""
+        model_path, _ = QFileDialog.getOpenFileName(self, "选择分类模型", "", "ONNX (*.onnx)")
+        if model_path:
+            self.model_path_edit.setText(model_path)
+
+    def _on_pixel_check_changed(self, index: int):
+        """像素校验方式变化时 切换阈值的范围和默认值"""
+        _, pixel_check, (min_value, max_value), default_value, suffix = PIXEL_CHECK_OPTIONS[index]
+        self.pixel_check_spinbox.setRange(min_value, max_value)
+        self.pixel_check_spinbox.setValue(default_value)
+        self.pixel_check_spinbox.setSuffix(suffix)
+        self.pixel_check_spinbox.setEnabled(pixel_check is not None)
         
     def _select_folder(self):
         """选择根文件夹"""
@@ -161,6 +442,7 @@ class ImageSimilarityTab(QWidget):
         )
         if folder_path:
             self.folder_path_edit.setText(folder_path)
+            self._set_plan(None)
             
     def _start_processing(self):
         """开始处理"""
@@ -177,28 +459,145 @@ class ImageSimilarityTab(QWidget):
             return
             
         similarity_threshold = self.similarity_spinbox.value()
-        mode = 'cross_folder' if self.mode_combo.currentIndex() == 0 else 'within_folder'
+        mode = MODE_OPTIONS[self.mode_combo.currentIndex()]
+        use_hash_cache = self.hash_cache_checkbox.isChecked()
+        num_workers = self.workers_spinbox.value()
+        keep_policy = KEEP_POLICY_OPTIONS[self.keep_policy_combo.currentIndex()][1]
+        dry_run = self.dry_run_checkbox.isChecked()
+        pixel_check = PIXEL_CHECK_OPTIONS[self.pixel_check_combo.currentIndex()][1]
+        cascade_kwargs = {
+            'prefilter_hash_type': PREFILTER_OPTIONS[self.prefilter_combo.currentIndex()][1],
+            'prefilter_threshold': self.prefilter_spinbox.value(),
+            'pixel_check': pixel_check,
+        }
+        backend = BACKEND_OPTIONS[self.backend_combo.currentIndex()][1]
+        if backend == SIMILARITY_BACKEND_EMBEDDING:
+            model_path = self.model_path_edit.text().strip()
+            if not model_path or not os.path.exists(model_path):
+                self._show_info("错误", "请先选择分类模型", success=False)
+                return
+            cascade_kwargs['similarity_backend'] = backend
+            cascade_kwargs['embedding_model_path'] = model_path
+            cascade_kwargs['embedding_threshold'] = self.embedding_spinbox.value()
+        if pixel_check == PIXEL_CHECK_SSIM:
+            cascade_kwargs['ssim_threshold'] = self.pixel_check_spinbox.value()
+        elif pixel_check == PIXEL_CHECK_MSE:
+            cascade_kwargs['mse_threshold'] = self.pixel_check_spinbox.value()
         
-        # 启动工作线程
-        self.worker = ImageSimilarityWorker(folder_path, similarity_threshold, mode)
+        # 启动工作线程 直接处理会修改图片 之前的预览失效
+        self._set_plan(None)
+        self._start_worker(ImageSimilarityWorker(folder_path, similarity_threshold, mode,
+                                                 use_hash_cache, num_workers, keep_policy, dry_run, cascade_kwargs,
+                                                 self.quarantine_checkbox.isChecked(),
+                                                 self.subsample_spinbox.value()),
+                           "开始处理...")
+
+    def _start_worker(self, worker: ImageSimilarityWorker, message: str):
+        """连接信号并启动工作线程"""
+        self.worker = worker
         self.worker.progress_updated.connect(self._update_progress)
         self.worker.log_message.connect(self._add_log)
         self.worker.finished.connect(self._processing_finished)
-        
+        self.worker.plan_ready.connect(self._on_plan_ready)
+
         # 更新UI状态
-        self.btn_start.setEnabled(False)
-        self.btn_cancel.setEnabled(True)
-        self.progress_bar.setVisible(True)
+        self._set_running(True)
         self.log_text.clear()
-        
-        self._add_log("开始处理...")
+
+        self._add_log(message)
         self.worker.start()
+
+    def _set_running(self, running: bool):
+        """工作线程运行时禁用开始类按钮"""
+        self.btn_start.setEnabled(not running)
+        self.btn_preview.setEnabled(not running)
+        self.btn_commit_plan.setEnabled(not running and self._can_commit_plan())
+        self.btn_cancel.setEnabled(running)
+        self.progress_bar.setVisible(running)
+
+    def _start_preview(self):
+        """计算预览的相似对 不修改任何图片"""
+        folder_path = self.folder_path_edit.text().strip()
+        if not folder_path or not os.path.exists(folder_path):
+            self._show_info("错误", "请先选择有效的根文件夹", success=False)
+            return
+        mode = MODE_OPTIONS[self.mode_combo.currentIndex()]
+        if mode not in PLAN_MODES:
+            self._show_info("错误", "只有跨文件夹比较和文件夹内比较支持预览", success=False)
+            return
+        if BACKEND_OPTIONS[self.backend_combo.currentIndex()][1] != SIMILARITY_BACKEND_PHASH:
+            self._show_info("错误", "预览只支持感知哈希", success=False)
+            return
+
+        self._set_plan(None)
+        self._start_worker(ImageSimilarityWorker(folder_path, self.similarity_spinbox.value(), mode,
+                                                 self.hash_cache_checkbox.isChecked(), self.workers_spinbox.value(),
+                                                 plan_action=PLAN_ACTION_BUILD),
+                           "开始预览...")
+
+    def _on_plan_ready(self, plan: Optional[SimilarityPlan]):
+        """预览完成"""
+        self._set_plan(plan)
+        self._set_running(False)
+
+    def _set_plan(self, plan: Optional[SimilarityPlan]):
+        """更新预览结果 None 表示预览失效"""
+        self.plan = plan
+        self.plan_histogram.set_histogram(None if plan is None else plan.histogram().tolist())
+        self._update_plan_summary()
+
+    def _can_commit_plan(self) -> bool:
+        """有预览结果 并且当前阈值在预览的范围内"""
+        if self.plan is None:
+            return False
+        try:
+            self.plan.threshold_to_distance(self.similarity_spinbox.value())
+        except ValueError:
+            return False
+        return True
+
+    def _update_plan_summary(self, *args):
+        """按当前阈值更新预览的直方图和预计删除数量"""
+        running = self.worker is not None and self.worker.isRunning()
+        self.btn_commit_plan.setEnabled(not running and self._can_commit_plan())
+        if self.plan is None:
+            self.plan_label.setText("点击\"预览阈值\"计算相似对 之后调整相似度阈值可以立即看到预计删除的数量")
+            self.plan_histogram.set_threshold_distance(-1)
+            return
+        similarity_threshold = self.similarity_spinbox.value()
+        try:
+            max_distance = self.plan.threshold_to_distance(similarity_threshold)
+        except ValueError as e:
+            self.plan_label.setText(str(e))
+            self.plan_histogram.set_threshold_distance(self.plan.max_distance)
+            return
+        self.plan_histogram.set_threshold_distance(max_distance)
+        self.plan_label.setText(
+            f"相似度 >= {similarity_threshold:.2f} (汉明距离 <= {max_distance}): "
+            f"相似对 {self.plan.count_pairs(similarity_threshold)} 个 "
+            f"预计删除 {self.plan.count_deletions(similarity_threshold)} 张 / 共 {len(self.plan.image_paths)} 张"
+        )
+
+    def _commit_plan(self):
+        """按预览的相似对和当前阈值删除 不重新计算哈希"""
+        if not self._can_commit_plan():
+            return
+        plan = self.plan
+        keep_policy = KEEP_POLICY_OPTIONS[self.keep_policy_combo.currentIndex()][1]
+        # 删除后预览失效
+        self._set_plan(None)
+        self._start_worker(ImageSimilarityWorker(plan.root_folder, self.similarity_spinbox.value(), plan.mode,
+                                                 use_hash_cache=self.hash_cache_checkbox.isChecked(),
+                                                 keep_policy=keep_policy, quarantine=self.quarantine_checkbox.isChecked(),
+                                                 plan_action=PLAN_ACTION_COMMIT, plan=plan),
+                           "按预览删除...")
         
     def _cancel_processing(self):
         """取消处理"""
         if self.worker and self.worker.isRunning():
             self.worker.cancel()
-            self._add_log("正在取消处理...")
+            self.btn_cancel.setEnabled(False)
+            self._add_log("正在取消处理 当前这一批完成后停止...")
             
     def _update_progress(self, current: int, total: int, message: str):
         """更新进度"""
@@ -209,24 +608,45 @@ class ImageSimilarityTab(QWidget):
             
     def _add_log(self, message: str):
         """添加日志消息"""
-        self.log_text.append(message)
+        self.log_text.appendPlainText(message)
         self.log_text.ensureCursorVisible()
         
     def _processing_finished(self, result: Dict):
         """处理完成"""
-        self.btn_start.setEnabled(True)
-        self.btn_cancel.setEnabled(False)
-        self.progress_bar.setVisible(False)
+        self._set_running(False)
         
         # 显示结果统计
         deleted_files = result.get('deleted_files', 0)
         processed_folders = result.get('processed_folders', 0)
         total_comparisons = result.get('total_comparisons', 0)
         
-        summary = (f"处理完成！\n"
-                  f"删除文件数: {deleted_files}\n"
+        if result.get('cancelled'):
+            title = '已取消 以下是已完成的部分'
+        elif self.worker.processor.dry_run:
+            title = '预览完成 未删除任何文件'
+        else:
+            title = '处理完成'
+        summary = (f"{title}！\n"
+                  f"{'预计删除' if self.worker.processor.dry_run else '删除'}文件数: {deleted_files}\n"
                   f"处理文件夹数: {processed_folders}\n"
                   f"总比较次数: {total_comparisons}")
+        if 'new_images' in result:
+            summary += f"\n新增图片数: {result['new_images']} 记录为已去重: {result['accepted_images']}"
+        if 'clusters' in result:
+            summary += f"\n相似分组数: {len(result['clusters'])}"
+        cascade = result.get('cascade')
+        if cascade is not None:
+            summary += (f"\n图片对: {cascade['total_pairs']} "
+                        f"预筛选排除 {cascade['prefilter_rejected']} "
+                        f"感知哈希排除 {cascade['phash_rejected']} "
+                        f"特征排除 {cascade['embedding_rejected']} "
+                        f"像素校验排除 {cascade['pixel_rejected']} "
+                        f"相似 {cascade['accepted_pairs']}")
+        timings = result.get('timings')
+        if timings is not None:
+            summary += (f"\n耗时: 哈希 {timings['hash']:.2f}s "
+                        f"比较 {timings['compare']:.2f}s "
+                        f"删除 {timings['delete']:.2f}s")
         
         self._add_log(summary)
         self._show_info("完成", summary, success=True)
@@ -2,30 +2,445 @@
 图片相似度处理模块
 
 该模块提供图片相似度计算和重复图片删除功能。
-支持两种模式：
+支持四种模式：
 1. 跨文件夹比较：平衡各文件夹的图片数量
 2. 文件夹内比较：删除每个文件夹内的重复图片
+3. 增量去重：只比较新增的图片，旧图片之间不再重复比较
+4. 按类别下采样：每个文件夹最多保留 N 张差异最大的图片
 """
 
+import json
 import os
+import shutil
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from typing import Dict, List, Tuple, Optional
 from pathlib import Path
+import numpy as np
 from PIL import Image
 import imagehash
 
+from one_dragon_yolo.devtools import cv2_utils, embedding_utils, hamming_utils, image_hash_utils
+from one_dragon_yolo.devtools.embedding_utils import EmbeddingIndex, FeatureCache, OnnxFeatureExtractor
+from one_dragon_yolo.devtools.hamming_utils import HammingIndex
+from one_dragon_yolo.devtools.hash_cache_utils import ImageHashCache
+from one_dragon_yolo.devtools.image_hash_utils import HashRoi
+
+
+HASH_CHUNK_SIZE = 64  # 并行计算哈希时 每个任务包含的图片数量
+CLUSTER_REPORT_FILE_NAME = 'similarity_clusters.json'  # 文件夹内模式的分组报告 保存在根文件夹中
+QUARANTINE_FOLDER_NAME = '.quarantine'  # 隔离的相似图片 按原子文件夹保存在根文件夹的这个目录下
+PLAN_MAX_DISTANCE = 16  # 预览时保存的相似对的最大汉明距离 对应相似度 0.75
+
+# 处理模式
+MODE_CROSS_FOLDER = 'cross_folder'
+MODE_WITHIN_FOLDER = 'within_folder'
+PLAN_MODES = [MODE_CROSS_FOLDER, MODE_WITHIN_FOLDER]  # 支持先预览再删除的模式
+
+# 文件夹内模式中 每个相似分组保留哪一张图片
+KEEP_POLICY_SHORTEST_NAME = 'shortest_name'  # 文件名最短的 (较长的通常是重复的副本)
+KEEP_POLICY_LARGEST_FILE = 'largest_file'  # 文件最大的 通常画质最好
+KEEP_POLICY_EARLIEST_MTIME = 'earliest_mtime'  # 修改时间最早的 即最先保存的
+KEEP_POLICIES = [KEEP_POLICY_SHORTEST_NAME, KEEP_POLICY_LARGEST_FILE, KEEP_POLICY_EARLIEST_MTIME]
+
+# 哈希种类 感知哈希用于最终判断 均值哈希和差异哈希只用于预筛选
+HASH_TYPE_PHASH = 'phash'
+HASH_TYPE_AHASH = 'ahash'
+HASH_TYPE_DHASH = 'dhash'
+PREFILTER_HASH_TYPES = [HASH_TYPE_AHASH, HASH_TYPE_DHASH]
+HASH_TYPE_EMBEDDING = 'embedding'  # 分类模型的特征 不是哈希 但与哈希一样按图片路径保存和打包
+
+# 相似度计算方式
+SIMILARITY_BACKEND_PHASH = 'phash'  # 感知哈希 只能找出画面几乎一样的图片
+SIMILARITY_BACKEND_EMBEDDING = 'embedding'  # 分类模型特征的余弦相似度 可以找出语义上重复的图片
+SIMILARITY_BACKENDS = [SIMILARITY_BACKEND_PHASH, SIMILARITY_BACKEND_EMBEDDING]
+
+# 像素级校验 只对通过感知哈希的图片对进行
+PIXEL_CHECK_SSIM = 'ssim'
+PIXEL_CHECK_MSE = 'mse'
+PIXEL_CHECKS = [PIXEL_CHECK_SSIM, PIXEL_CHECK_MSE]
+
+_FAST_HASH_BATCH = {
+    HASH_TYPE_PHASH: image_hash_utils.phash_batch,
+    HASH_TYPE_AHASH: image_hash_utils.ahash_batch,
+    HASH_TYPE_DHASH: image_hash_utils.dhash_batch,
+}
+_IMAGEHASH_FUNC = {
+    HASH_TYPE_PHASH: imagehash.phash,
+    HASH_TYPE_AHASH: imagehash.average_hash,
+    HASH_TYPE_DHASH: imagehash.dhash,
+}
+
+
+def compute_image_hash(image_path: str, fast_decode: bool = True, roi: Optional[HashRoi] = None) -> Optional[int]:
+    """
+    计算一张图片的感知哈希值 不使用缓存
+    定义在模块层级 以便在子进程中调用
+
+    Args:
+        image_path: 图片文件路径
+        fast_decode: 是否直接解码成缩小的灰度图 误差见 image_hash_utils
+        roi: 感兴趣区域 None 表示使用完整画面
+
+    Returns:
+        图片的感知哈希值 (64位整数)，如果计算失败返回None
+    """
+    hash_values = compute_image_hash_chunk([image_path], fast_decode, roi=roi)[0]
+    return None if hash_values is None else hash_values[0]
+
+
+def compute_image_hash_chunk(image_paths: List[str], fast_decode: bool = True,
+                             hash_types: Tuple[str, ...] = (HASH_TYPE_PHASH,),
+                             roi: Optional[HashRoi] = None,
+                             progress_callback=None) -> List[Optional[Tuple[int, ...]]]:
+    """
+    计算一批图片的哈希值 作为进程池的一个任务
+    快速解码时 先读取每张图片的 32*32 灰度图 再一起批量计算各种哈希 每张图片只解码一次
+
+    Args:
+        image_paths: 图片文件路径列表
+        fast_decode: 是否直接解码成缩小的灰度图
+        hash_types: 需要计算的哈希种类
+        roi: 感兴趣区域 None 表示使用完整画面
+        progress_callback: 每解码一张图片后的回调 (已完成数量) 只在当前进程中计算时使用
+
+    Returns:
+        与图片路径一一对应的列表 每项是与 hash_types 顺序一致的哈希值 计算失败时为 None
+    """
+    result: List[Optional[Tuple[int, ...]]] = [None] * len(image_paths)
+    tiles: List[np.ndarray] = []
+    tile_idx_list: List[int] = []
+    for idx, image_path in enumerate(image_paths):
+        try:
+            # 使用感知哈希算法，对图片的小幅变化不敏感
+            if fast_decode:
+                tile = image_hash_utils.load_hash_tile(image_path, roi)
+                if tile is not None:
+                    tiles.append(tile)
+                    tile_idx_list.append(idx)
+            else:
+                with Image.open(image_path) as img:
+                    if roi is not None:
+                        img = Image.fromarray(roi.apply(np.asarray(img.convert('L'))))
+                    result[idx] = tuple(hamming_utils.hash_to_int(_IMAGEHASH_FUNC[hash_type](img))
+                                        for hash_type in hash_types)
+        except Exception as e:
+            print(f"无法处理图片 {image_path}: {str(e)}")
+        if progress_callback is not None:
+            progress_callback(idx + 1)
+
+    if len(tiles) > 0:
+        tile_arr = np.stack(tiles)
+        hash_columns = [_FAST_HASH_BATCH[hash_type](tile_arr).tolist() for hash_type in hash_types]
+        for idx, hash_values in zip(tile_idx_list, zip(*hash_columns)):
+            result[idx] = hash_values
+
+    return result
+
+
+def new_cascade_stats() -> Dict[str, int]:
+    """
+    级联筛选的统计 记录每个阶段排除了多少图片对
+
+    Returns:
+        统计字典
+    """
+    return {
+        'total_pairs': 0,  # 需要比较的全部图片对
+        'prefilter_rejected': 0,  # 被预筛选哈希排除的
+        'phash_rejected': 0,  # 被感知哈希排除的
+        'embedding_rejected': 0,  # 使用特征时 被余弦相似度排除的
+        'pixel_rejected': 0,  # 被像素级校验排除的
+        'accepted_pairs': 0,  # 最终认为相似的
+    }
+
+
+class ProcessCancelled(Exception):
+    """处理被取消 已完成的部分保留在处理结果中"""
+    pass
+
+
+def new_timings() -> Dict[str, float]:
+    """
+    各阶段的耗时 单位秒 删除的耗时不计入比较
+
+    Returns:
+        耗时字典
+    """
+    return {
+        'hash': 0.0,  # 计算哈希和特征
+        'compare': 0.0,  # 查询索引和级联筛选
+        'delete': 0.0,  # 删除或隔离文件
+    }
+
+
+class SimilarityPlan:
+    """
+    预览的结果 保存了汉明距离不超过 max_distance 的全部相似对
+    之后调整相似度阈值时 直接从相似对中计算直方图和需要删除的数量 不需要重新计算哈希
+    图片按文件夹连续排列 文件夹的顺序与 get_folder_info 一致
+    """
+
+    def __init__(self, root_folder: str, mode: str, folder_info: List[Tuple[str, str, int]],
+                 image_paths: List[str], folder_start: np.ndarray, hashes: np.ndarray,
+                 pair_i: np.ndarray, pair_j: np.ndarray, distance: np.ndarray,
+                 max_distance: int, total_comparisons: int = 0):
+        """
+        Args:
+            root_folder: 根文件夹路径
+            mode: 处理模式 见 PLAN_MODES
+            folder_info: 文件夹信息列表
+            image_paths: 全部图片路径 按文件夹连续排列
+            folder_start: 长度为 文件夹数量+1 第 f 个文件夹的图片下标为 [folder_start[f], folder_start[f+1])
+            hashes: 与图片路径对应的感知哈希
+            pair_i: 相似对的第一个下标 跨文件夹模式中是数量较少的源文件夹中的图片
+            pair_j: 相似对的第二个下标
+            distance: 相似对的汉明距离
+            max_distance: 保存的相似对的最大汉明距离
+            total_comparisons: 预览时计算汉明距离的次数
+        """
+        self.root_folder: str = root_folder
+        self.mode: str = mode
+        self.folder_info: List[Tuple[str, str, int]] = folder_info
+        self.image_paths: List[str] = image_paths
+        self.folder_start: np.ndarray = folder_start
+        self.image_folder: np.ndarray = np.repeat(np.arange(len(folder_info)), np.diff(folder_start))
+        self.hashes: np.ndarray = hashes
+        self.pair_i: np.ndarray = pair_i
+        self.pair_j: np.ndarray = pair_j
+        self.distance: np.ndarray = distance
+        self.max_distance: int = max_distance
+        self.total_comparisons: int = total_comparisons
+        self._deletion_counts: Optional[np.ndarray] = None
+
+    @property
+    def min_similarity(self) -> float:
+        """预览能支持的最低相似度阈值"""
+        return float(hamming_utils.distance_to_similarity(self.max_distance))
+
+    def threshold_to_distance(self, similarity_threshold: float) -> int:
+        """
+        将相似度阈值转换成最大汉明距离 超出预览范围时抛出 ValueError
+        """
+        max_distance = hamming_utils.similarity_to_max_distance(similarity_threshold)
+        if max_distance > self.max_distance:
+            raise ValueError(f'相似度阈值低于预览的范围 {self.min_similarity:.3f}')
+        return max_distance
+
+    def histogram(self) -> np.ndarray:
+        """
+        Returns:
+            np.ndarray: 长度为 max_distance + 1 第 d 项是汉明距离等于 d 的相似对数量
+        """
+        return np.bincount(self.distance, minlength=self.max_distance + 1)[:self.max_distance + 1]
+
+    def deletion_counts(self) -> np.ndarray:
+        """
+        每个最大汉明距离下需要删除的图片数量 第一次调用时计算
+
+        Returns:
+            np.ndarray: 长度为 max_distance + 1 第 d 项是只使用距离 <= d 的相似对时需要删除的数量
+        """
+        if self._deletion_counts is None:
+            if self.mode == MODE_WITHIN_FOLDER:
+                # 每个分组保留一张 删除的数量与保留策略无关
+                self._deletion_counts = hamming_utils.merge_counts_by_distance(
+                    len(self.image_paths), self.pair_i, self.pair_j, self.distance, self.max_distance)
+            else:
+                self._deletion_counts = np.array([len(self.cross_folder_deletions(d)[0])
+                                                  for d in range(self.max_distance + 1)], dtype=np.int64)
+        return self._deletion_counts
+
+    def count_deletions(self, similarity_threshold: float) -> int:
+        """
+        Args:
+            similarity_threshold: 相似度阈值 (0-1)
+
+        Returns:
+            使用这个阈值时需要删除的图片数量
+        """
+        return int(self.deletion_counts()[self.threshold_to_distance(similarity_threshold)])
+
+    def count_pairs(self, similarity_threshold: float) -> int:
+        """
+        Args:
+            similarity_threshold: 相似度阈值 (0-1)
+
+        Returns:
+            使用这个阈值时的相似对数量
+        """
+        return int(np.count_nonzero(self.distance <= self.threshold_to_distance(similarity_threshold)))
+
+    def cross_folder_deletions(self, max_distance: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        按跨文件夹模式的顺序模拟删除: 从图片少的文件夹开始 删除后面文件夹中与仍然保留的图片相似的图片
+
+        Args:
+            max_distance: 最大汉明距离
+
+        Returns:
+            (删除的图片下标, 与源文件夹最小的汉明距离) 按删除的顺序排列
+        """
+        mask = self.distance <= max_distance
+        source_idx, target_idx, distance = self.pair_i[mask], self.pair_j[mask], self.distance[mask]
+        source_folder = self.image_folder[source_idx]
+        alive = np.ones(len(self.image_paths), dtype=bool)
+        deleted_idx: List[np.ndarray] = []
+        deleted_distance: List[np.ndarray] = []
+        for folder_idx in range(len(self.folder_info) - 1):
+            # 同一个源文件夹删除的图片都在后面的文件夹中 不影响这个源文件夹的其它相似对
+            selected = (source_folder == folder_idx) & alive[source_idx] & alive[target_idx]
+            if not selected.any():
+                continue
+            targets, target_distance = target_idx[selected], distance[selected]
+            order = np.lexsort((target_distance, targets))
+            unique_targets, first = np.unique(targets[order], return_index=True)
+            alive[unique_targets] = False
+            deleted_idx.append(unique_targets)
+            deleted_distance.append(target_distance[order][first])
+        if len(deleted_idx) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.uint8)
+        return np.concatenate(deleted_idx), np.concatenate(deleted_distance)
+
 
 class ImageSimilarityProcessor:
     """图片相似度处理器"""
     
-    def __init__(self, similarity_threshold: float = 0.85):
+    def __init__(self, similarity_threshold: float = 0.85, use_hash_cache: bool = True,
+                 num_workers: int = 1, fast_decode: bool = True,
+                 keep_policy: str = KEEP_POLICY_SHORTEST_NAME, dry_run: bool = False,
+                 prefilter_hash_type: Optional[str] = None, prefilter_threshold: float = 0.75,
+                 pixel_check: Optional[str] = None, ssim_threshold: float = 0.9, mse_threshold: float = 100.0,
+                 quarantine: bool = False, subsample_cnt: int = 0, roi: Optional[HashRoi] = None,
+                 similarity_backend: str = SIMILARITY_BACKEND_PHASH, embedding_model_path: Optional[str] = None,
+                 embedding_threshold: float = 0.95, embedding_batch_size: int = 16,
+                 cancel_event: Optional[threading.Event] = None):
         """
         初始化相似度处理器
         
         Args:
             similarity_threshold: 相似度阈值 (0-1)，越高越严格
+            use_hash_cache: 是否使用根文件夹中的持久化哈希缓存
+            num_workers: 计算哈希的并行进程数 1表示在当前线程中计算
+            fast_decode: 是否直接解码成缩小的灰度图计算哈希 更快 但与完整解码的结果有很小的误差
+            keep_policy: 文件夹内模式中 每个相似分组保留图片的策略 见 KEEP_POLICIES
+            dry_run: 只生成报告 不删除任何文件
+            prefilter_hash_type: 预筛选使用的哈希种类 ahash / dhash，None 表示直接使用感知哈希查找
+            prefilter_threshold: 预筛选的相似度阈值 (0-1) 应比 similarity_threshold 宽松
+            pixel_check: 对通过感知哈希的图片对再做的像素级校验 ssim / mse，None 表示不校验
+            ssim_threshold: SSIM 不低于这个值才认为相似
+            mse_threshold: MSE 不高于这个值才认为相似 (0-255 灰度)
+            quarantine: 将相似图片移动到根文件夹的 .quarantine 中 而不是直接删除
+            subsample_cnt: 下采样模式中 每个子文件夹最多保留的图片数量
+            roi: 计算哈希时使用的感兴趣区域 None 时读取根文件夹中的 similarity_roi.json 没有则使用完整画面
+            similarity_backend: 相似度计算方式 phash / embedding
+            embedding_model_path: 使用特征时 export_cls_model 导出的 model.onnx 路径
+            embedding_threshold: 使用特征时的余弦相似度阈值 代替 similarity_threshold
+            embedding_batch_size: 提取特征时每次推理的图片数量
+            cancel_event: 取消处理的信号 可以由其它线程设置 为空时新建一个 通过 cancel() 设置
         """
+        if keep_policy not in KEEP_POLICIES:
+            raise ValueError(f'未知的保留策略: {keep_policy}')
+        if prefilter_hash_type is not None and prefilter_hash_type not in PREFILTER_HASH_TYPES:
+            raise ValueError(f'未知的预筛选哈希: {prefilter_hash_type}')
+        if pixel_check is not None and pixel_check not in PIXEL_CHECKS:
+            raise ValueError(f'未知的像素校验: {pixel_check}')
+        if similarity_backend not in SIMILARITY_BACKENDS:
+            raise ValueError(f'未知的相似度计算方式: {similarity_backend}')
+        if similarity_backend == SIMILARITY_BACKEND_EMBEDDING and embedding_model_path is None:
+            raise ValueError('使用特征时需要指定模型路径')
         self.similarity_threshold = similarity_threshold
         self.image_extensions = {'.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tiff'}
+        self.use_hash_cache = use_hash_cache
+        self.num_workers = max(1, num_workers)
+        self.fast_decode = fast_decode
+        self.hash_cache: Optional[ImageHashCache] = None
+        self.feature_cache: Optional[FeatureCache] = None  # 第一次提取特征时打开 与哈希缓存一起关闭
+        self.keep_policy = keep_policy
+        self.dry_run = dry_run
+
+        # 级联筛选: 预筛选哈希建立索引找候选 -> 感知哈希确认 -> 可选的像素级校验
+        self.prefilter_hash_type = prefilter_hash_type
+        self.prefilter_threshold = prefilter_threshold
+        self.pixel_check = pixel_check
+        self.ssim_threshold = ssim_threshold
+        self.mse_threshold = mse_threshold
+        self.hash_types: Tuple[str, ...] = (HASH_TYPE_PHASH,) if prefilter_hash_type is None \
+            else (HASH_TYPE_PHASH, prefilter_hash_type)
+        self.index_hash_type: str = HASH_TYPE_PHASH if prefilter_hash_type is None else prefilter_hash_type
+        self._pixel_tiles: Dict[str, Optional[np.ndarray]] = {}  # 像素级校验用的小图 只在一次处理中有效
+        self.quarantine = quarantine
+        self.root_folder: Optional[str] = None  # 正在处理的根文件夹
+        self.subsample_cnt = subsample_cnt
+        self.fixed_roi: Optional[HashRoi] = roi
+        self.roi: Optional[HashRoi] = roi  # 当前使用的感兴趣区域
+
+        # 使用特征时 用特征建立索引 代替预筛选哈希和感知哈希
+        self.similarity_backend = similarity_backend
+        self.embedding_model_path = embedding_model_path
+        self.embedding_threshold = embedding_threshold
+        self.embedding_batch_size = embedding_batch_size
+        self._feature_extractor: Optional[OnnxFeatureExtractor] = None  # 第一次使用时才加载模型
+        if similarity_backend == SIMILARITY_BACKEND_EMBEDDING:
+            self.index_hash_type = HASH_TYPE_EMBEDDING
+
+        self.cancel_event: threading.Event = cancel_event if cancel_event is not None else threading.Event()
+
+    def cancel(self) -> None:
+        """
+        取消处理 可以在其它线程中调用 处理会在当前这一批完成后停止
+        """
+        self.cancel_event.set()
+
+    def check_cancelled(self) -> None:
+        """
+        已经取消时抛出 ProcessCancelled 在每一批处理之间调用
+        """
+        if self.cancel_event.is_set():
+            raise ProcessCancelled()
+
+    def get_hash_cache_kind(self, hash_type: str) -> str:
+        """
+        哈希在缓存中的种类名 快速解码和完整解码的结果不完全一致 分开保存
+        使用感兴趣区域时 种类名中带有区域的签名 区域变化后缓存自动失效
+
+        Args:
+            hash_type: 哈希种类
+
+        Returns:
+            缓存中的种类名
+        """
+        kind = f'{hash_type}_fast' if self.fast_decode else hash_type
+        if self.roi is not None and not self.roi.is_empty():
+            kind = f'{kind}_roi_{self.roi.signature()}'
+        return kind
+
+    def open_hash_cache(self, root_folder: str) -> None:
+        """
+        打开根文件夹中的哈希缓存 未开启缓存时不做任何事
+        同时读取根文件夹中的感兴趣区域配置 (初始化时指定了 roi 的除外)
+
+        Args:
+            root_folder: 根文件夹路径
+        """
+        self.close_hash_cache()
+        self.root_folder = root_folder
+        if self.fixed_roi is None:
+            self.roi = HashRoi.load(os.path.join(root_folder, image_hash_utils.ROI_FILE_NAME))
+        if self.use_hash_cache:
+            self.hash_cache = ImageHashCache(root_folder)
+
+    def close_hash_cache(self) -> None:
+        """
+        保存并关闭哈希缓存和特征缓存
+        """
+        if self.hash_cache is not None:
+            self.hash_cache.close()
+            self.hash_cache = None
+        if self.feature_cache is not None:
+            self.feature_cache.close()
+            self.feature_cache = None
         
     def get_image_files(self, folder_path: str) -> List[str]:
         """
@@ -48,25 +463,28 @@ class ImageSimilarityProcessor:
                 
         return image_files
         
-    def calculate_image_hash(self, image_path: str) -> Optional[imagehash.ImageHash]:
+    def calculate_image_hash(self, image_path: str) -> Optional[int]:
         """
         计算图片的感知哈希值
+        如果打开了哈希缓存 会优先使用文件大小和修改时间都没有变化的缓存结果
         
         Args:
             image_path: 图片文件路径
             
         Returns:
-            图片的感知哈希值，如果计算失败返回None
+            图片的感知哈希值 (64位整数)，如果计算失败返回None
         """
-        try:
-            with Image.open(image_path) as img:
-                # 使用感知哈希算法，对图片的小幅变化不敏感
-                return imagehash.phash(img)
-        except Exception as e:
-            print(f"无法处理图片 {image_path}: {str(e)}")
-            return None
+        if self.hash_cache is not None:
+            hash_value = self.hash_cache.get(image_path, self.get_hash_cache_kind(HASH_TYPE_PHASH))
+            if hash_value is not None:
+                return hash_value
+
+        hash_value = compute_image_hash(image_path, self.fast_decode, self.roi)
+        if hash_value is not None and self.hash_cache is not None:
+            self.hash_cache.put(image_path, hash_value, self.get_hash_cache_kind(HASH_TYPE_PHASH))
+        return hash_value
             
-    def calculate_similarity(self, hash1: imagehash.ImageHash, hash2: imagehash.ImageHash) -> float:
+    def calculate_similarity(self, hash1: int, hash2: int) -> float:
         """
         计算两个哈希值的相似度
         
@@ -77,11 +495,8 @@ class ImageSimilarityProcessor:
         Returns:
             相似度 (0-1)，1表示完全相同
         """
-        hamming_distance = hash1 - hash2
-        # 感知哈希通常是64位，最大汉明距离为64
-        max_distance = 64
-        similarity = 1.0 - (hamming_distance / max_distance)
-        return similarity
+        hamming_distance = (hash1 ^ hash2).bit_count()
+        return hamming_utils.distance_to_similarity(hamming_distance)
         
     def get_folder_info(self, root_folder: str) -> List[Tuple[str, str, int]]:
         """
@@ -98,8 +513,9 @@ class ImageSimilarityProcessor:
         if not os.path.exists(root_folder):
             return folder_info
             
-        subfolders = [f for f in os.listdir(root_folder) 
-                     if os.path.isdir(os.path.join(root_folder, f))]
+        # 隐藏文件夹 (例如 .quarantine) 不参与处理
+        subfolders = [f for f in os.listdir(root_folder)
+                      if not f.startswith('.') and os.path.isdir(os.path.join(root_folder, f))]
         
         for folder in subfolders:
             folder_path = os.path.join(root_folder, folder)
@@ -110,27 +526,527 @@ class ImageSimilarityProcessor:
         folder_info.sort(key=lambda x: x[2])
         return folder_info
         
-    def calculate_all_hashes(self, folder_info: List[Tuple[str, str, int]]) -> Dict[str, imagehash.ImageHash]:
+    def calculate_all_hashes(self, folder_info: List[Tuple[str, str, int]],
+                             progress_callback=None) -> Dict[str, int]:
         """
-        计算所有图片的哈希值
-        
+        计算所有图片的感知哈希值
+
         Args:
             folder_info: 文件夹信息列表
-            
+            progress_callback: 进度回调函数 (current, total, message)
+
         Returns:
             {图片路径: 哈希值} 的字典
         """
-        all_hashes = {}
-        
+        return self.calculate_all_hash_types(folder_info, progress_callback)[HASH_TYPE_PHASH]
+
+    def calculate_all_hash_types(self, folder_info: List[Tuple[str, str, int]],
+                                 progress_callback=None) -> Dict[str, Dict[str, int]]:
+        """
+        计算所有图片在 self.hash_types 中的各种哈希值
+        缓存中没有的图片按 HASH_CHUNK_SIZE 分批计算，num_workers > 1 时分发到进程池，
+        结果按原顺序逐批返回并报告进度
+
+        Args:
+            folder_info: 文件夹信息列表
+            progress_callback: 进度回调函数 (current, total, message)
+
+        Returns:
+            {哈希种类: {图片路径: 哈希值}} 的字典
+        """
+        image_paths: List[str] = []
         for folder_name, folder_path, image_count in folder_info:
-            image_files = self.get_image_files(folder_path)
-            for image_path in image_files:
-                hash_value = self.calculate_image_hash(image_path)
-                if hash_value is not None:
-                    all_hashes[image_path] = hash_value
-                    
-        return all_hashes
-        
+            image_paths.extend(self.get_image_files(folder_path))
+        return self.calculate_hash_types(image_paths, progress_callback)
+
+    def calculate_hash_types(self, image_paths: List[str], progress_callback=None) -> Dict[str, Dict[str, int]]:
+        """
+        计算指定图片在 self.hash_types 中的各种哈希值
+
+        Args:
+            image_paths: 图片路径列表
+            progress_callback: 进度回调函数 (current, total, message)
+
+        Returns:
+            {哈希种类: {图片路径: 哈希值}} 的字典 计算失败的图片不包含在内
+        """
+        total = len(image_paths)
+        cache_kinds = [self.get_hash_cache_kind(hash_type) for hash_type in self.hash_types]
+
+        # 先读取缓存 只有未命中的图片需要计算 任意一种哈希未命中时全部重新计算
+        hash_list: List[Optional[Tuple[int, ...]]] = [None] * total
+        to_compute: List[int] = []
+        for idx, image_path in enumerate(image_paths):
+            if self.hash_cache is not None:
+                cached = tuple(self.hash_cache.get(image_path, kind) for kind in cache_kinds)
+                if None not in cached:
+                    hash_list[idx] = cached
+            if hash_list[idx] is None:
+                to_compute.append(idx)
+
+        done = total - len(to_compute)
+        if progress_callback:
+            progress_callback(done, total, "计算哈希值")
+
+        chunks = [to_compute[i:i + HASH_CHUNK_SIZE] for i in range(0, len(to_compute), HASH_CHUNK_SIZE)]
+
+        def save_chunk(chunk: List[int], chunk_result: List[Optional[Tuple[int, ...]]]) -> None:
+            for idx, hash_values in zip(chunk, chunk_result):
+                hash_list[idx] = hash_values
+                if hash_values is not None and self.hash_cache is not None:
+                    for kind, hash_value in zip(cache_kinds, hash_values):
+                        self.hash_cache.put(image_paths[idx], hash_value, kind)
+
+        # 取消时已经算好的哈希仍然写入缓存 下次不需要重新计算
+        try:
+            if self.num_workers > 1 and len(chunks) > 1:
+                # 进程池中的任务按完成顺序返回 每完成一批报告一次进度
+                executor = ProcessPoolExecutor(max_workers=min(self.num_workers, len(chunks)))
+                try:
+                    future_chunks = {
+                        executor.submit(compute_image_hash_chunk, [image_paths[idx] for idx in chunk],
+                                        self.fast_decode, self.hash_types, self.roi): chunk
+                        for chunk in chunks
+                    }
+                    for future in as_completed(future_chunks):
+                        chunk = future_chunks[future]
+                        save_chunk(chunk, future.result())
+                        done += len(chunk)
+                        if progress_callback:
+                            progress_callback(done, total, "计算哈希值")
+                        self.check_cancelled()
+                finally:
+                    # 取消时不等待正在计算的任务
+                    executor.shutdown(wait=not self.cancel_event.is_set(), cancel_futures=True)
+            else:
+                # 在当前线程中计算时 每解码一张图片报告一次进度
+                for chunk in chunks:
+                    def on_image_done(current: int):
+                        if progress_callback:
+                            progress_callback(done + current, total, "计算哈希值")
+                        self.check_cancelled()
+
+                    save_chunk(chunk, compute_image_hash_chunk([image_paths[idx] for idx in chunk],
+                                                               self.fast_decode, self.hash_types, self.roi,
+                                                               on_image_done))
+                    done += len(chunk)
+        finally:
+            if self.hash_cache is not None:
+                self.hash_cache.commit()
+
+        result: Dict[str, Dict] = {hash_type: {} for hash_type in self.hash_types}
+        for image_path, hash_values in zip(image_paths, hash_list):
+            if hash_values is None:
+                continue
+            for hash_type, hash_value in zip(self.hash_types, hash_values):
+                result[hash_type][image_path] = hash_value
+
+        if self.similarity_backend == SIMILARITY_BACKEND_EMBEDDING:
+            features = self.calculate_features(list(result[HASH_TYPE_PHASH].keys()), progress_callback)
+            # 只保留两种都计算成功的图片 保证各种哈希可以按同一个路径列表打包
+            for hashes in result.values():
+                for image_path in [path for path in hashes if path not in features]:
+                    del hashes[image_path]
+            result[HASH_TYPE_EMBEDDING] = features
+        return result
+
+    def get_feature_extractor(self) -> OnnxFeatureExtractor:
+        """
+        特征提取器 第一次使用时加载模型
+        """
+        if self._feature_extractor is None:
+            self._feature_extractor = OnnxFeatureExtractor(self.embedding_model_path, self.embedding_batch_size)
+        return self._feature_extractor
+
+    def calculate_features(self, image_paths: List[str], progress_callback=None) -> Dict[str, np.ndarray]:
+        """
+        提取图片的分类模型特征 开启缓存时以 float16 保存在根文件夹中
+
+        Args:
+            image_paths: 图片路径列表
+            progress_callback: 进度回调函数 (current, total, message)
+
+        Returns:
+            {图片路径: L2 归一化后的 float32 特征} 的字典 提取失败的图片不包含在内
+        """
+        extractor = self.get_feature_extractor()
+        model_key = extractor.model_key()
+        if self.roi is not None and not self.roi.is_empty():
+            model_key = f'{model_key}|roi_{self.roi.signature()}'
+        if self.feature_cache is not None and self.feature_cache.model_key != model_key:
+            self.feature_cache.close()
+            self.feature_cache = None
+        if self.feature_cache is None and self.use_hash_cache and self.root_folder is not None:
+            self.feature_cache = FeatureCache(self.root_folder, model_key)
+        feature_cache = self.feature_cache
+
+        result: Dict[str, np.ndarray] = {}
+        to_compute: List[str] = []
+        for image_path in image_paths:
+            feature = feature_cache.get(image_path) if feature_cache is not None else None
+            if feature is None:
+                to_compute.append(image_path)
+            else:
+                result[image_path] = feature
+
+        total = len(image_paths)
+        done = total - len(to_compute)
+
+        def on_progress(current: int):
+            if progress_callback:
+                progress_callback(done + current, total, "提取特征")
+            self.check_cancelled()
+
+        try:
+            on_progress(0)
+            for image_path, feature in zip(to_compute, extractor.extract(to_compute, self.roi, on_progress)):
+                if feature is None:
+                    continue
+                result[image_path] = feature
+                if feature_cache is not None:
+                    feature_cache.put(image_path, feature)
+        finally:
+            if feature_cache is not None:
+                feature_cache.close()  # 先保存一次 删除图片时继续使用 关闭哈希缓存时再保存
+        return result
+
+    def group_hashes_by_folder(self, folder_info: List[Tuple[str, str, int]],
+                               all_hashes: Dict[str, int]) -> Dict[str, Dict[str, int]]:
+        """
+        将全部图片的哈希值按所在文件夹分组
+
+        Args:
+            folder_info: 文件夹信息列表
+            all_hashes: {图片路径: 哈希值} 的字典
+
+        Returns:
+            {文件夹路径: {图片路径: 哈希值}} 的字典
+        """
+        folder_hashes: Dict[str, Dict[str, int]] = {
+            folder_path: {} for _, folder_path, _ in folder_info
+        }
+        for image_path, hash_value in all_hashes.items():
+            folder_hashes[os.path.dirname(image_path)][image_path] = hash_value
+        return folder_hashes
+
+    def build_folder_index(self, hashes: Dict) -> Tuple[List[str], HammingIndex]:
+        """
+        为一个文件夹内的图片建立汉明空间索引 使用特征时建立余弦相似度索引 两者的接口一致
+
+        Args:
+            hashes: 一个文件夹内 {图片路径: 哈希值或特征} 的字典
+
+        Returns:
+            (图片路径列表, 索引) 索引中的下标与图片路径列表一一对应 哈希以连续的 uint64 数组保存
+        """
+        image_paths = list(hashes.keys())
+        if self.index_hash_type == HASH_TYPE_EMBEDDING:
+            features = [hashes[path] for path in image_paths]
+            index = EmbeddingIndex(np.stack(features) if len(features) > 0 else np.zeros((0, 1), dtype=np.float32))
+        else:
+            index = HammingIndex(np.array([hashes[path] for path in image_paths], dtype=np.uint64))
+        return image_paths, index
+
+    def get_hash_arrays(self, image_paths: List[str], type_hashes: Dict[str, Dict[str, int]]) -> Dict[str, np.ndarray]:
+        """
+        将各种哈希按图片路径列表的顺序打包成 uint64 数组 特征打包成 (N, D) float32 矩阵
+
+        Args:
+            image_paths: 图片路径列表 通常来自 build_folder_index
+            type_hashes: {哈希种类: {图片路径: 哈希值}} 的字典
+
+        Returns:
+            {哈希种类: 数组} 的字典
+        """
+        result: Dict[str, np.ndarray] = {}
+        for hash_type, hashes in type_hashes.items():
+            if hash_type == HASH_TYPE_EMBEDDING:
+                result[hash_type] = embedding_utils.normalize_features(
+                    np.stack([hashes[path] for path in image_paths])) if len(image_paths) > 0 \
+                    else np.zeros((0, 1), dtype=np.float32)
+            else:
+                result[hash_type] = np.array([hashes[path] for path in image_paths], dtype=np.uint64)
+        return result
+
+    def get_pixel_tile(self, image_path: str) -> Optional[np.ndarray]:
+        """
+        读取像素级校验用的小图 同一次处理中每张图片只读取一次
+
+        Args:
+            image_path: 图片文件路径
+
+        Returns:
+            缩小后的灰度图 读取失败时返回 None
+        """
+        if image_path not in self._pixel_tiles:
+            try:
+                self._pixel_tiles[image_path] = image_hash_utils.load_pixel_tile(image_path, roi=self.roi)
+            except Exception as e:
+                print(f"无法处理图片 {image_path}: {str(e)}")
+                self._pixel_tiles[image_path] = None
+        return self._pixel_tiles[image_path]
+
+    def is_pixel_similar(self, image_path1: str, image_path2: str) -> bool:
+        """
+        像素级校验两张图片是否相似 读取失败时视为不相似 避免误删
+
+        Args:
+            image_path1: 第一张图片路径
+            image_path2: 第二张图片路径
+
+        Returns:
+            是否相似
+        """
+        tile1 = self.get_pixel_tile(image_path1)
+        tile2 = self.get_pixel_tile(image_path2)
+        if tile1 is None or tile2 is None:
+            return False
+        if self.pixel_check == PIXEL_CHECK_MSE:
+            return cv2_utils.calculate_mse(tile1, tile2) <= self.mse_threshold
+        return cv2_utils.calculate_ssim(tile1, tile2) >= self.ssim_threshold
+
+    def find_similar_pairs(self, query_paths: List[str], query_arrays: Dict[str, np.ndarray],
+                           target_paths: List[str], target_index, target_arrays: Dict[str, np.ndarray],
+                           query_alive: Optional[np.ndarray] = None, self_join: bool = False,
+                           stats: Optional[Dict[str, int]] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        级联筛选相似的图片对
+        1. 在目标索引中做批量查询
+           - 使用特征时 查询余弦相似度不低于 embedding_threshold 的图片
+           - 开启预筛选时 索引和半径使用预筛选哈希 否则直接使用感知哈希
+        2. 开启预筛选时 用感知哈希的距离确认候选对
+        3. 开启像素级校验时 只对剩下的图片对计算 SSIM / MSE
+
+        Args:
+            query_paths: 查询图片路径列表
+            query_arrays: 查询图片的 {哈希种类: 数组}
+            target_paths: 目标图片路径列表
+            target_index: 目标图片的索引 建立在 self.index_hash_type 上 HammingIndex 或 EmbeddingIndex
+            target_arrays: 目标图片的 {哈希种类: 数组}
+            query_alive: 查询图片中仍然有效的标记 None 表示全部有效
+            self_join: 查询和目标是同一组图片 每一对只保留一次 (查询下标 < 目标下标)
+            stats: 级联统计 各阶段排除的图片对数量会累加到这里
+
+        Returns:
+            (查询下标, 目标下标, 相似度) 相似度是感知哈希的相似度 使用特征时是余弦相似度
+        """
+        if self.similarity_backend == SIMILARITY_BACKEND_EMBEDDING:
+            first_threshold = self.embedding_threshold
+        elif self.prefilter_hash_type is None:
+            first_threshold = hamming_utils.similarity_to_max_distance(self.similarity_threshold)
+        else:
+            first_threshold = hamming_utils.similarity_to_max_distance(self.prefilter_threshold)
+        query_idx, target_idx, score = target_index.query_many(
+            query_arrays[self.index_hash_type], first_threshold, query_alive=query_alive)
+
+        target_alive_cnt = int(np.count_nonzero(target_index.alive))
+        if self_join:
+            upper = query_idx < target_idx  # 每一对只需要处理一次
+            query_idx, target_idx, score = query_idx[upper], target_idx[upper], score[upper]
+            total_pairs = target_alive_cnt * (target_alive_cnt - 1) // 2
+        else:
+            query_alive_cnt = len(query_paths) if query_alive is None else int(np.count_nonzero(query_alive))
+            total_pairs = query_alive_cnt * target_alive_cnt
+
+        if stats is None:
+            stats = new_cascade_stats()
+        stats['total_pairs'] += total_pairs
+        first_rejected = total_pairs - len(query_idx)
+
+        if self.similarity_backend == SIMILARITY_BACKEND_EMBEDDING:
+            stats['embedding_rejected'] += first_rejected
+            similarity = score.astype(np.float64)
+        elif self.prefilter_hash_type is None:
+            stats['phash_rejected'] += first_rejected
+            similarity = hamming_utils.distance_to_similarity(score.astype(np.float64))
+        else:
+            stats['prefilter_rejected'] += first_rejected
+            distance = hamming_utils.popcount64(
+                query_arrays[HASH_TYPE_PHASH][query_idx] ^ target_arrays[HASH_TYPE_PHASH][target_idx])
+            keep = distance <= hamming_utils.similarity_to_max_distance(self.similarity_threshold)
+            stats['phash_rejected'] += int(len(keep) - np.count_nonzero(keep))
+            query_idx, target_idx = query_idx[keep], target_idx[keep]
+            similarity = hamming_utils.distance_to_similarity(distance[keep].astype(np.float64))
+
+        if self.pixel_check is not None and len(query_idx) > 0:
+            keep = np.array([self.is_pixel_similar(query_paths[i], target_paths[j])
+                             for i, j in zip(query_idx.tolist(), target_idx.tolist())], dtype=bool)
+            stats['pixel_rejected'] += int(len(keep) - np.count_nonzero(keep))
+            query_idx, target_idx, similarity = query_idx[keep], target_idx[keep], similarity[keep]
+
+        stats['accepted_pairs'] += len(query_idx)
+        return query_idx, target_idx, similarity
+
+    def choose_keeper(self, image_paths: List[str]) -> str:
+        """
+        按保留策略 从一个相似分组中选出需要保留的图片
+        策略相同时依次比较文件名长度和路径 保证结果稳定
+
+        Args:
+            image_paths: 分组内的图片路径
+
+        Returns:
+            需要保留的图片路径
+        """
+        def name_key(path: str):
+            return len(os.path.basename(path)), path
+
+        if self.keep_policy == KEEP_POLICY_LARGEST_FILE:
+            return min(image_paths, key=lambda path: (-os.path.getsize(path), *name_key(path)))
+        if self.keep_policy == KEEP_POLICY_EARLIEST_MTIME:
+            return min(image_paths, key=lambda path: (os.stat(path).st_mtime_ns, *name_key(path)))
+        return min(image_paths, key=name_key)
+
+    def save_cluster_report(self, root_folder: str, result: Dict) -> str:
+        """
+        将相似分组保存成 json 报告 方便在删除前检查
+
+        Args:
+            root_folder: 根文件夹路径
+            result: 处理结果统计字典
+
+        Returns:
+            报告文件路径
+        """
+        report_path = os.path.join(root_folder, CLUSTER_REPORT_FILE_NAME)
+        report = {
+            'similarity_threshold': self.similarity_threshold,
+            'keep_policy': self.keep_policy,
+            'dry_run': self.dry_run,
+            'clusters': result['clusters'],
+        }
+        with open(report_path, 'w', encoding='utf-8') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+        return report_path
+
+    def move_to_quarantine(self, image_path: str) -> str:
+        """
+        将图片移动到根文件夹的隔离目录中 保留原来的子文件夹结构 同名文件会加上序号
+
+        Args:
+            image_path: 图片路径
+
+        Returns:
+            移动后的路径
+        """
+        root_folder = self.root_folder if self.root_folder is not None else os.path.dirname(os.path.dirname(image_path))
+        rel_dir = os.path.relpath(os.path.dirname(image_path), root_folder)
+        target_dir = os.path.join(root_folder, QUARANTINE_FOLDER_NAME, rel_dir)
+        os.makedirs(target_dir, exist_ok=True)
+
+        stem, ext = os.path.splitext(os.path.basename(image_path))
+        target_path = os.path.join(target_dir, stem + ext)
+        idx = 1
+        while os.path.exists(target_path):
+            target_path = os.path.join(target_dir, f'{stem}_{idx}{ext}')
+            idx += 1
+        shutil.move(image_path, target_path)
+        return target_path
+
+    def delete_image(self, image_path: str, similarity: float, result: Dict, log_callback=None) -> bool:
+        """
+        删除一张相似图片 并记录到处理结果中
+        dry_run 时不删除文件 只记录到处理结果中
+        quarantine 时移动到根文件夹的 .quarantine/<子文件夹> 中
+
+        Args:
+            image_path: 需要删除的图片路径
+            similarity: 与保留图片的相似度
+            result: 处理结果统计字典
+            log_callback: 日志回调函数 (message)
+
+        Returns:
+            是否删除成功
+        """
+        start_time = time.perf_counter()
+        try:
+            if not self.dry_run:
+                if self.quarantine:
+                    self.move_to_quarantine(image_path)
+                else:
+                    os.remove(image_path)
+                if self.hash_cache is not None:
+                    self.hash_cache.remove(image_path)
+                if self.feature_cache is not None:
+                    self.feature_cache.remove(image_path)
+            result['deleted_files'] += 1
+            result['deleted_file_paths'].append(image_path)
+
+            if self.dry_run:
+                action = '预计删除'
+            elif self.quarantine:
+                action = '隔离'
+            else:
+                action = '删除'
+            if log_callback:
+                log_callback(
+                    f"{action}相似图片: {os.path.basename(image_path)} "
+                    f"(相似度: {similarity:.3f})"
+                )
+            return True
+        except Exception as e:
+            if log_callback:
+                log_callback(f"删除文件失败 {image_path}: {str(e)}")
+            return False
+        finally:
+            result['timings']['delete'] += time.perf_counter() - start_time
+
+    @staticmethod
+    def finish_timings(result: Dict, compare_start_time: float) -> None:
+        """
+        计算完哈希后的耗时 扣除删除文件的部分 记为比较的耗时
+
+        Args:
+            result: 处理结果统计字典
+            compare_start_time: 哈希计算完成的时间 time.perf_counter()
+        """
+        timings = result['timings']
+        timings['compare'] = max(0.0, time.perf_counter() - compare_start_time - timings['delete'])
+
+    def delete_clusters(self, folder_name: str, image_paths: List[str], hash_arrays: Dict[str, np.ndarray], index,
+                        pair_i: np.ndarray, pair_j: np.ndarray, result: Dict, log_callback=None) -> None:
+        """
+        将相似的图片对合并成分组 每个分组按保留策略只保留一张 其余删除
+        相似关系可以传递 分组记录到 result['clusters'] 中
+
+        Args:
+            folder_name: 文件夹名 用于分组报告
+            image_paths: 图片路径列表
+            hash_arrays: 与图片路径列表对应的 {哈希种类: 数组} 用于计算与保留图片的相似度
+            index: 图片的索引 删除的图片会从索引中移除
+            pair_i: 相似对的第一个下标
+            pair_j: 相似对的第二个下标
+            result: 处理结果统计字典
+            log_callback: 日志回调函数 (message)
+        """
+        for cluster in hamming_utils.cluster_pairs(len(image_paths), pair_i, pair_j):
+            self.check_cancelled()
+            cluster_paths = [image_paths[idx] for idx in cluster]
+            keeper = self.choose_keeper(cluster_paths)
+            keeper_idx = cluster[cluster_paths.index(keeper)]
+            to_delete = [(idx, path) for idx, path in zip(cluster, cluster_paths) if path != keeper]
+            delete_idx = [idx for idx, _ in to_delete]
+            if self.similarity_backend == SIMILARITY_BACKEND_EMBEDDING:
+                features = hash_arrays[HASH_TYPE_EMBEDDING]
+                similarity_list = (features[delete_idx] @ features[keeper_idx]).tolist()
+            else:
+                phash_arr = hash_arrays[HASH_TYPE_PHASH]
+                similarity_list = hamming_utils.distance_to_similarity(
+                    hamming_utils.popcount64(phash_arr[delete_idx] ^ phash_arr[keeper_idx])
+                ).tolist()
+
+            result['clusters'].append({
+                'folder': folder_name,
+                'keep': keeper,
+                'delete': [
+                    {'path': path, 'similarity': round(similarity, 4)}
+                    for (_, path), similarity in zip(to_delete, similarity_list)
+                ],
+            })
+            for (idx, path), similarity in zip(to_delete, similarity_list):
+                if self.delete_image(path, similarity, result, log_callback):
+                    index.remove(idx)
+
     def process_cross_folder_similarity(self, root_folder: str, 
                                       progress_callback=None, 
                                       log_callback=None) -> Dict:
@@ -152,16 +1068,32 @@ class ImageSimilarityProcessor:
             'deleted_files': 0,
             'processed_folders': 0,
             'total_comparisons': 0,
-            'deleted_file_paths': []
+            'deleted_file_paths': [],
+            'cancelled': False,  # 是否被取消 取消时只包含已完成的部分
+            'cascade': new_cascade_stats(),
+            'timings': new_timings(),
         }
-        
+        self.open_hash_cache(root_folder)
+        try:
+            self._process_cross_folder_similarity(root_folder, result, progress_callback, log_callback)
+        except ProcessCancelled:
+            result['cancelled'] = True
+            if log_callback:
+                log_callback("处理已取消")
+        finally:
+            self.close_hash_cache()
+            self._pixel_tiles.clear()
+        return result
+
+    def _process_cross_folder_similarity(self, root_folder: str, result: Dict,
+                                         progress_callback=None, log_callback=None) -> None:
         # 获取文件夹信息
         folder_info = self.get_folder_info(root_folder)
         
         if len(folder_info) < 2:
             if log_callback:
                 log_callback("需要至少2个子文件夹才能进行跨文件夹比较")
-            return result
+            return
             
         if log_callback:
             log_callback(f"找到 {len(folder_info)} 个子文件夹")
@@ -169,60 +1101,58 @@ class ImageSimilarityProcessor:
                 log_callback(f"  {folder}: {count} 张图片")
                 
         # 计算所有图片的哈希值
-        all_hashes = self.calculate_all_hashes(folder_info)
-        total_images = len(all_hashes)
+        start_time = time.perf_counter()
+        type_hashes = self.calculate_all_hash_types(folder_info, progress_callback)
+        compare_start_time = time.perf_counter()
+        result['timings']['hash'] = compare_start_time - start_time
+        total_images = len(type_hashes[HASH_TYPE_PHASH])
         
         if progress_callback:
             progress_callback(total_images, total_images, "哈希值计算完成")
             
+        # 按文件夹建立汉明空间索引 避免用路径前缀反复筛选
+        folder_hashes = self.group_hashes_by_folder(folder_info, type_hashes[self.index_hash_type])
+        folder_paths: Dict[str, List[str]] = {}
+        folder_indexes: Dict[str, HammingIndex] = {}
+        folder_arrays: Dict[str, Dict[str, np.ndarray]] = {}
+        for folder_path, hashes in folder_hashes.items():
+            folder_paths[folder_path], folder_indexes[folder_path] = self.build_folder_index(hashes)
+            folder_arrays[folder_path] = self.get_hash_arrays(folder_paths[folder_path], type_hashes)
+
         # 跨文件夹相似度比较
         if log_callback:
             log_callback("开始跨文件夹相似度比较...")
-            
+
         for i, (source_folder, source_path, _) in enumerate(folder_info[:-1]):
-            source_images = [path for path in all_hashes.keys() 
-                           if path.startswith(source_path)]
-            
+            source_index = folder_indexes[source_path]
+
             for j in range(i + 1, len(folder_info)):
+                self.check_cancelled()
                 target_folder, target_path, _ = folder_info[j]
-                target_images = [path for path in all_hashes.keys() 
-                               if path.startswith(target_path)]
-                
-                # 比较源文件夹和目标文件夹的图片
-                for source_img in source_images:
-                    if source_img not in all_hashes:
-                        continue
-                        
-                    source_hash = all_hashes[source_img]
-                    
-                    for target_img in target_images[:]:  # 使用切片复制
-                        if target_img not in all_hashes:
-                            continue
-                            
-                        target_hash = all_hashes[target_img]
-                        similarity = self.calculate_similarity(source_hash, target_hash)
-                        result['total_comparisons'] += 1
-                        
-                        if similarity >= self.similarity_threshold:
-                            # 删除目标文件夹中的相似图片
-                            try:
-                                os.remove(target_img)
-                                del all_hashes[target_img]
-                                target_images.remove(target_img)
-                                result['deleted_files'] += 1
-                                result['deleted_file_paths'].append(target_img)
-                                
-                                if log_callback:
-                                    log_callback(
-                                        f"删除相似图片: {os.path.basename(target_img)} "
-                                        f"(相似度: {similarity:.3f})"
-                                    )
-                            except Exception as e:
-                                if log_callback:
-                                    log_callback(f"删除文件失败 {target_img}: {str(e)}")
-                                    
+                target_images = folder_paths[target_path]
+                target_index = folder_indexes[target_path]
+
+                # 用源文件夹剩余的全部图片 在目标文件夹的索引中做批量查询和级联筛选
+                _, target_idx, similarity = self.find_similar_pairs(
+                    folder_paths[source_path], folder_arrays[source_path],
+                    target_images, target_index, folder_arrays[target_path],
+                    query_alive=source_index.alive, stats=result['cascade'])
+                if len(target_idx) == 0:
+                    continue
+
+                # 每张目标图片只删除一次 日志中使用与源文件夹最高的相似度
+                order = np.lexsort((-similarity, target_idx))
+                to_delete_idx, first = np.unique(target_idx[order], return_index=True)
+                max_similarity = similarity[order][first]
+
+                # 删除目标文件夹中的相似图片
+                for idx, image_similarity in zip(to_delete_idx.tolist(), max_similarity.tolist()):
+                    if self.delete_image(target_images[idx], image_similarity, result, log_callback):
+                        target_index.remove(idx)
+
+        result['total_comparisons'] = sum(index.comparison_cnt for index in folder_indexes.values())
         result['processed_folders'] = len(folder_info)
-        return result
+        self.finish_timings(result, compare_start_time)
         
     def process_within_folder_similarity(self, root_folder: str, 
                                        progress_callback=None, 
@@ -231,6 +1161,7 @@ class ImageSimilarityProcessor:
         文件夹内相似度处理
         
         在每个子文件夹内部查找并删除相似的图片。
+        相似的图片对用并查集合并成分组，每个分组按保留策略只保留一张。
         
         Args:
             root_folder: 根文件夹路径
@@ -244,73 +1175,443 @@ class ImageSimilarityProcessor:
             'deleted_files': 0,
             'processed_folders': 0,
             'total_comparisons': 0,
-            'deleted_file_paths': []
+            'deleted_file_paths': [],
+            'cancelled': False,  # 是否被取消 取消时只包含已完成的部分
+            'clusters': [],  # 每个相似分组保留和删除的图片
+            'cascade': new_cascade_stats(),
+            'timings': new_timings(),
         }
-        
+        self.open_hash_cache(root_folder)
+        try:
+            self._process_within_folder_similarity(root_folder, result, progress_callback, log_callback)
+        except ProcessCancelled:
+            result['cancelled'] = True
+            if log_callback:
+                log_callback("处理已取消")
+        finally:
+            self.close_hash_cache()
+            self._pixel_tiles.clear()
+        return result
+
+    def _process_within_folder_similarity(self, root_folder: str, result: Dict,
+                                          progress_callback=None, log_callback=None) -> None:
         # 获取所有子文件夹
+        folder_info = [info for info in self.get_folder_info(root_folder) if info[2] >= 2]
+
+        # 一次计算所有图片的哈希值 再按文件夹分组
+        start_time = time.perf_counter()
+        type_hashes = self.calculate_all_hash_types(folder_info, progress_callback)
+        compare_start_time = time.perf_counter()
+        result['timings']['hash'] = compare_start_time - start_time
+        folder_hashes = self.group_hashes_by_folder(folder_info, type_hashes[self.index_hash_type])
+
+        for folder_name, folder_path, image_count in folder_info:
+            self.check_cancelled()
+            if log_callback:
+                log_callback(f"处理文件夹: {folder_name} ({image_count} 张图片)")
+
+            hashes = folder_hashes[folder_path]
+
+            # 在文件夹内进行相似度比较 通过索引只比较候选图片
+            image_paths, index = self.build_folder_index(hashes)
+            hash_arrays = self.get_hash_arrays(image_paths, type_hashes)
+            query_idx, item_idx, _ = self.find_similar_pairs(
+                image_paths, hash_arrays, image_paths, index, hash_arrays,
+                self_join=True, stats=result['cascade'])
+
+            self.delete_clusters(folder_name, image_paths, hash_arrays, index,
+                                 query_idx, item_idx, result, log_callback)
+
+            result['total_comparisons'] += index.comparison_cnt
+            result['processed_folders'] += 1
+        self.finish_timings(result, compare_start_time)
+
+        if self.dry_run and len(result['clusters']) > 0:
+            report_path = self.save_cluster_report(root_folder, result)
+            if log_callback:
+                log_callback(f"相似分组报告已保存: {report_path}")
+
+
+    def process_incremental_similarity(self, root_folder: str,
+                                       progress_callback=None,
+                                       log_callback=None) -> Dict:
+        """
+        增量去重
+
+        根文件夹的缓存中记录了已经去重过的图片。每个子文件夹中新增的图片
+        先与已去重的图片比较，再在新增图片之间比较 (与文件夹内比较模式相同的分组和保留策略)，
+        相似的新图片被删除或隔离，剩下的新图片记录为已去重。
+        只需要计算新增图片的哈希 比较次数也只与新增图片的数量有关。
+        第一次运行时所有图片都是新增的 相当于一次文件夹内比较。
+
+        Args:
+            root_folder: 根文件夹路径
+            progress_callback: 进度回调函数 (current, total, message)
+            log_callback: 日志回调函数 (message)
+
+        Returns:
+            处理结果统计字典
+        """
+        result = {
+            'deleted_files': 0,
+            'processed_folders': 0,
+            'total_comparisons': 0,
+            'deleted_file_paths': [],
+            'cancelled': False,  # 是否被取消 取消时只包含已完成的部分
+            'clusters': [],
+            'cascade': new_cascade_stats(),
+            'timings': new_timings(),
+            'new_images': 0,  # 本次新增的图片数量
+            'accepted_images': 0,  # 本次记录为已去重的图片数量
+        }
+        self.open_hash_cache(root_folder)
+        if self.hash_cache is None:  # 已去重的记录保存在缓存文件中 增量模式总是需要打开
+            self.hash_cache = ImageHashCache(root_folder)
+        try:
+            self._process_incremental_similarity(root_folder, result, progress_callback, log_callback)
+        except ProcessCancelled:
+            result['cancelled'] = True
+            if log_callback:
+                log_callback("处理已取消")
+        finally:
+            self.close_hash_cache()
+            self._pixel_tiles.clear()
+        return result
+
+    def _process_incremental_similarity(self, root_folder: str, result: Dict,
+                                        progress_callback=None, log_callback=None) -> None:
         folder_info = self.get_folder_info(root_folder)
-        
+        accepted_rel_paths = self.hash_cache.get_accepted()
+
+        # 按文件夹区分已去重的图片和新增的图片
+        folder_images: Dict[str, Tuple[List[str], List[str]]] = {}
+        existing_rel_paths = set()
+        new_paths: List[str] = []
+        for folder_name, folder_path, _ in folder_info:
+            accepted_paths, folder_new_paths = [], []
+            for image_path in self.get_image_files(folder_path):
+                rel_path = self.hash_cache.to_rel_path(image_path)
+                existing_rel_paths.add(rel_path)
+                if rel_path in accepted_rel_paths:
+                    accepted_paths.append(image_path)
+                else:
+                    folder_new_paths.append(image_path)
+            folder_images[folder_path] = (accepted_paths, folder_new_paths)
+            new_paths.extend(folder_new_paths)
+
+        # 已经不存在的图片 (例如被手动删除) 不再作为比较对象
+        self.hash_cache.remove_accepted(sorted(accepted_rel_paths - existing_rel_paths))
+        result['new_images'] = len(new_paths)
+        if log_callback:
+            log_callback(f"已去重图片 {len(existing_rel_paths) - len(new_paths)} 张 新增图片 {len(new_paths)} 张")
+        if len(new_paths) == 0:
+            self.hash_cache.commit()
+            return
+
+        # 已去重图片的哈希通常都在缓存中 只有新增图片需要计算
+        all_paths = [path for accepted_paths, folder_new_paths in folder_images.values()
+                     for path in accepted_paths + folder_new_paths
+                     if len(folder_new_paths) > 0]
+        start_time = time.perf_counter()
+        type_hashes = self.calculate_hash_types(all_paths, progress_callback)
+        compare_start_time = time.perf_counter()
+        result['timings']['hash'] = compare_start_time - start_time
+        index_hashes = type_hashes[self.index_hash_type]
+
+        for folder_name, folder_path, _ in folder_info:
+            accepted_paths, folder_new_paths = folder_images[folder_path]
+            accepted_paths = [path for path in accepted_paths if path in index_hashes]
+            folder_new_paths = [path for path in folder_new_paths if path in index_hashes]
+            if len(folder_new_paths) == 0:
+                continue
+            self.check_cancelled()
+            if log_callback:
+                log_callback(f"处理文件夹: {folder_name} (新增 {len(folder_new_paths)} 张图片)")
+
+            new_hashes = {path: index_hashes[path] for path in folder_new_paths}
+            new_paths_list, new_index = self.build_folder_index(new_hashes)
+            new_arrays = self.get_hash_arrays(new_paths_list, type_hashes)
+
+            # 1. 与已去重的图片比较 相似的新图片直接删除
+            if len(accepted_paths) > 0:
+                accepted_hashes = {path: index_hashes[path] for path in accepted_paths}
+                accepted_list, accepted_index = self.build_folder_index(accepted_hashes)
+                accepted_arrays = self.get_hash_arrays(accepted_list, type_hashes)
+                new_idx, _, similarity = self.find_similar_pairs(
+                    new_paths_list, new_arrays, accepted_list, accepted_index, accepted_arrays,
+                    stats=result['cascade'])
+                if len(new_idx) > 0:
+                    order = np.lexsort((-similarity, new_idx))
+                    to_delete_idx, first = np.unique(new_idx[order], return_index=True)
+                    max_similarity = similarity[order][first]
+                    for idx, image_similarity in zip(to_delete_idx.tolist(), max_similarity.tolist()):
+                        if self.delete_image(new_paths_list[idx], image_similarity, result, log_callback):
+                            new_index.remove(idx)
+                result['total_comparisons'] += accepted_index.comparison_cnt
+
+            # 2. 剩下的新图片之间比较 每个分组只保留一张
+            alive = new_index.alive.copy()
+            query_idx, item_idx, _ = self.find_similar_pairs(
+                new_paths_list, new_arrays, new_paths_list, new_index, new_arrays,
+                query_alive=alive, self_join=True, stats=result['cascade'])
+            self.delete_clusters(folder_name, new_paths_list, new_arrays, new_index,
+                                 query_idx, item_idx, result, log_callback)
+            result['total_comparisons'] += new_index.comparison_cnt
+
+            # 3. 留下的新图片记录为已去重 预览时不记录
+            if not self.dry_run:
+                kept_paths = [new_paths_list[idx] for idx in np.flatnonzero(new_index.alive).tolist()]
+                self.hash_cache.add_accepted(kept_paths)
+                result['accepted_images'] += len(kept_paths)
+            result['processed_folders'] += 1
+
+        self.hash_cache.commit()
+        self.finish_timings(result, compare_start_time)
+
+    def process_subsample(self, root_folder: str,
+                          progress_callback=None,
+                          log_callback=None) -> Dict:
+        """
+        按类别下采样
+
+        图片数量超过 subsample_cnt 的子文件夹，在汉明空间中做最远点采样，
+        保留彼此差异最大的 subsample_cnt 张图片，删除其余的图片。
+        相似的图片会最后才被选中，因此会优先删除重复的图片，保留的图片尽量多样。
+        适合在 classify_dataset_utils.split_dataset 之前缩小数量过多的类别。
+
+        Args:
+            root_folder: 根文件夹路径
+            progress_callback: 进度回调函数 (current, total, message)
+            log_callback: 日志回调函数 (message)
+
+        Returns:
+            处理结果统计字典
+        """
+        result = {
+            'deleted_files': 0,
+            'processed_folders': 0,
+            'total_comparisons': 0,
+            'deleted_file_paths': [],
+            'cancelled': False,  # 是否被取消 取消时只包含已完成的部分
+            'subsampled_folders': [],  # 每个下采样的文件夹 处理前后的图片数量
+            'timings': new_timings(),
+        }
+        self.open_hash_cache(root_folder)
+        try:
+            self._process_subsample(root_folder, result, progress_callback, log_callback)
+        except ProcessCancelled:
+            result['cancelled'] = True
+            if log_callback:
+                log_callback("处理已取消")
+        finally:
+            self.close_hash_cache()
+        return result
+
+    def _process_subsample(self, root_folder: str, result: Dict,
+                           progress_callback=None, log_callback=None) -> None:
+        if self.subsample_cnt <= 0:
+            if log_callback:
+                log_callback("每个类别保留的数量需要大于0")
+            return
+
+        folder_info = [info for info in self.get_folder_info(root_folder) if info[2] > self.subsample_cnt]
+        if log_callback:
+            log_callback(f"需要下采样到 {self.subsample_cnt} 张的文件夹: {len(folder_info)} 个")
+
+        start_time = time.perf_counter()
+        all_hashes = self.calculate_all_hashes(folder_info, progress_callback)
+        compare_start_time = time.perf_counter()
+        result['timings']['hash'] = compare_start_time - start_time
+        folder_hashes = self.group_hashes_by_folder(folder_info, all_hashes)
+
         for folder_name, folder_path, image_count in folder_info:
-            if image_count < 2:
+            hashes = folder_hashes[folder_path]
+            if len(hashes) <= self.subsample_cnt:
                 continue
-                
+            self.check_cancelled()
+            image_paths = sorted(hashes.keys())  # 排序后结果是确定的
+            hash_arr = np.array([hashes[path] for path in image_paths], dtype=np.uint64)
+
+            # 从最接近各位多数值 (汉明空间的中心) 的图片开始采样 避免第一张就选到离群的图片
+            bits = np.unpackbits(hash_arr.astype('>u8').view(np.uint8).reshape(-1, 8), axis=1)
+            center = np.packbits(bits.mean(axis=0) > 0.5).view('>u8').astype(np.uint64)[0]
+            start_idx = int(np.argmin(hamming_utils.popcount64(hash_arr ^ center)))
+
+            selected, min_distance = hamming_utils.farthest_point_sample(hash_arr, self.subsample_cnt, start_idx)
+            result['total_comparisons'] += len(hash_arr) * len(selected)
             if log_callback:
-                log_callback(f"处理文件夹: {folder_name} ({image_count} 张图片)")
-                
-            image_files = self.get_image_files(folder_path)
-            
-            # 计算所有图片的哈希值
-            hashes = {}
-            for image_path in image_files:
-                hash_value = self.calculate_image_hash(image_path)
-                if hash_value is not None:
-                    hashes[image_path] = hash_value
-                    
-            # 在文件夹内进行相似度比较
-            image_paths = list(hashes.keys())
-            i = 0
-            while i < len(image_paths):
-                j = i + 1
-                while j < len(image_paths):
-                    img1, img2 = image_paths[i], image_paths[j]
-
-                    if img1 not in hashes or img2 not in hashes:
-                        j += 1
-                        continue
-
-                    similarity = self.calculate_similarity(hashes[img1], hashes[img2])
-                    result['total_comparisons'] += 1
-
-                    if similarity >= self.similarity_threshold:
-                        # 删除文件名较长的图片（通常是重复的）
-                        to_delete = img2 if len(os.path.basename(img2)) > len(os.path.basename(img1)) else img1
-
-                        try:
-                            os.remove(to_delete)
-                            del hashes[to_delete]
-                            image_paths.remove(to_delete)
-                            result['deleted_files'] += 1
-                            result['deleted_file_paths'].append(to_delete)
-
-                            if log_callback:
-                                log_callback(
-                                    f"删除相似图片: {os.path.basename(to_delete)} "
-                                    f"(相似度: {similarity:.3f})"
-                                )
-
-                            # 如果删除的是img2，不需要增加j，因为列表已经缩短
-                            # 如果删除的是img1，需要重新开始这一轮比较
-                            if to_delete == img1:
-                                break  # 跳出内层循环，重新开始外层循环
-                        except Exception as e:
-                            if log_callback:
-                                log_callback(f"删除文件失败 {to_delete}: {str(e)}")
-                            j += 1
-                    else:
-                        j += 1
-
-                i += 1
-                                
+                log_callback(f"处理文件夹: {folder_name} ({len(image_paths)} -> {len(selected)} 张图片)")
+
+            keep = np.zeros(len(image_paths), dtype=bool)
+            keep[selected] = True
+            # 按与保留图片的距离从小到大删除 最相似的先删
+            to_delete = np.flatnonzero(~keep)
+            to_delete = to_delete[np.argsort(min_distance[to_delete], kind='stable')]
+            for idx, similarity in zip(to_delete.tolist(),
+                                       hamming_utils.distance_to_similarity(min_distance[to_delete]).tolist()):
+                self.delete_image(image_paths[idx], similarity, result, log_callback)
+
+            result['subsampled_folders'].append({
+                'folder': folder_name,
+                'before': len(image_paths),
+                'after': len(selected),
+            })
             result['processed_folders'] += 1
-            
+
+        self.finish_timings(result, compare_start_time)
+
+    def build_plan(self, root_folder: str, mode: str, max_distance: int = PLAN_MAX_DISTANCE,
+                   progress_callback=None, log_callback=None) -> Optional[SimilarityPlan]:
+        """
+        预览 计算汉明距离不超过 max_distance 的全部相似对 不修改任何图片
+        只使用感知哈希 不使用预筛选和像素校验
+
+        Args:
+            root_folder: 根文件夹路径
+            mode: 处理模式 见 PLAN_MODES
+            max_distance: 保存的相似对的最大汉明距离 决定之后能选择的最低相似度阈值
+            progress_callback: 进度回调函数 (current, total, message)
+            log_callback: 日志回调函数 (message)
+
+        Returns:
+            预览结果 取消时返回 None
+        """
+        if mode not in PLAN_MODES:
+            raise ValueError(f'不支持预览的处理模式: {mode}')
+        if self.similarity_backend == SIMILARITY_BACKEND_EMBEDDING:
+            raise ValueError('预览只支持感知哈希')
+        if log_callback and (self.prefilter_hash_type is not None or self.pixel_check is not None):
+            log_callback("预览只使用感知哈希 忽略预筛选和像素校验")
+
+        self.open_hash_cache(root_folder)
+        try:
+            return self._build_plan(root_folder, mode, max_distance, progress_callback, log_callback)
+        except ProcessCancelled:
+            if log_callback:
+                log_callback("预览已取消")
+            return None
+        finally:
+            self.close_hash_cache()
+
+    def _build_plan(self, root_folder: str, mode: str, max_distance: int,
+                    progress_callback=None, log_callback=None) -> SimilarityPlan:
+        folder_info = self.get_folder_info(root_folder)
+        image_paths: List[str] = []
+        for _, folder_path, _ in folder_info:
+            image_paths.extend(self.get_image_files(folder_path))
+        phashes = self.calculate_hash_types(image_paths, progress_callback)[HASH_TYPE_PHASH]
+
+        # 按文件夹连续排列 计算失败的图片不参与
+        folder_hashes = self.group_hashes_by_folder(folder_info, phashes)
+        plan_paths: List[str] = []
+        folder_start = [0]
+        folder_indexes: List[HammingIndex] = []
+        for _, folder_path, _ in folder_info:
+            hashes = folder_hashes[folder_path]
+            plan_paths.extend(hashes.keys())
+            folder_start.append(len(plan_paths))
+            folder_indexes.append(HammingIndex(np.array(list(hashes.values()), dtype=np.uint64)))
+        folder_start = np.array(folder_start, dtype=np.int64)
+        hash_arr = np.array([phashes[path] for path in plan_paths], dtype=np.uint64)
+
+        pair_i: List[np.ndarray] = []
+        pair_j: List[np.ndarray] = []
+        distance: List[np.ndarray] = []
+        for folder_idx, index in enumerate(folder_indexes):
+            self.check_cancelled()
+            start = folder_start[folder_idx]
+            query_hashes = hash_arr[start:folder_start[folder_idx + 1]]
+            if mode == MODE_WITHIN_FOLDER:
+                query_idx, item_idx, pair_distance = index.query_many(query_hashes, max_distance)
+                upper = query_idx < item_idx
+                pair_i.append(query_idx[upper] + start)
+                pair_j.append(item_idx[upper] + start)
+                distance.append(pair_distance[upper])
+            else:
+                # 跨文件夹只需要图片少的文件夹查询后面的文件夹
+                for target_idx in range(folder_idx + 1, len(folder_indexes)):
+                    query_idx, item_idx, pair_distance = folder_indexes[target_idx].query_many(
+                        query_hashes, max_distance)
+                    pair_i.append(query_idx + start)
+                    pair_j.append(item_idx + folder_start[target_idx])
+                    distance.append(pair_distance)
+
+        plan = SimilarityPlan(
+            root_folder, mode, folder_info, plan_paths, folder_start, hash_arr,
+            np.concatenate(pair_i).astype(np.int32) if len(pair_i) > 0 else np.zeros(0, dtype=np.int32),
+            np.concatenate(pair_j).astype(np.int32) if len(pair_j) > 0 else np.zeros(0, dtype=np.int32),
+            np.concatenate(distance).astype(np.uint8) if len(distance) > 0 else np.zeros(0, dtype=np.uint8),
+            max_distance, sum(index.comparison_cnt for index in folder_indexes),
+        )
+        if log_callback:
+            log_callback(f"预览完成: {len(plan_paths)} 张图片 汉明距离不超过 {max_distance} 的相似对 {len(plan.distance)} 个")
+        return plan
+
+    def commit_plan(self, plan: SimilarityPlan, progress_callback=None, log_callback=None) -> Dict:
+        """
+        按预览的相似对和当前的相似度阈值删除图片 不重新计算哈希
+        结果与直接运行对应的处理模式一致 (不使用预筛选和像素校验时)
+
+        Args:
+            plan: build_plan 的结果 预览之后图片不应有变化
+            progress_callback: 进度回调函数 (current, total, message)
+            log_callback: 日志回调函数 (message)
+
+        Returns:
+            处理结果统计字典
+        """
+        if self.similarity_backend == SIMILARITY_BACKEND_EMBEDDING:
+            raise ValueError('预览只支持感知哈希')
+        max_distance = plan.threshold_to_distance(self.similarity_threshold)
+        result = {
+            'deleted_files': 0,
+            'processed_folders': 0,
+            'total_comparisons': 0,
+            'deleted_file_paths': [],
+            'cancelled': False,
+            'timings': new_timings(),
+        }
+        if plan.mode == MODE_WITHIN_FOLDER:
+            result['clusters'] = []
+
+        self.open_hash_cache(plan.root_folder)
+        try:
+            self._commit_plan(plan, max_distance, result, progress_callback, log_callback)
+        except ProcessCancelled:
+            result['cancelled'] = True
+            if log_callback:
+                log_callback("处理已取消")
+        finally:
+            self.close_hash_cache()
         return result
+
+    def _commit_plan(self, plan: SimilarityPlan, max_distance: int, result: Dict,
+                     progress_callback=None, log_callback=None) -> None:
+        compare_start_time = time.perf_counter()
+        if plan.mode == MODE_CROSS_FOLDER:
+            deleted_idx, deleted_distance = plan.cross_folder_deletions(max_distance)
+            similarity_list = hamming_utils.distance_to_similarity(deleted_distance.astype(np.float64)).tolist()
+            for i, (idx, similarity) in enumerate(zip(deleted_idx.tolist(), similarity_list)):
+                if i % HASH_CHUNK_SIZE == 0:
+                    self.check_cancelled()
+                    if progress_callback:
+                        progress_callback(i, len(deleted_idx), "删除相似图片")
+                self.delete_image(plan.image_paths[idx], similarity, result, log_callback)
+            result['processed_folders'] = len(plan.folder_info)
+        else:
+            mask = plan.distance <= max_distance
+            pair_i, pair_j = plan.pair_i[mask], plan.pair_j[mask]
+            pair_folder = plan.image_folder[pair_i]
+            for folder_idx, (folder_name, _, _) in enumerate(plan.folder_info):
+                self.check_cancelled()
+                if progress_callback:
+                    progress_callback(folder_idx, len(plan.folder_info), "删除相似图片")
+                start, end = plan.folder_start[folder_idx], plan.folder_start[folder_idx + 1]
+                folder_pairs = pair_folder == folder_idx
+                hash_arrays = {HASH_TYPE_PHASH: plan.hashes[start:end]}
+                self.delete_clusters(folder_name, plan.image_paths[start:end], hash_arrays,
+                                     HammingIndex(hash_arrays[HASH_TYPE_PHASH]),
+                                     pair_i[folder_pairs] - start, pair_j[folder_pairs] - start,
+                                     result, log_callback)
+                result['processed_folders'] += 1
+        self.finish_timings(result, compare_start_time)
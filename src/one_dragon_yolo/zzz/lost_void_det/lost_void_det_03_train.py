@@ -4,6 +4,7 @@ from ultralytics import YOLO
 
 from one_dragon_yolo.devtools import ultralytics_utils
 from one_dragon_yolo.devtools import yolo_dataset_utils
+from one_dragon_yolo.devtools.virtual_mosaic_utils import VirtualMosaicTrainer, init_virtual_dataset
 from one_dragon_yolo.zzz.lost_void_det import lost_void_det_env
 
 # 训练
@@ -21,6 +22,9 @@ if __name__ == "__main__":
     export_img_size = (export_height, export_width)  # 由于训练时候没有开启缩放，使用训练的尺寸效果会更好
 
     train_dataset_name = f'zzz_lost_void_det_{dataset_img_size}'
+    use_virtual_mosaic = False  # 训练时在内存中拼接图片 不需要生成数据集图片 每个epoch都是新的配对
+    if use_virtual_mosaic:
+        train_dataset_name = f'{train_dataset_name}_virtual'
 
     # pretrained_model_name = 'yolo11n'
     pretrained_model_name = 'yolov8n'
@@ -28,18 +32,28 @@ if __name__ == "__main__":
 
     print(train_dataset_name, train_name, export_img_size)
 
-    yolo_dataset_utils.init_dataset(
-        project_dir=lost_void_det_env.get_dataset_project_dir(),
-        dataset_name=train_dataset_name,
-        labels=lost_void_det_env.get_labels_with_name(),
-        target_img_size=dataset_img_size,
-        split_weights=(0.9, 0.1, 0),
-    )
+    if use_virtual_mosaic:
+        init_virtual_dataset(
+            project_dir=lost_void_det_env.get_dataset_project_dir(),
+            dataset_name=train_dataset_name,
+            labels=lost_void_det_env.get_labels_with_name(),
+            mosaic_size=dataset_img_size,
+            split_weights=(0.9, 0.1, 0),
+        )
+    else:
+        yolo_dataset_utils.init_dataset(
+            project_dir=lost_void_det_env.get_dataset_project_dir(),
+            dataset_name=train_dataset_name,
+            labels=lost_void_det_env.get_labels_with_name(),
+            target_img_size=dataset_img_size,
+            split_weights=(0.9, 0.1, 0),
+        )
 
     model = YOLO(ultralytics_utils.get_base_model_path(f'{pretrained_model_name}.pt'))
 
     model.train(
         data=ultralytics_utils.get_dataset_yaml_path(train_dataset_name),  # 数据集配置文件的位置
+        trainer=VirtualMosaicTrainer if use_virtual_mosaic else None,
         project=ultralytics_utils.get_dataset_model_dir(train_dataset_name),  # 训练模型的数据（包括模型文件）的自动保存位置
         name=train_name,
         imgsz=train_img_size,
@@ -0,0 +1,189 @@
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+from one_dragon_yolo.devtools import dataset_build_utils, mosaic_utils
+from one_dragon_yolo.devtools.dataset_build_utils import BuildManifest
+
+FRAME_WIDTH = 64
+FRAME_HEIGHT = 36
+MOSAIC_SIZE = 96
+
+
+def test_split_is_stable_and_follows_weights():
+    names = [f'{i:05d}-{i * 7 % 1000:05d}' for i in range(2000)]
+    split_idx = [dataset_build_utils.get_split_idx(name, (0.8, 0.2, 0)) for name in names]
+    assert split_idx == [dataset_build_utils.get_split_idx(name, (0.8, 0.2, 0)) for name in names]
+    assert 2 not in split_idx
+    assert 0.75 < split_idx.count(0) / len(names) < 0.85
+
+
+def test_write_split_lists_uses_train_as_val_without_val_weight(tmp_path):
+    dataset_build_utils.write_split_lists(str(tmp_path), ['b.png', 'a.png'], weights=(1, 0, 0))
+    train = (tmp_path / 'autosplit_train.txt').read_text(encoding='utf-8')
+    assert train == './images/a.png\n./images/b.png\n'
+    assert (tmp_path / 'autosplit_val.txt').read_text(encoding='utf-8') == train
+    assert (tmp_path / 'autosplit_test.txt').read_text(encoding='utf-8') == ''
+
+
+def test_load_manifest_reuse_and_rebuild(tmp_path):
+    output_dir = tmp_path / 'images'
+    output_dir.mkdir()
+    (output_dir / 'old.png').write_bytes(b'old')
+    params = {'size': 1}
+
+    manifest, reusable = dataset_build_utils.load_manifest(str(tmp_path), params, output_dirs=[str(output_dir)])
+    assert not reusable
+    assert os.listdir(str(output_dir)) == []  # 没有清单时清空输出文件夹
+    manifest.outputs['a'] = {'pair': ['x', 'y'], 'inputs': []}
+    manifest.save(dataset_build_utils.get_manifest_path(str(tmp_path)))
+
+    manifest, reusable = dataset_build_utils.load_manifest(str(tmp_path), params)
+    assert reusable
+    assert manifest.get_pairs() == [('x', 'y')]
+
+    assert not dataset_build_utils.load_manifest(str(tmp_path), {'size': 2})[1]
+    assert not dataset_build_utils.load_manifest(str(tmp_path), params, force_rebuild=True)[1]
+
+
+def test_file_hash_is_reused_while_file_is_unchanged(tmp_path, monkeypatch):
+    file_path = str(tmp_path / 'a.txt')
+    with open(file_path, 'w') as file:
+        file.write('abc')
+    hashed = []
+    original = dataset_build_utils.calculate_file_hash
+    monkeypatch.setattr(dataset_build_utils, 'calculate_file_hash',
+                        lambda path: hashed.append(path) or original(path))
+
+    manifest = BuildManifest({})
+    first = manifest.get_file_hash(file_path)
+    assert manifest.get_file_hash(file_path) == first
+    assert len(hashed) == 1
+
+    with open(file_path, 'w') as file:
+        file.write('abcd')
+    assert manifest.get_file_hash(file_path) != first
+    assert len(hashed) == 2
+
+
+def test_remove_stale_outputs_keeps_hidden_files(tmp_path):
+    for name in ('a.png', 'b.png', '.hidden'):
+        (tmp_path / name).write_bytes(b'')
+    assert dataset_build_utils.remove_stale_outputs(str(tmp_path), {'a'}) == 1
+    assert sorted(os.listdir(str(tmp_path))) == ['.hidden', 'a.png']
+
+
+def test_reuse_random_pairing():
+    data_ids = ['a', 'b', 'c', 'd']
+    first = mosaic_utils.reuse_random_pairing(data_ids, [], seed=0)
+    assert [pair[0] for pair in first] == data_ids
+    assert mosaic_utils.reuse_random_pairing(data_ids, first, seed=None) == first
+
+    # 去掉 b 后 与 b 配对的样例重新抽取 其它配对不变
+    remaining = ['a', 'c', 'd', 'e']
+    second = dict(mosaic_utils.reuse_random_pairing(remaining, first, seed=None))
+    for id1, id2 in first:
+        if id1 in remaining and id2 in remaining:
+            assert second[id1] == id2
+    assert set(second.values()) <= set(remaining)
+
+
+def test_reuse_sequential_pairing_keeps_existing_pairs():
+    first = mosaic_utils.reuse_sequential_pairing(['a', 'b', 'c', 'd', 'e'], [])
+    assert first == [('a', 'b'), ('c', 'd'), ('e', 'd')]
+    # 在前面插入一张 已有的配对不会全部错开
+    second = mosaic_utils.reuse_sequential_pairing(['0', 'a', 'b', 'c', 'd', 'e'], first)
+    assert second[:2] == [('a', 'b'), ('c', 'd')]
+    assert sorted({data_id for pair in second for data_id in pair}) == ['0', 'a', 'b', 'c', 'd', 'e']
+
+
+class IncrementalProject:
+    """
+    一个很小的拼接数据集 记录每次生成了多少张图片
+    """
+
+    def __init__(self, root, monkeypatch):
+        self.raw_dir = str(root / 'raw')
+        self.dataset_dir = str(root / 'dataset')
+        self.images_dir = os.path.join(self.dataset_dir, 'images')
+        self.labels_dir = os.path.join(self.dataset_dir, 'labels')
+        for dir_path in (self.raw_dir, self.images_dir, self.labels_dir):
+            os.makedirs(dir_path)
+        self.built: list = []
+        original = mosaic_utils.run_mosaic_jobs
+
+        def run_mosaic_jobs(jobs, *args, **kwargs):
+            self.built.append(sorted(os.path.basename(job.save_image_path) for job in jobs))
+            return original(jobs, *args, **kwargs)
+
+        monkeypatch.setattr(mosaic_utils, 'run_mosaic_jobs', run_mosaic_jobs)
+
+    def add_case(self, data_id: str, cls: int) -> None:
+        img = np.full((FRAME_HEIGHT, FRAME_WIDTH, 3), cls * 20, dtype=np.uint8)
+        cv2.imwrite(os.path.join(self.raw_dir, f'{data_id}.png'), img)
+        self.write_label(data_id, cls)
+
+    def write_label(self, data_id: str, cls: int) -> None:
+        with open(os.path.join(self.raw_dir, f'{data_id}.txt'), 'w', encoding='utf-8') as file:
+            file.write(f'{cls} 0.5 0.5 0.25 0.25\n')
+
+    def build(self) -> list:
+        manifest, reusable = dataset_build_utils.load_manifest(
+            self.dataset_dir, {'size': MOSAIC_SIZE}, output_dirs=[self.images_dir, self.labels_dir])
+        data_ids = sorted(name[:-4] for name in os.listdir(self.raw_dir) if name.endswith('.txt'))
+        previous_pairs = manifest.get_pairs() if reusable else []
+        pair_jobs = []
+        for id1, id2 in mosaic_utils.reuse_sequential_pairing(data_ids, previous_pairs):
+            pair_jobs.append(((id1, id2), mosaic_utils.MosaicJob(
+                os.path.join(self.raw_dir, f'{id1}.png'), os.path.join(self.raw_dir, f'{id1}.txt'),
+                os.path.join(self.raw_dir, f'{id2}.png'), os.path.join(self.raw_dir, f'{id2}.txt'),
+                os.path.join(self.images_dir, f'{id1}-{id2}.png'),
+                os.path.join(self.labels_dir, f'{id1}-{id2}.txt'),
+                MOSAIC_SIZE,
+            )))
+        image_names = mosaic_utils.run_incremental_mosaic_jobs(manifest, pair_jobs, self.images_dir, self.labels_dir)
+        manifest.save(dataset_build_utils.get_manifest_path(self.dataset_dir))
+        return sorted(image_names)
+
+
+@pytest.fixture
+def project(tmp_path, monkeypatch) -> IncrementalProject:
+    project = IncrementalProject(tmp_path, monkeypatch)
+    for idx, data_id in enumerate(['a', 'b', 'c', 'd']):
+        project.add_case(data_id, idx)
+    return project
+
+
+def test_incremental_build_reuses_unchanged_outputs(project: IncrementalProject):
+    assert project.build() == ['a-b.png', 'c-d.png']
+    assert project.built[-1] == ['a-b.png', 'c-d.png']
+
+    # 没有变化时不生成任何图片
+    assert project.build() == ['a-b.png', 'c-d.png']
+    assert project.built[-1] == []
+
+    # 只重新生成用到变化了的标签的图片 且标签内容是新的
+    project.write_label('c', 9)
+    assert project.build() == ['a-b.png', 'c-d.png']
+    assert project.built[-1] == ['c-d.png']
+    with open(os.path.join(project.labels_dir, 'c-d.txt'), encoding='utf-8') as file:
+        assert file.readline().startswith('9 ')
+
+
+def test_incremental_build_removes_stale_outputs_and_label_cache(project: IncrementalProject):
+    project.build()
+    labels_cache = os.path.join(project.dataset_dir, 'labels.cache')
+    with open(labels_cache, 'wb') as file:
+        file.write(b'ultralytics')
+
+    # 没有变化时保留 ultralytics 的标签缓存
+    project.build()
+    assert os.path.exists(labels_cache)
+
+    os.remove(os.path.join(project.raw_dir, 'd.txt'))
+    assert project.build() == ['a-b.png', 'c-c.png']  # 只剩一张时与自己配对
+    assert not os.path.exists(os.path.join(project.images_dir, 'c-d.png'))
+    assert not os.path.exists(os.path.join(project.labels_dir, 'c-d.txt'))
+    assert not os.path.exists(labels_cache)
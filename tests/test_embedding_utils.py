@@ -0,0 +1,67 @@
+import os
+
+import numpy as np
+
+from one_dragon_yolo.devtools.embedding_utils import EmbeddingIndex, FeatureCache
+
+
+def test_embedding_index_matches_brute_force():
+    rng = np.random.default_rng(0)
+    features = rng.normal(size=(50, 16)).astype(np.float32)
+    features[10:20] = features[0] + rng.normal(scale=0.05, size=(10, 16))  # 一组相近的特征
+    index = EmbeddingIndex(features)
+    index.remove([3, 12])
+    assert len(index) == 48
+
+    normalized = features / np.linalg.norm(features, axis=1, keepdims=True)
+    similarity = normalized @ normalized.T
+    expected = [(q, i) for q in range(50) for i in range(50)
+                if index.is_alive(i) and similarity[q, i] >= 0.9]
+    query_idx, item_idx, result_similarity = index.query_many(features, 0.9, block_size=7)
+    assert list(zip(query_idx.tolist(), item_idx.tolist())) == expected
+    assert np.allclose(result_similarity, similarity[query_idx, item_idx], atol=1e-5)
+
+
+def test_feature_cache_round_trip_and_remove(tmp_path):
+    image_paths = []
+    for name in ('1.png', '2.png'):
+        path = str(tmp_path / name)
+        with open(path, 'wb') as file:
+            file.write(name.encode())
+        image_paths.append(path)
+    feature = np.arange(8, dtype=np.float32) / 8
+
+    with FeatureCache(str(tmp_path), 'model') as cache:
+        for path in image_paths:
+            cache.put(path, feature)
+    with FeatureCache(str(tmp_path), 'model') as cache:
+        assert np.allclose(cache.get(image_paths[0]), feature, atol=1e-3)
+        cache.remove(image_paths[0])
+    with FeatureCache(str(tmp_path), 'model') as cache:
+        assert cache.get(image_paths[0]) is None
+        assert cache.get(image_paths[1]) is not None
+
+    # 模型变化后缓存全部失效
+    with FeatureCache(str(tmp_path), 'another model') as cache:
+        assert cache.get(image_paths[1]) is None
+    assert os.path.exists(cache.file_path)
+
+
+def test_processor_delete_image_drops_cached_feature(tmp_path):
+    from one_dragon_yolo.gui.similarity_processor import ImageSimilarityProcessor, new_timings
+
+    image_path = str(tmp_path / '1.png')
+    with open(image_path, 'wb') as file:
+        file.write(b'image')
+    processor = ImageSimilarityProcessor()
+    processor.open_hash_cache(str(tmp_path))
+    processor.feature_cache = FeatureCache(str(tmp_path), 'model')
+    processor.feature_cache.put(image_path, np.ones(4, dtype=np.float32))
+
+    result = {'deleted_files': 0, 'deleted_file_paths': [], 'timings': new_timings()}
+    assert processor.delete_image(image_path, 1.0, result)
+    processor.close_hash_cache()
+
+    assert not os.path.exists(image_path)
+    with FeatureCache(str(tmp_path), 'model') as cache:
+        assert len(cache._entries) == 0
@@ -0,0 +1,107 @@
+from collections import Counter
+
+import cv2
+import numpy as np
+import pytest
+
+from one_dragon_yolo.devtools import mosaic_utils
+from one_dragon_yolo.devtools.frame_cache_utils import FrameCache
+
+
+def fake_jobs(pairing: list) -> list:
+    """
+    只需要原图路径 不会读取文件
+    """
+    return [mosaic_utils.MosaicJob(f'{i}.png', f'{i}.txt', f'{j}.png', f'{j}.txt', f'{k}.png', f'{k}.txt', 96)
+            for k, (i, j) in enumerate(pairing)]
+
+
+def check_trails(jobs: list, trails: list) -> None:
+    # 每个任务正好出现一次
+    assert sorted(idx for trail in trails for idx in trail) == list(range(len(jobs)))
+    # 路径上相邻的任务共用一张原图
+    for trail in trails:
+        for prev_idx, next_idx in zip(trail, trail[1:]):
+            prev_frames = {jobs[prev_idx].image1_path, jobs[prev_idx].image2_path}
+            next_frames = {jobs[next_idx].image1_path, jobs[next_idx].image2_path}
+            assert prev_frames & next_frames
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_schedule_covers_random_pairing(seed: int):
+    jobs = fake_jobs(mosaic_utils.draw_random_pairing(200, seed=seed))
+    trails = mosaic_utils.schedule_cache_local(jobs)
+    check_trails(jobs, trails)
+    # 每条路径最多用掉两张连接了奇数个任务的原图 路径数量不能少于其一半 这里要求接近这个下限
+    degree = Counter()
+    for job in jobs:
+        degree[job.image1_path] += 1
+        if job.image2_path != job.image1_path:
+            degree[job.image2_path] += 1
+    odd_cnt = sum(1 for cnt in degree.values() if cnt % 2 == 1)
+    assert odd_cnt // 2 <= len(trails) <= odd_cnt // 2 + 5
+
+
+def test_schedule_single_trail_for_chain_and_cycle():
+    chain = fake_jobs([(0, 1), (2, 3), (1, 2), (3, 4)])
+    trails = mosaic_utils.schedule_cache_local(chain)
+    check_trails(chain, trails)
+    assert len(trails) == 1
+
+    cycle = fake_jobs([(0, 1), (2, 0), (1, 2)])
+    assert len(mosaic_utils.schedule_cache_local(cycle)) == 1
+
+
+def test_split_trails_keeps_order_and_size():
+    trails = [[0, 1, 2, 3, 4], [5], [6, 7]]
+    chunks = mosaic_utils.split_trails(trails, 3)
+    assert [idx for chunk in chunks for idx in chunk] == list(range(8))
+    assert all(len(chunk) <= 3 for chunk in chunks)
+
+
+def write_frames(tmp_path, cnt: int) -> list:
+    paths = []
+    for idx in range(cnt):
+        path = str(tmp_path / f'{idx}.png')
+        cv2.imwrite(path, np.full((10, 10, 3), idx, dtype=np.uint8))
+        paths.append(path)
+    return paths
+
+
+def test_frame_cache_lru(tmp_path):
+    paths = write_frames(tmp_path, 3)
+    cache = FrameCache(max_mb=2 * 300 / 1024 / 1024)  # 只能放下两张 10*10*3 的图片
+    cache.get_image(paths[0])
+    cache.get_image(paths[1])
+    cache.get_image(paths[0])  # 0 变成最近使用的
+    cache.get_image(paths[2])  # 淘汰 1
+    assert (cache.stats.hit_cnt, cache.stats.miss_cnt) == (1, 3)
+    cache.get_image(paths[0])
+    cache.get_image(paths[1])
+    assert (cache.stats.hit_cnt, cache.stats.miss_cnt) == (2, 4)
+    assert cache.used_bytes <= cache.max_bytes
+
+
+def test_frame_cache_disabled_and_missing_file(tmp_path):
+    paths = write_frames(tmp_path, 1)
+    cache = FrameCache(max_mb=0)
+    cache.get_image(paths[0])
+    cache.get_image(paths[0])
+    assert cache.stats.hit_cnt == 0
+    assert cache.get_image(str(tmp_path / 'missing.png')) is None
+
+
+def test_scheduled_build_decodes_each_frame_once(tmp_path):
+    frame_cnt = 30
+    paths = write_frames(tmp_path, frame_cnt)
+    for idx in range(frame_cnt):
+        (tmp_path / f'{idx}.txt').write_text('0 0.5 0.5 0.1 0.1\n', encoding='utf-8')
+    jobs = [mosaic_utils.MosaicJob(paths[i], str(tmp_path / f'{i}.txt'), paths[j], str(tmp_path / f'{j}.txt'),
+                                   str(tmp_path / f'out-{k}.png'), str(tmp_path / f'out-{k}.txt'), 32)
+            for k, (i, j) in enumerate(mosaic_utils.draw_random_pairing(frame_cnt, seed=0))]
+
+    cache = FrameCache(max_mb=1)  # 能放下全部原图
+    for trail in mosaic_utils.schedule_cache_local(jobs):
+        for job_idx in trail:
+            assert mosaic_utils.build_mosaic(jobs[job_idx], cache)
+    assert cache.stats.miss_cnt == len({path for job in jobs for path in (job.image1_path, job.image2_path)})
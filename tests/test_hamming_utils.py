@@ -0,0 +1,210 @@
+import imagehash
+import numpy as np
+import pytest
+
+from one_dragon_yolo.devtools import hamming_utils
+from one_dragon_yolo.devtools.hamming_utils import HammingIndex
+
+
+def random_hashes(rng: np.random.Generator, cnt: int) -> np.ndarray:
+    return rng.integers(0, 1 << 63, size=cnt, dtype=np.uint64) * np.uint64(2) + rng.integers(0, 2, size=cnt,
+                                                                                           dtype=np.uint64)
+
+
+def flip_bits(rng: np.random.Generator, hashes: np.ndarray, max_flip: int) -> np.ndarray:
+    """
+    每个哈希随机翻转 0~max_flip 位 得到相近的哈希
+    """
+    result = hashes.copy()
+    for idx in range(len(result)):
+        for bit in rng.choice(64, size=rng.integers(0, max_flip + 1), replace=False).tolist():
+            result[idx] ^= np.uint64(1 << bit)
+    return result
+
+
+def clustered_hashes(seed: int, center_cnt: int = 50, copies: int = 6, max_flip: int = 12) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centers = random_hashes(rng, center_cnt)
+    return flip_bits(rng, np.repeat(centers, copies), max_flip)
+
+
+def brute_force_pairs(query_hashes: np.ndarray, hashes: np.ndarray, alive: np.ndarray, max_distance: int):
+    pairs = []
+    for q, query_hash in enumerate(query_hashes.tolist()):
+        for i, item_hash in enumerate(hashes.tolist()):
+            distance = bin(query_hash ^ item_hash).count('1')
+            if alive[i] and distance <= max_distance:
+                pairs.append((q, i, distance))
+    return pairs
+
+
+def to_pairs(result) -> list:
+    return list(zip(*(arr.tolist() for arr in result)))
+
+
+@pytest.mark.parametrize('max_distance', [0, 3, 7, 10, 20, 40])
+@pytest.mark.parametrize('block_count', [4, 8])
+def test_query_many_matches_brute_force(max_distance: int, block_count: int):
+    hashes = clustered_hashes(seed=max_distance * 10 + block_count)
+    index = HammingIndex(hashes, block_count=block_count)
+    result = index.query_many(hashes, max_distance)
+    assert to_pairs(result) == brute_force_pairs(hashes, hashes, index.alive, max_distance)
+
+
+def test_query_many_skips_removed_items_and_queries():
+    hashes = clustered_hashes(seed=1)
+    index = HammingIndex(hashes)
+    removed = np.arange(0, len(hashes), 3)
+    index.remove(removed)
+    assert len(index) == len(hashes) - len(removed)
+
+    query_alive = np.ones(len(hashes), dtype=bool)
+    query_alive[1::5] = False
+    result = index.query_many(hashes, 8, query_alive=query_alive)
+    expected = [pair for pair in brute_force_pairs(hashes, hashes, index.alive, 8) if query_alive[pair[0]]]
+    assert to_pairs(result) == expected
+
+
+def test_query_single():
+    hashes = clustered_hashes(seed=2, center_cnt=10)
+    index = HammingIndex(hashes)
+    expected = [(i, d) for _, i, d in brute_force_pairs(hashes[3:4], hashes, index.alive, 6)]
+    assert index.query(int(hashes[3]), 6) == expected
+
+
+def test_empty_index():
+    index = HammingIndex(np.zeros(0, dtype=np.uint64))
+    assert len(index) == 0
+    assert index.query(123, 10) == []
+
+
+def test_invalid_block_count():
+    with pytest.raises(ValueError):
+        HammingIndex(np.zeros(1, dtype=np.uint64), block_count=5)
+
+
+def test_small_radius_uses_index():
+    hashes = clustered_hashes(seed=3, center_cnt=500, copies=2, max_flip=2)
+    index = HammingIndex(hashes)
+    result = index.query_many(hashes, 3)
+    assert to_pairs(result) == brute_force_pairs(hashes, hashes, index.alive, 3)
+    assert index.comparison_cnt < len(hashes) * len(hashes) // 10  # 使用了索引 没有两两比较
+
+
+def random_image_hashes(seed: int, cnt: int) -> list:
+    rng = np.random.default_rng(seed)
+    return [imagehash.ImageHash(rng.integers(0, 2, size=(8, 8)).astype(bool)) for _ in range(cnt)]
+
+
+def test_pack_hashes_matches_hash_to_int():
+    hashes = random_image_hashes(seed=0, cnt=50)
+    packed = hamming_utils.pack_hashes(hashes)
+    assert packed.dtype == np.uint64
+    assert packed.tolist() == [hamming_utils.hash_to_int(h) for h in hashes]
+    assert len(hamming_utils.pack_hashes([])) == 0
+
+
+def test_distance_matrix_matches_imagehash():
+    hashes = random_image_hashes(seed=1, cnt=30)
+    packed = hamming_utils.pack_hashes(hashes)
+    distance = hamming_utils.hamming_distance_matrix(packed, packed)
+    expected = np.array([[h1 - h2 for h2 in hashes] for h1 in hashes])
+    assert np.array_equal(distance, expected)
+
+
+def test_popcount_table_matches_bit_count():
+    values = random_hashes(np.random.default_rng(2), 1000)
+    expected = [bin(v).count('1') for v in values.tolist()]
+    assert hamming_utils.popcount64(values).tolist() == expected
+    # 没有 np.bitwise_count 的旧版 numpy 使用查表
+    byte_counts = hamming_utils._POPCOUNT_TABLE[values.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+    assert byte_counts.tolist() == expected
+
+
+def test_distance_blocks_cover_full_matrix():
+    rng = np.random.default_rng(3)
+    hashes1 = random_hashes(rng, 23)
+    hashes2 = random_hashes(rng, 17)
+    full = hamming_utils.hamming_distance_matrix(hashes1, hashes2)
+    assembled = np.full(full.shape, 255, dtype=np.uint8)
+    for row_start, col_start, block in hamming_utils.iter_distance_blocks(hashes1, hashes2, block_size=5):
+        assembled[row_start:row_start + block.shape[0], col_start:col_start + block.shape[1]] = block
+    assert np.array_equal(assembled, full)
+
+
+@pytest.mark.parametrize('threshold', [1.0, 0.95, 0.9, 0.875, 0.85, 0.5, 0.0])
+def test_similarity_threshold_to_distance(threshold: float):
+    max_distance = hamming_utils.similarity_to_max_distance(threshold)
+    # 距离不超过 max_distance 时相似度不低于阈值 再多一位就低于阈值
+    assert hamming_utils.distance_to_similarity(max_distance) >= threshold - 1e-9
+    if max_distance < hamming_utils.HASH_BITS:
+        assert hamming_utils.distance_to_similarity(max_distance + 1) < threshold
+
+
+def brute_force_groups(item_cnt: int, pairs: list) -> list:
+    """
+    反复合并有公共元素的分组 得到连通分量
+    """
+    groups = [{i} for i in range(item_cnt)]
+    for i, j in pairs:
+        group_i = next(g for g in groups if i in g)
+        group_j = next(g for g in groups if j in g)
+        if group_i is not group_j:
+            group_i |= group_j
+            groups.remove(group_j)
+    return sorted(sorted(g) for g in groups if len(g) >= 2)
+
+
+def test_cluster_pairs_matches_connected_components():
+    rng = np.random.default_rng(4)
+    item_cnt = 60
+    pair_i = rng.integers(0, item_cnt, size=40)
+    pair_j = rng.integers(0, item_cnt, size=40)
+    clusters = hamming_utils.cluster_pairs(item_cnt, pair_i, pair_j)
+    assert clusters == brute_force_groups(item_cnt, list(zip(pair_i.tolist(), pair_j.tolist())))
+    # 与相似对的顺序无关
+    order = rng.permutation(len(pair_i))
+    assert hamming_utils.cluster_pairs(item_cnt, pair_j[order], pair_i[order]) == clusters
+
+
+def test_cluster_pairs_empty():
+    assert hamming_utils.cluster_pairs(0, np.zeros(0), np.zeros(0)) == []
+    assert hamming_utils.cluster_pairs(3, np.zeros(0), np.zeros(0)) == []
+
+
+def test_farthest_point_sample_matches_greedy_reference():
+    hashes = clustered_hashes(seed=5, center_cnt=8, copies=5)
+    selected, min_distance = hamming_utils.farthest_point_sample(hashes, 10, start_idx=2)
+
+    distance = hamming_utils.hamming_distance_matrix(hashes, hashes).astype(np.int64)
+    expected = [2]
+    while len(expected) < 10:
+        nearest = distance[:, expected].min(axis=1)
+        nearest[expected] = -1
+        expected.append(int(np.argmax(nearest)))
+    assert selected.tolist() == expected
+    assert min_distance.tolist() == distance[:, expected].min(axis=1).tolist()
+    assert len(set(selected.tolist())) == len(selected)  # 相同的哈希也不会被重复选中
+
+
+def test_farthest_point_sample_more_than_items():
+    hashes = np.zeros(3, dtype=np.uint64)  # 全部相同
+    selected, min_distance = hamming_utils.farthest_point_sample(hashes, 10)
+    assert sorted(selected.tolist()) == [0, 1, 2]
+    assert min_distance.tolist() == [0, 0, 0]
+
+
+@pytest.mark.parametrize('window_size', [1, 3, 10, 100])
+def test_window_min_distance_matches_brute_force(window_size: int):
+    hashes = clustered_hashes(seed=6, center_cnt=10, copies=3)
+    np.random.default_rng(window_size).shuffle(hashes)
+    expected = []
+    for i, hash_value in enumerate(hashes.tolist()):
+        previous = hashes[max(0, i - window_size):i].tolist()
+        expected.append(min((bin(hash_value ^ p).count('1') for p in previous), default=hamming_utils.HASH_BITS))
+    assert hamming_utils.window_min_distance(hashes, window_size).tolist() == expected
+
+
+def test_window_min_distance_short_input():
+    assert hamming_utils.window_min_distance(np.zeros(0, dtype=np.uint64), 5).tolist() == []
+    assert hamming_utils.window_min_distance(np.zeros(1, dtype=np.uint64), 5).tolist() == [hamming_utils.HASH_BITS]
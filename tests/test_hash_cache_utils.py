@@ -0,0 +1,49 @@
+import os
+
+from one_dragon_yolo.devtools.hash_cache_utils import ImageHashCache
+
+
+def write_file(path: str, content: bytes) -> str:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as file:
+        file.write(content)
+    return path
+
+
+def test_hash_persists_and_unsigned_round_trip(tmp_path):
+    image_path = write_file(str(tmp_path / 'a' / '1.png'), b'image')
+    big_hash = (1 << 64) - 3  # 超过 sqlite 有符号整数的范围
+    with ImageHashCache(str(tmp_path)) as cache:
+        cache.put(image_path, big_hash)
+        cache.put(image_path, 7, kind='dhash')
+
+    with ImageHashCache(str(tmp_path)) as cache:
+        assert cache.get(image_path) == big_hash
+        assert cache.get(image_path, kind='dhash') == 7
+        assert cache.get(image_path, kind='ahash') is None
+        assert cache.hit_cnt == 2
+        assert cache.miss_cnt == 1
+
+
+def test_changed_file_invalidates_entry(tmp_path):
+    image_path = write_file(str(tmp_path / '1.png'), b'image')
+    with ImageHashCache(str(tmp_path)) as cache:
+        cache.put(image_path, 123)
+
+    write_file(image_path, b'another image')
+    with ImageHashCache(str(tmp_path)) as cache:
+        assert cache.get(image_path) is None
+
+
+def test_remove_drops_hashes_and_accepted(tmp_path):
+    image_path = write_file(str(tmp_path / 'a' / '1.png'), b'image')
+    with ImageHashCache(str(tmp_path)) as cache:
+        cache.put(image_path, 123)
+        cache.add_accepted([image_path])
+        assert cache.get_accepted() == {'a/1.png'}
+        cache.remove(image_path)
+        assert cache.get(image_path) is None
+
+    with ImageHashCache(str(tmp_path)) as cache:
+        assert cache.get(image_path) is None
+        assert cache.get_accepted() == set()
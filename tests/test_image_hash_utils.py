@@ -0,0 +1,62 @@
+import imagehash
+import numpy as np
+from PIL import Image
+
+from one_dragon_yolo.devtools import hamming_utils, image_hash_utils
+
+
+def make_tiles(seed: int, cnt: int, size: int = image_hash_utils.HASH_TILE_SIZE) -> np.ndarray:
+    """
+    一半是随机噪声 一半是平滑的渐变 后者的低频系数更接近中位数
+    """
+    rng = np.random.default_rng(seed)
+    noise = rng.integers(0, 256, size=(cnt // 2, size, size), dtype=np.uint8)
+    y, x = np.mgrid[0:size, 0:size] / size
+    smooth = []
+    for _ in range(cnt - cnt // 2):
+        a, b, c = rng.uniform(-1, 1, size=3)
+        wave = np.sin(a * 6 * x + b * 6 * y + c * 3)
+        smooth.append(np.clip((wave + 1) * 127.5, 0, 255).astype(np.uint8))
+    return np.concatenate([noise, np.stack(smooth)])
+
+
+def imagehash_phash_int(gray: np.ndarray) -> int:
+    return hamming_utils.hash_to_int(imagehash.phash(Image.fromarray(gray)))
+
+
+def test_phash_batch_bit_identical_to_imagehash():
+    tiles = make_tiles(seed=0, cnt=400)
+    result = image_hash_utils.phash_batch(tiles)
+    assert result.dtype == np.uint64
+    assert result.tolist() == [imagehash_phash_int(tile) for tile in tiles]
+
+
+def test_phash_of_resized_gray_matches_imagehash():
+    # 大图先用 LANCZOS 缩放到 32*32 与 imagehash.phash 的处理一致
+    for gray in make_tiles(seed=1, cnt=20, size=200):
+        tile = image_hash_utils.gray_to_hash_tile(gray)
+        assert int(image_hash_utils.phash_batch(tile[None])[0]) == imagehash_phash_int(gray)
+
+
+def test_batch_hashes_empty_input():
+    empty = np.zeros((0, 32, 32), dtype=np.uint8)
+    for hash_func in (image_hash_utils.ahash_batch, image_hash_utils.dhash_batch, image_hash_utils.phash_batch):
+        assert len(hash_func(empty)) == 0
+
+
+def test_batch_hash_is_per_tile():
+    # 批量计算与逐张计算的结果一致
+    tiles = make_tiles(seed=2, cnt=10)
+    for hash_func in (image_hash_utils.ahash_batch, image_hash_utils.dhash_batch, image_hash_utils.phash_batch):
+        batch = hash_func(tiles).tolist()
+        assert batch == [int(hash_func(tile[None])[0]) for tile in tiles]
+
+
+def test_non_image_files_are_skipped(tmp_path):
+    txt_path = tmp_path / 'notes.txt'
+    txt_path.write_text('not an image')
+    fake_jpg_path = tmp_path / 'broken.jpg'
+    fake_jpg_path.write_bytes(b'not a jpeg')
+    for path in (txt_path, fake_jpg_path):
+        assert image_hash_utils.load_gray_for_hash(str(path)) is None
+        assert image_hash_utils.calculate_phash_file(str(path)) is None
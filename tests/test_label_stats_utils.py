@@ -0,0 +1,64 @@
+import os
+
+import numpy as np
+
+from one_dragon_yolo.devtools import label_stats_utils, label_store_utils
+
+LABELS = {
+    'a': '0 0.5 0.5 0.1 0.2\n0 0.2 0.2 0.3 0.3\n2 0.5 0.5 0.9 0.1\n',
+    'b': '2 0.1 0.1 0.05 0.05\n',
+    'c': '',
+}
+
+
+def write_labels(tmp_path) -> str:
+    labels_dir = tmp_path / 'yolo'
+    labels_dir.mkdir()
+    for data_id, text in LABELS.items():
+        (labels_dir / f'{data_id}.txt').write_text(text, encoding='utf-8')
+    return str(labels_dir)
+
+
+def test_stats_match_per_file_count(tmp_path):
+    labels_dir = write_labels(tmp_path)
+    stats = label_stats_utils.report_label_stats(labels_dir, class_names=['x', 'y', 'z', 'w'],
+                                                 json_path=str(tmp_path / 'stats.json'),
+                                                 csv_path=str(tmp_path / 'stats.csv'))
+
+    # 逐个文件统计作为对照
+    rows = [line.split() for text in LABELS.values() for line in text.splitlines()]
+    assert stats['image_cnt'] == 3
+    assert stats['empty_image_cnt'] == 1
+    assert stats['box_cnt'] == len(rows)
+    classes = {item['class_id']: item for item in stats['classes']}
+    assert len(classes) == 4
+    assert [classes[idx]['boxes'] for idx in range(4)] == [2, 0, 2, 0]
+    assert [classes[idx]['images'] for idx in range(4)] == [1, 0, 2, 0]
+    assert classes[0]['name'] == 'x'
+    assert np.isclose(classes[0]['mean_w'], 0.2)
+    assert np.isclose(classes[2]['mean_h'], 0.075)
+    assert sum(stats['size_hist']) == len(rows)
+    assert sum(stats['aspect_hist']) == len(rows)
+    assert os.path.exists(tmp_path / 'stats.json')
+    assert os.path.exists(tmp_path / 'stats.csv')
+
+
+def test_stats_do_not_write_label_store(tmp_path):
+    labels_dir = write_labels(tmp_path)
+    label_stats_utils.load_labels(labels_dir)
+    assert sorted(os.listdir(labels_dir)) == ['a.txt', 'b.txt', 'c.txt']
+
+    # 已有的汇总文件仍然会被复用
+    label_store_utils.update_label_store(labels_dir)
+    store_path = label_store_utils.get_label_store_path(labels_dir)
+    mtime = os.stat(store_path).st_mtime_ns
+    (tmp_path / 'yolo' / 'b.txt').write_text('1 0.5 0.5 0.5 0.5\n', encoding='utf-8')
+    store = label_stats_utils.load_labels(labels_dir)
+    assert store.get('b')[0, 0] == 1
+    assert os.stat(store_path).st_mtime_ns == mtime
+
+
+def test_find_missing_expected_class(tmp_path):
+    store = label_stats_utils.load_labels(write_labels(tmp_path))
+    expected = np.array([2, 0, -1])  # a 有类别2 b 没有类别0 c 不检查
+    assert label_stats_utils.find_missing_expected_class(store, expected) == ['b']
@@ -0,0 +1,79 @@
+import os
+
+import numpy as np
+
+from one_dragon_yolo.devtools import label_store_utils, yolo_label_utils
+
+
+def write_txt(yolo_dir, data_id: str, text: str, mtime_ns: int = None) -> str:
+    txt_path = os.path.join(str(yolo_dir), f'{data_id}.txt')
+    with open(txt_path, 'w', encoding='utf-8') as file:
+        file.write(text)
+    if mtime_ns is not None:
+        os.utime(txt_path, ns=(mtime_ns, mtime_ns))
+    return txt_path
+
+
+def count_reads(monkeypatch) -> list:
+    """
+    记录重新读取的 txt 文件
+    """
+    read_paths = []
+    original = yolo_label_utils.read_label_txt
+
+    def read_label_txt(txt_path, *args, **kwargs):
+        read_paths.append(os.path.basename(txt_path))
+        return original(txt_path, *args, **kwargs)
+
+    monkeypatch.setattr(yolo_label_utils, 'read_label_txt', read_label_txt)
+    return read_paths
+
+
+def assert_matches_dir(store: label_store_utils.LabelStore, yolo_dir) -> None:
+    expected = yolo_label_utils.read_label_dir(str(yolo_dir))
+    assert sorted(store.data_ids) == sorted(expected.keys())
+    for data_id, labels in expected.items():
+        assert np.array_equal(store.get(data_id), labels)
+
+
+def test_incremental_refresh(tmp_path, monkeypatch):
+    write_txt(tmp_path, 'a', '0 0.5 0.5 0.1 0.1\n', mtime_ns=1_000_000_000)
+    write_txt(tmp_path, 'b', '1 0.2 0.2 0.1 0.1\n2 0.3 0.3 0.1 0.1\n', mtime_ns=1_000_000_000)
+    write_txt(tmp_path, 'c', '', mtime_ns=1_000_000_000)
+    read_paths = count_reads(monkeypatch)
+
+    store = label_store_utils.load_label_store(str(tmp_path))
+    assert sorted(read_paths) == ['a.txt', 'b.txt', 'c.txt']
+    assert os.path.exists(label_store_utils.get_label_store_path(str(tmp_path)))
+    assert_matches_dir(store, tmp_path)
+
+    # 没有变化时不读取任何 txt
+    read_paths.clear()
+    label_store_utils.load_label_store(str(tmp_path))
+    assert read_paths == []
+
+    # 内容变化但大小不变 按修改时间发现变化 删除的文件从汇总中去掉
+    write_txt(tmp_path, 'a', '3 0.5 0.5 0.1 0.1\n', mtime_ns=2_000_000_000)
+    os.remove(os.path.join(str(tmp_path), 'c.txt'))
+    write_txt(tmp_path, 'd', '4 0.6 0.6 0.2 0.2\n')
+    read_paths.clear()
+    store = label_store_utils.load_label_store(str(tmp_path))
+    assert sorted(read_paths) == ['a.txt', 'd.txt']
+    assert 'c' not in store
+    assert_matches_dir(store, tmp_path)
+
+    # 重新打开汇总文件 结果一致
+    reloaded = label_store_utils.load_label_store(str(tmp_path), update=False)
+    assert reloaded.data_ids == store.data_ids
+    assert np.array_equal(reloaded.offsets, store.offsets)
+    assert np.array_equal(reloaded.cls, store.cls)
+
+
+def test_box_data_idx(tmp_path):
+    write_txt(tmp_path, 'a', '0 0.5 0.5 0.1 0.1\n1 0.5 0.5 0.1 0.1\n')
+    write_txt(tmp_path, 'b', '')
+    write_txt(tmp_path, 'c', '2 0.5 0.5 0.1 0.1\n')
+    store = label_store_utils.load_label_store(str(tmp_path))
+    assert store.box_data_idx().tolist() == [0, 0, 2]
+    assert len(store.get('b')) == 0
+    assert store.get('missing') is None
@@ -0,0 +1,112 @@
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+from one_dragon_yolo.devtools import dataset_build_utils, mosaic_utils
+
+
+def make_frame(seed: int, width: int = 64, height: int = 36) -> np.ndarray:
+    return np.random.default_rng(seed).integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+
+
+@pytest.mark.parametrize('image_format', list(mosaic_utils.MOSAIC_IMAGE_FORMATS.keys()))
+def test_save_and_load_formats(tmp_path, image_format: str):
+    img = make_frame(0)
+    save_path = str(tmp_path / ('a' + mosaic_utils.get_image_ext(image_format)))
+    assert mosaic_utils.save_mosaic_image(save_path, img, image_format)
+    loaded = mosaic_utils.load_mosaic_image(save_path)
+    assert loaded.shape == img.shape
+    if image_format != 'jpg':  # 只有 jpg 是有损的
+        assert np.array_equal(loaded, img)
+    assert os.path.exists(str(tmp_path / 'a.npy')) == (image_format == 'npy')
+
+
+def test_unknown_format():
+    with pytest.raises(ValueError):
+        mosaic_utils.get_image_ext('bmp')
+
+
+def test_failed_job_removes_previous_outputs_including_npy(tmp_path):
+    raw_dir, images_dir, labels_dir = (str(tmp_path / name) for name in ('raw', 'images', 'labels'))
+    for dir_path in (raw_dir, images_dir, labels_dir):
+        os.makedirs(dir_path)
+    for idx, data_id in enumerate(['a', 'b']):
+        cv2.imwrite(os.path.join(raw_dir, f'{data_id}.png'), make_frame(idx))
+        with open(os.path.join(raw_dir, f'{data_id}.txt'), 'w', encoding='utf-8') as file:
+            file.write(f'{idx} 0.5 0.5 0.1 0.1\n')
+
+    def build() -> list:
+        manifest, _ = dataset_build_utils.load_manifest(str(tmp_path), {'format': 'npy'})
+        job = mosaic_utils.MosaicJob(
+            os.path.join(raw_dir, 'a.png'), os.path.join(raw_dir, 'a.txt'),
+            os.path.join(raw_dir, 'b.png'), os.path.join(raw_dir, 'b.txt'),
+            os.path.join(images_dir, 'a-b.png'), os.path.join(labels_dir, 'a-b.txt'),
+            96, image_format='npy')
+        image_names = mosaic_utils.run_incremental_mosaic_jobs(manifest, [(('a', 'b'), job)], images_dir, labels_dir)
+        manifest.save(dataset_build_utils.get_manifest_path(str(tmp_path)))
+        return image_names
+
+    assert build() == ['a-b.png']
+    assert sorted(os.listdir(images_dir)) == ['a-b.npy', 'a-b.png']
+
+    # 原图损坏后生成失败 不留下旧的图片、.npy 和标签
+    with open(os.path.join(raw_dir, 'b.png'), 'wb') as file:
+        file.write(b'broken')
+    assert build() == []
+    assert os.listdir(images_dir) == []
+    assert os.listdir(labels_dir) == []
+
+
+def test_compose_mosaic():
+    img1, img2 = make_frame(1), make_frame(2)
+    labels1 = np.array([[0, 0.5, 0.5, 0.25, 0.25]], dtype=np.float32)
+    labels2 = np.zeros((0, 5), dtype=np.float32)
+    mosaic, labels = mosaic_utils.compose_mosaic(img1, labels1, img2, labels2, 96)
+    assert mosaic.shape == (96, 96, 3)
+    assert np.array_equal(mosaic[:36, :64], img1)
+    assert np.array_equal(mosaic[36:72, :64], img2)
+    assert (mosaic[72:] == mosaic_utils.MOSAIC_FILL_VALUE).all()
+    assert (mosaic[:, 64:] == mosaic_utils.MOSAIC_FILL_VALUE).all()
+    assert np.allclose(labels, [[0, 32 / 96, 18 / 96, 16 / 96, 9 / 96]])
+
+
+def test_random_pairing_is_reproducible():
+    assert mosaic_utils.draw_random_pairing(50, seed=3) == mosaic_utils.draw_random_pairing(50, seed=3)
+    assert [idx for idx, _ in mosaic_utils.draw_random_pairing(50, seed=3)] == list(range(50))
+
+
+def make_jobs(tmp_path, frame_cnt: int, pairing: list) -> list:
+    raw_dir = tmp_path / 'raw'
+    out_dir = tmp_path / 'out'
+    raw_dir.mkdir(exist_ok=True)
+    out_dir.mkdir(exist_ok=True)
+    for idx in range(frame_cnt):
+        cv2.imwrite(str(raw_dir / f'{idx}.png'), make_frame(idx))
+        (raw_dir / f'{idx}.txt').write_text(f'{idx} 0.5 0.5 0.1 0.1\n', encoding='utf-8')
+    return [mosaic_utils.MosaicJob(
+        str(raw_dir / f'{idx1}.png'), str(raw_dir / f'{idx1}.txt'),
+        str(raw_dir / f'{idx2}.png'), str(raw_dir / f'{idx2}.txt'),
+        str(out_dir / f'{job_idx}-{idx1}-{idx2}.png'), str(out_dir / f'{job_idx}-{idx1}-{idx2}.txt'),
+        96,
+    ) for job_idx, (idx1, idx2) in enumerate(pairing)]
+
+
+def read_outputs(jobs: list) -> list:
+    result = []
+    for job in jobs:
+        with open(job.save_label_path, encoding='utf-8') as file:
+            result.append((cv2.imread(job.save_image_path).tobytes(), file.read()))
+    return result
+
+
+def test_parallel_build_matches_serial(tmp_path):
+    pairing = mosaic_utils.draw_random_pairing(12, seed=0)
+    jobs = make_jobs(tmp_path, 12, pairing)
+    assert mosaic_utils.run_mosaic_jobs(jobs, num_workers=1) == [True] * len(jobs)
+    serial = read_outputs(jobs)
+    for job in jobs:
+        os.remove(job.save_image_path)
+    assert mosaic_utils.run_mosaic_jobs(jobs, num_workers=3, chunk_size=4) == [True] * len(jobs)
+    assert read_outputs(jobs) == serial
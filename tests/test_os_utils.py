@@ -0,0 +1,96 @@
+import errno
+import os
+
+import pytest
+
+from one_dragon_yolo.devtools import os_utils
+from one_dragon_yolo.devtools.os_utils import FileMaterializer
+
+
+def make_src(tmp_path, name: str = 'src.png', content: bytes = b'image') -> str:
+    path = str(tmp_path / name)
+    with open(path, 'wb') as file:
+        file.write(content)
+    return path
+
+
+def raise_errno(err: int):
+    def _raise(*args, **kwargs):
+        raise OSError(err, os.strerror(err))
+    return _raise
+
+
+def test_hardlink_shares_data(tmp_path):
+    src = make_src(tmp_path)
+    dst = str(tmp_path / 'dst.png')
+    materializer = FileMaterializer('hardlink')
+    assert materializer.materialize(src, dst) == 'hardlink'
+    assert os.path.samefile(src, dst)
+    assert materializer.counts == {'hardlink': 1}
+
+
+@pytest.mark.parametrize('err', [errno.EXDEV, errno.EPERM])
+def test_hardlink_falls_back_to_copy(tmp_path, monkeypatch, err: int):
+    src = make_src(tmp_path)
+    monkeypatch.setattr(os_utils.os, 'link', raise_errno(err))
+    monkeypatch.setattr(os_utils, '_reflink', raise_errno(errno.EOPNOTSUPP))
+    materializer = FileMaterializer('hardlink')
+    dst = str(tmp_path / 'dst.png')
+    assert materializer.materialize(src, dst) == 'copy'
+    assert not os.path.samefile(src, dst)
+    with open(dst, 'rb') as file:
+        assert file.read() == b'image'
+
+
+def test_hardlink_falls_back_to_reflink(tmp_path, monkeypatch):
+    src = make_src(tmp_path)
+    monkeypatch.setattr(os_utils.os, 'link', raise_errno(errno.EXDEV))
+    monkeypatch.setattr(os_utils, '_reflink', lambda s, d: os_utils.shutil.copyfile(s, d))
+    assert FileMaterializer('hardlink').materialize(src, str(tmp_path / 'dst.png')) == 'reflink'
+
+
+def test_unsupported_method_is_not_retried(tmp_path, monkeypatch):
+    link_calls = []
+
+    def fake_link(src, dst):
+        link_calls.append(dst)
+        raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+
+    monkeypatch.setattr(os_utils.os, 'link', fake_link)
+    monkeypatch.setattr(os_utils, '_reflink', raise_errno(errno.EOPNOTSUPP))
+    materializer = FileMaterializer('hardlink')
+    for idx in range(3):
+        src = make_src(tmp_path, f'src-{idx}.png')
+        materializer.materialize(src, str(tmp_path / f'dst-{idx}.png'))
+    # 同一对设备上 失败过的方式不再尝试
+    assert len(link_calls) == 1
+    assert materializer.counts == {'copy': 3}
+    assert materializer.summary() == 'copy 3'
+
+
+def test_symlink_falls_back_to_copy(tmp_path, monkeypatch):
+    src = make_src(tmp_path)
+    dst = str(tmp_path / 'dst.png')
+    assert FileMaterializer('symlink').materialize(src, dst) == 'symlink'
+    assert os.path.islink(dst)
+
+    # Windows 上没有权限创建软链接
+    monkeypatch.setattr(os_utils.os, 'symlink', raise_errno(errno.EPERM))
+    assert FileMaterializer('symlink').materialize(src, dst) == 'copy'
+    assert not os.path.islink(dst)
+
+
+def test_replace_existing_and_unexpected_error(tmp_path, monkeypatch):
+    src = make_src(tmp_path, content=b'new')
+    dst = make_src(tmp_path, 'dst.png', content=b'old')
+    FileMaterializer('copy').materialize(src, dst)
+    with open(dst, 'rb') as file:
+        assert file.read() == b'new'
+
+    # 不是文件系统不支持的错误 直接抛出
+    monkeypatch.setattr(os_utils.os, 'link', raise_errno(errno.ENOSPC))
+    with pytest.raises(OSError):
+        FileMaterializer('hardlink').materialize(src, dst)
+
+    with pytest.raises(ValueError):
+        FileMaterializer('move')
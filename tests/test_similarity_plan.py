@@ -0,0 +1,81 @@
+import cv2
+import numpy as np
+import pytest
+
+from one_dragon_yolo.devtools import hamming_utils
+from one_dragon_yolo.gui.similarity_processor import (ImageSimilarityProcessor, MODE_CROSS_FOLDER,
+                                                      MODE_WITHIN_FOLDER)
+
+
+def brute_force_merge_counts(item_cnt: int, pairs: list, max_distance: int) -> list:
+    counts = []
+    for d in range(max_distance + 1):
+        clusters = hamming_utils.cluster_pairs(
+            item_cnt, np.array([i for i, _, dist in pairs if dist <= d], dtype=np.int64),
+            np.array([j for _, j, dist in pairs if dist <= d], dtype=np.int64))
+        counts.append(sum(len(cluster) - 1 for cluster in clusters))
+    return counts
+
+
+def test_merge_counts_by_distance_matches_clustering():
+    rng = np.random.default_rng(0)
+    item_cnt = 80
+    pairs = [(int(i), int(j), int(d)) for i, j, d in zip(rng.integers(0, item_cnt, 120),
+                                                          rng.integers(0, item_cnt, 120),
+                                                          rng.integers(0, 17, 120))]
+    pair_i, pair_j, distance = (np.array(column) for column in zip(*pairs))
+    counts = hamming_utils.merge_counts_by_distance(item_cnt, pair_i, pair_j, distance, 16)
+    assert counts.tolist() == brute_force_merge_counts(item_cnt, pairs, 16)
+
+
+@pytest.fixture(scope='module')
+def image_tree(tmp_path_factory) -> str:
+    """
+    几个文件夹 每张基础图片在多个文件夹中有不同程度加噪的副本 汉明距离分布在预览范围内
+    """
+    root = tmp_path_factory.mktemp('similarity')
+    rng = np.random.default_rng(1)
+    bases = [rng.uniform(0, 255, size=(8, 8)) for _ in range(12)]
+    for folder_idx, copy_cnt in enumerate([3, 5, 8]):
+        folder = root / f'folder_{folder_idx}'
+        folder.mkdir()
+        for image_idx in range(copy_cnt * 3):
+            base = bases[(image_idx * (folder_idx + 1)) % len(bases)]
+            # 在低频上加噪 噪声越大汉明距离越大
+            noisy = np.clip(base + rng.normal(scale=rng.uniform(0, 50), size=base.shape), 0, 255)
+            image = cv2.resize(noisy.astype(np.uint8), (128, 128), interpolation=cv2.INTER_CUBIC)
+            cv2.imwrite(str(folder / f'{image_idx:03d}.png'), image)
+    return str(root)
+
+
+def direct_run(root: str, mode: str, threshold: float) -> list:
+    processor = ImageSimilarityProcessor(similarity_threshold=threshold, use_hash_cache=False, dry_run=True)
+    if mode == MODE_CROSS_FOLDER:
+        result = processor.process_cross_folder_similarity(root)
+    else:
+        result = processor.process_within_folder_similarity(root)
+    return sorted(result['deleted_file_paths'])
+
+
+@pytest.mark.parametrize('mode', [MODE_CROSS_FOLDER, MODE_WITHIN_FOLDER])
+def test_plan_matches_direct_run(image_tree: str, mode: str):
+    plan = ImageSimilarityProcessor(use_hash_cache=False, dry_run=True).build_plan(image_tree, mode)
+    assert plan is not None
+    assert plan.histogram().sum() == len(plan.distance)
+
+    deleted_any = False
+    for threshold in [0.95, 0.9, 0.85, 0.8, 0.75]:
+        expected = direct_run(image_tree, mode, threshold)
+        deleted_any = deleted_any or len(expected) > 0
+        assert plan.count_deletions(threshold) == len(expected)
+
+        processor = ImageSimilarityProcessor(similarity_threshold=threshold, use_hash_cache=False, dry_run=True)
+        result = processor.commit_plan(plan)
+        assert sorted(result['deleted_file_paths']) == expected
+    assert deleted_any  # 测试数据中需要有相似的图片
+
+
+def test_plan_rejects_threshold_below_range(image_tree: str):
+    plan = ImageSimilarityProcessor(use_hash_cache=False).build_plan(image_tree, MODE_WITHIN_FOLDER, max_distance=4)
+    with pytest.raises(ValueError):
+        plan.count_deletions(0.8)
@@ -0,0 +1,41 @@
+import json
+
+import pytest
+
+from one_dragon_yolo.devtools import x_anylabeling_utils
+
+LABELS = ['0000-感叹号', '0001-敌人']
+TXT_LINE = '1 0.773914433084428 0.273859746754169 0.026951028034091 0.046918287873268'
+
+
+def expected_points(line: str, width: int = 1920, height: int = 1080) -> list:
+    _, cx, cy, w, h = [float(x) for x in line.split()]
+    x1, x2 = cx * width - w * width / 2, cx * width + w * width / 2
+    y1, y2 = cy * height - h * height / 2, cy * height + h * height / 2
+    return [[x1, y1], [x2, y1], [x2, y2], [x1, y2]]
+
+
+@pytest.mark.parametrize('use_label_store', [False, True])
+def test_convert_yolo_2_x(tmp_path, use_label_store: bool):
+    yolo_dir = tmp_path / 'yolo'
+    json_dir = tmp_path / 'json'
+    yolo_dir.mkdir()
+    json_dir.mkdir()
+    (yolo_dir / 'a.txt').write_text(TXT_LINE + '\n', encoding='utf-8')
+    (yolo_dir / 'b.txt').write_text('', encoding='utf-8')
+
+    x_anylabeling_utils.convert_yolo_2_x(str(yolo_dir), str(json_dir), LABELS, use_label_store=use_label_store)
+
+    data = json.loads((json_dir / 'a.json').read_text(encoding='utf-8'))
+    assert data['imagePath'] == 'a.png'
+    assert len(data['shapes']) == 1
+    shape = data['shapes'][0]
+    assert shape['label'] == LABELS[1]
+    if use_label_store:  # 汇总中是 float32
+        flat = [value for point in shape['points'] for value in point]
+        assert flat == pytest.approx([value for point in expected_points(TXT_LINE) for value in point], abs=1e-3)
+    else:  # 与直接读取 txt 的结果完全一致
+        assert shape['points'] == expected_points(TXT_LINE)
+
+    empty = json.loads((json_dir / 'b.json').read_text(encoding='utf-8'))
+    assert empty['shapes'] == []
@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+from one_dragon_yolo.devtools import yolo_label_utils
+
+
+def test_parse_labels():
+    labels = yolo_label_utils.parse_labels('0 0.5 0.5 0.1 0.2\n\n3 0.25 0.75 0.05 0.05\n')
+    assert labels.dtype == np.float32
+    assert np.allclose(labels, [[0, 0.5, 0.5, 0.1, 0.2], [3, 0.25, 0.75, 0.05, 0.05]])
+    assert yolo_label_utils.parse_labels('').shape == (0, 5)
+    with pytest.raises(ValueError):
+        yolo_label_utils.parse_labels('0 0.5 0.5 0.1\n')
+
+
+def test_write_and_read_round_trip(tmp_path):
+    labels = np.array([[1, 0.123456, 0.5, 0.25, 0.125], [0, 0.9, 0.1, 0.01, 0.02]], dtype=np.float32)
+    txt_path = str(tmp_path / 'a.txt')
+    yolo_label_utils.write_label_txt(txt_path, labels)
+    assert open(txt_path, encoding='utf-8').readline() == '1 0.123456 0.500000 0.250000 0.125000\n'
+    assert np.allclose(yolo_label_utils.read_label_txt(txt_path), labels, atol=1e-6)
+    assert list(yolo_label_utils.read_label_dir(str(tmp_path)).keys()) == ['a']
+
+
+def test_remap_classes_drops_unmapped():
+    labels = np.array([[0, 0.1, 0.1, 0.1, 0.1], [2, 0.2, 0.2, 0.2, 0.2], [5, 0.3, 0.3, 0.3, 0.3]],
+                      dtype=np.float32)
+    result = yolo_label_utils.remap_classes(labels, {2: 0, 5: 1})
+    assert result[:, 0].tolist() == [0, 1]
+    assert result[:, 1].tolist() == pytest.approx([0.2, 0.3])
+    assert labels[1, 0] == 2  # 不修改传入的数组
+
+
+def test_merge_vertical_labels():
+    top = np.array([[0, 0.5, 0.5, 0.1, 0.1]], dtype=np.float32)
+    bottom = np.array([[1, 0.5, 0.5, 0.1, 0.1]], dtype=np.float32)
+    merged = yolo_label_utils.merge_vertical_labels(top, bottom, 1920, 1080, 2176)
+    assert merged[:, 0].tolist() == [0, 1]
+    assert merged[0, 1:].tolist() == pytest.approx([960 / 2176, 540 / 2176, 192 / 2176, 108 / 2176])
+    assert merged[1, 2] == pytest.approx((1080 + 540) / 2176)
+
+
+def test_float64_keeps_txt_precision():
+    text = '0 0.773914433084428 0.273859746754169 0.026951028034091 0.046918287873268\n'
+    labels = yolo_label_utils.parse_labels(text, dtype=np.float64)
+    assert labels[0].tolist() == [float(x) for x in text.split()]